@@ -6,13 +6,46 @@ import numpy as np
 import os
 from pdf2image import convert_from_path
 from PIL import Image
+import argparse
+import asyncio
+import contextvars
+import inspect
 import json
+import re
 import multiprocessing
+import queue
+import tempfile
+import threading
+import time
 from functools import partial
-from langchain_community.chat_models.openai import ChatOpenAI
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
 import logging
 import utils
+import sbe_type_inference
+import repeating_group_detector
+import ocr_text_chunker
+import ai_output_validator
+import page_text_deduplicator
+import table_stitcher
+from ai_model_usage import (
+    ai_model_usage, estimate_tokens, estimate_tokens_from_length, get_run_usage, track_run_usage
+)
+from dag_scheduler import DagScheduler
+from metrics_registry import (
+    metrics_registry, start_metrics_server, pages_processed_counter, stage_duration_histogram, stage_errors_counter,
+    ai_model_calls_counter, ai_model_input_tokens_counter, ai_model_output_tokens_counter, cache_lookups_counter
+)
+from stage_pipeline_runner import PipelineStage, StagePipelineRunner
+from stage_checkpoint_store import StageCheckpointStore, get_file_hash, get_input_hash
+import stage_result
+import stage_memory_profiler
+import stage_tracer
+from stage_result import StageResult
+from streaming_json_parser import JsonArrayStreamParser
+from fix_tag_knowledge_base import FixTagKnowledgeBase
+from field_similarity_index import FieldSimilarityIndex, track_run_statistics
+from ai_model_client import AIModelClient, is_transient_error
 
 from ai_model_handler import AIModelHandler
 
@@ -20,6 +53,46 @@ from ai_model_handler import AIModelHandler
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# set while process_async runs: model requests made from its worker threads are sent on its event loop
+ai_model_event_loop = contextvars.ContextVar("ai_model_event_loop", default=None)
+ai_model_handler = None
+ai_model_handler_lock = threading.Lock()
+empty_ocr_output = {"text_tables": [], "table_geometries": []}
+run_lock_file_name = "run.lock"
+# the local SBE typing caches, read on first use from the paths in utils
+fix_tag_knowledge_base = None
+field_similarity_index = None
+local_caches_lock = threading.Lock()
+ai_model_client = AIModelClient(
+    requests_per_minute=utils.ai_model_requests_per_minute,
+    tokens_per_minute=utils.ai_model_tokens_per_minute
+)
+
+
+def get_ai_model_handler():
+    # the layout and OCR models are loaded once per process, not once per page
+    global ai_model_handler
+    with ai_model_handler_lock:
+        if ai_model_handler is None:
+            ai_model_handler = AIModelHandler()
+        return ai_model_handler
+
+
+def initialize_page_worker(worker_metrics_directory, is_loading_models=True):
+    metrics_registry.start_worker_export(worker_metrics_directory)
+    if is_loading_models:
+        get_ai_model_handler()
+
+
+def create_page_process_pool(number_page_workers, is_loading_models=True):
+    # spawned rather than forked: the models must not be inherited half-initialised from the parent
+    return ProcessPoolExecutor(
+        max_workers=number_page_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=initialize_page_worker,
+        initargs=(metrics_registry.get_worker_metrics_directory(), is_loading_models)
+    )
+
 
 def convert_pdf_pages_to_jpg(pdf_path, starting_page, ending_page, folder_path):
     try:
@@ -42,6 +115,19 @@ def convert_pdf_pages_to_jpg(pdf_path, starting_page, ending_page, folder_path):
         print(f"Error during PDF to JPEG conversion: {e}")
 
 
+def rasterize_pdf_page(pdf_path, folder_path, page_number):
+    utils.create_directory_if_not_exists(folder_path)
+    image = convert_from_path(pdf_path, first_page=page_number, last_page=page_number)[0]
+    stage_tracer.set_span_attributes(page_number=page_number, image_width=image.width, image_height=image.height)
+    image_path = os.path.join(folder_path, f"page_{page_number}.jpg")
+    image.save(image_path, 'JPEG')
+    return image_path
+
+
+def preprocess_page_image(image_path):
+    return thresholding(increase_contrast(convert_grayscale(image_path)))
+
+
 def convert_grayscale(image_path):
     try:
         image = cv2.imread(image_path)
@@ -50,6 +136,7 @@ def convert_grayscale(image_path):
 
         image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
         image_gray = cv2.cvtColor(image_rgb, cv2.COLOR_RGB2GRAY)
+        stage_tracer.set_span_attributes(image_width=image_gray.shape[1], image_height=image_gray.shape[0])
 
         return {
             "image_path": image_path,
@@ -111,20 +198,12 @@ def detect_tables(output_previous_function):
     image = output_previous_function["image"]
     image_rgb = cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
 
-    detectron2_model = lp.Detectron2LayoutModel(
-        config_path='config.yaml',
-        extra_config=["MODEL.ROI_HEADS.SCORE_THRESH_TEST", 0.65],
-        label_map={
-            0: "Text",
-            1: "Title",
-            2: "List",
-            3: "Table",
-            4: "Figure"
-        }
-    )
-
-    layout = detectron2_model.detect(image_rgb)
+    layout = get_ai_model_handler().use_detectron2(image_rgb)
     layout_tables = lp.Layout([element for element in layout if element.type == 'Table'])
+    stage_tracer.set_span_attributes(table_count=len(layout_tables))
+    if len(layout_tables) == 0:
+        # nothing for OCR and the AI model to do on this page
+        return StageResult.empty("detect_tables", "no Table element detected")
 
     return {
         "image": image,
@@ -137,7 +216,9 @@ def ocr_tables(output_previous_function):
     image = output_previous_function["image"]
     layout_tables = output_previous_function["layout_tables"]
 
-    tesseract_model = lp.TesseractAgent(languages='eng')
+    # top to bottom, so that the last table of a page can be continued by the first table of the next one
+    layout_tables = lp.Layout(sorted(layout_tables, key=lambda table: table.coordinates[1]))
+    array_table_geometries = []
 
     for table in layout_tables:
         image_cropped = (
@@ -146,17 +227,86 @@ def ocr_tables(output_previous_function):
             .crop_image(image)
         )
 
-        text = tesseract_model.detect(image_cropped)
+        text = get_ai_model_handler().use_tesseract(image_cropped)
         table.set(text=text, inplace=True)
+        array_table_geometries.append(get_table_geometry(table, image, image_cropped))
+
+    text_tables = layout_tables.get_texts()
+    stage_tracer.set_span_attributes(
+        table_count=len(text_tables),
+        text_characters=sum(len(text_table) for text_table in text_tables)
+    )
+    if not any(text_table.strip() for text_table in text_tables):
+        return StageResult.empty("ocr_tables", "no text recognized in the tables")
+
+    return {
+        "text_tables": text_tables,
+        "table_geometries": array_table_geometries
+    }
+
 
+def get_table_geometry(table, image, image_cropped):
+    image_height, image_width = image.shape[:2]
+    x_1, y_1, x_2, y_2 = table.coordinates
+
+    # plain floats: the geometries are checkpointed as JSON with the OCR text
     return {
-        "text_tables": layout_tables.get_texts()
+        "x_1": float(x_1) / image_width,
+        "y_1": float(y_1) / image_height,
+        "x_2": float(x_2) / image_width,
+        "y_2": float(y_2) / image_height,
+        "column_positions": get_table_column_positions(image_cropped)
     }
 
 
+def get_table_column_positions(image_cropped, min_line_ratio=0.6):
+    height, width = image_cropped.shape[:2]
+    if height == 0 or width == 0:
+        return []
+
+    # vertical rulings are the dark runs that survive an opening with a tall kernel
+    _, image_inverted = cv2.threshold(image_cropped, 127, 255, cv2.THRESH_BINARY_INV)
+    vertical_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (1, max(height // 10, 1)))
+    image_vertical_lines = cv2.morphologyEx(image_inverted, cv2.MORPH_OPEN, vertical_kernel)
+
+    column_coverage = np.count_nonzero(image_vertical_lines, axis=0) / height
+    array_line_groups = []
+    for x in np.flatnonzero(column_coverage >= min_line_ratio):
+        if array_line_groups and x - array_line_groups[-1][-1] <= 2:
+            array_line_groups[-1].append(x)
+        else:
+            array_line_groups.append([x])
+
+    return [round(float(np.mean(line_group)) / width, 4) for line_group in array_line_groups]
+
+
 def generate_document_fields(output_previous_function):
     text_tables = output_previous_function["text_tables"]
+    column_header = output_previous_function.get("column_header")
+
+    array_chunks = ocr_text_chunker.chunk_text_tables(text_tables)
+    array_chunk_texts = [chunk["text"] for chunk in array_chunks]
+    if column_header:
+        array_chunk_texts = [f"{column_header}\n{chunk_text}" for chunk_text in array_chunk_texts]
+    if len(array_chunk_texts) <= 1:
+        yield from stream_document_fields_from_ai_model(array_chunk_texts)
+        return
+
+    logger.info(f"OCR text split into {len(array_chunk_texts)} row-aligned chunks")
+
+    context = contextvars.copy_context()
+    with ThreadPoolExecutor(max_workers=len(array_chunk_texts)) as executor:
+        # the chunks are requested together, their fields are passed on in order as soon as each chunk is done
+        yield from ocr_text_chunker.stitch_document_fields(
+            executor.map(
+                lambda chunk_text: context.copy().run(lambda: list(stream_document_fields_from_ai_model([chunk_text]))),
+                array_chunk_texts
+            ),
+            [chunk["overlap_field_ids"] for chunk in array_chunks]
+        )
+
 
+def stream_document_fields_from_ai_model(text_tables, resume_attempts=2, repair_attempts=1):
     system_message = """
 Sei un esperto in sistemi di trading elettronico con una conoscenza approfondita dei protocolli FIX e SBE. Ti verra fornita in input una trascrizione grezza ottenuta tramite OCR di una tabella che rappresenta i campi di un messaggio FIX o SBE. La tua missione e ricostruire la tabella step by step seguendo i seguenti passaggi:
 1. Definire quali sono le colonne della tabella.
@@ -619,85 +769,310 @@ exclusive with (1616, 1547) and 1545.
     ### OUTPUT JSON ###
         """
 
-    # ai_model = ChatOpenAI(
-    #     openai_api_key=utils.openai_api_key,
-    #     model=utils.ai_model_name,
-    #     temperature=0,
-    #     top_p=0
-    # )
-    #
-    # json_array_document_fields = ai_model([
-    #     SystemMessage(content=utils.replace_newlines_with_space(system_message)),
-    #     HumanMessage(content=example_1_human_message),
-    #     AIMessage(content=example_1_assistant_message),
-    #     HumanMessage(content=example_2_human_message),
-    #     AIMessage(content=example_2_assistant_message),
-    #     HumanMessage(content=example_3_human_message),
-    #     AIMessage(content=example_3_assistant_message),
-    #     HumanMessage(content=utils.replace_newlines_with_space(human_message))
-    # ])
-    #
-    # data = json.loads(json_array_document_fields.content)
-    #
-    # with open('document_fields_output.json', 'w') as file:
-    #     json.dump(data, file, indent=4)
-    #
-    # return json.loads(json_array_document_fields.content)
-
-    with open('document_fields.json', 'r') as file:
-        data = json.load(file)
-
-    return data
+    ai_model_usage.record_call("generate_document_fields", human_message)
+
+    array_messages = [
+        SystemMessage(content=utils.replace_newlines_with_space(system_message)),
+        HumanMessage(content=example_1_human_message),
+        AIMessage(content=example_1_assistant_message),
+        HumanMessage(content=example_2_human_message),
+        AIMessage(content=example_2_assistant_message),
+        HumanMessage(content=example_3_human_message),
+        AIMessage(content=example_3_assistant_message),
+        HumanMessage(content=utils.replace_newlines_with_space(human_message))
+    ]
+
+    parser = JsonArrayStreamParser()
+    last_field_id = None
+    number_document_fields = 0
+    array_invalid_objects = []
+    for json_object in parser.iterate(
+            stream_ai_model_response(array_messages, 'document_fields.json', stage_name="generate_document_fields")
+    ):
+        document_field, array_errors = ai_output_validator.validate_document_field(json_object)
+        if array_errors:
+            array_invalid_objects.append({"json_object": json_object, "errors": array_errors})
+            continue
+        last_field_id = utils.get_document_field_id(document_field)
+        number_document_fields = number_document_fields + 1
+        yield document_field
+
+    invalid_field_ids = log_stage_output_validation(
+        "generate_document_fields",
+        number_document_fields,
+        array_invalid_objects,
+        parser.array_unparsable_objects
+    )
+    if invalid_field_ids and repair_attempts > 0:
+        yield from stream_document_fields_from_ai_model(
+            ocr_text_chunker.get_text_table_rows(text_tables, invalid_field_ids),
+            resume_attempts,
+            repair_attempts - 1
+        )
+
+    if not parser.is_complete:
+        # what was parsed is already downstream: ask only for the rows after the last complete field
+        logger.warning(f"AI model answer truncated after {number_document_fields} fields")
+        remaining_text_tables = ocr_text_chunker.get_text_tables_after_field(text_tables, last_field_id)
+        if remaining_text_tables and resume_attempts > 0:
+            yield from stream_document_fields_from_ai_model(remaining_text_tables, resume_attempts - 1, repair_attempts)
+
+
+def log_stage_output_validation(stage_name, number_valid_objects, array_invalid_objects, array_unparsable_objects):
+    if not array_invalid_objects and not array_unparsable_objects:
+        return set()
+
+    for invalid_object in array_invalid_objects:
+        logger.warning(f"{stage_name}: invalid output {invalid_object['json_object']}: {invalid_object['errors']}")
+    for object_text in array_unparsable_objects:
+        logger.warning(f"{stage_name}: unparsable output {object_text!r}")
+
+    # only the rows that can be named again are worth a second request
+    invalid_field_ids = {
+        ai_output_validator.get_object_text_field_id(json.dumps(invalid_object["json_object"], ensure_ascii=False))
+        for invalid_object in array_invalid_objects
+    } | {ai_output_validator.get_object_text_field_id(object_text) for object_text in array_unparsable_objects}
+    invalid_field_ids.discard(None)
+
+    logger.info(
+        f"{stage_name}: {number_valid_objects} valid objects, {len(array_invalid_objects)} invalid, "
+        f"{len(array_unparsable_objects)} unparsable, {len(invalid_field_ids)} rows to request again"
+    )
+    return invalid_field_ids
 
 
 def generate_sbe_message_components(json_array_document_fields_pages):
-    json_array_repeating_groups = []
+    scheduler = DagScheduler()
+
+    array_page_task_names = []
+    for page_index, json_array_document_fields_page in enumerate(json_array_document_fields_pages):
+        array_page_task_names.append(scheduler.add_task(
+            f"document_fields_page_{page_index}",
+            lambda json_array_document_fields_page=json_array_document_fields_page: json_array_document_fields_page
+        ))
+
+    sbe_message_components_task_name = schedule_sbe_message_components(scheduler, array_page_task_names)
+
+    sbe_message_components = scheduler.run()[sbe_message_components_task_name]
+    save_local_caches()
+    return sbe_message_components
+
+
+def schedule_sbe_message_components(scheduler, array_page_task_names, array_stitching_task_names=None,
+                                    checkpoint_store=None, array_sbe_fields_task_names=None):
+    # the calls of other runs of the process are not counted
+    usage_snapshot = get_run_usage().get_snapshot()
+
+    # pages typed while their fields were extracted bring their own SBE fields tasks
+    is_sbe_fields_scheduled = array_sbe_fields_task_names is None
+    if is_sbe_fields_scheduled:
+        array_sbe_fields_task_names = []
+    array_repeating_groups_task_names = []
+
+    for page_index, page_task_name in enumerate(array_page_task_names):
+        sbe_fields_task_name = f"sbe_fields_{page_task_name}"
+        if is_sbe_fields_scheduled:
+            array_sbe_fields_task_names.append(scheduler.add_task(
+                sbe_fields_task_name,
+                get_checkpointed_task(
+                    checkpoint_store,
+                    sbe_fields_task_name,
+                    generate_page_sbe_fields,
+                    get_ai_model_input_key()
+                ),
+                [page_task_name]
+            ))
+
+        # groups starting on a page may end on the next one: the detection waits for both pages
+        array_adjacent_page_task_names = array_page_task_names[page_index:page_index + 2]
+        repeating_groups_task_name = f"repeating_groups_{'_'.join(array_adjacent_page_task_names)}"
+        if array_stitching_task_names is not None and len(array_adjacent_page_task_names) == 2:
+            array_repeating_groups_task_names.append(scheduler.add_task(
+                repeating_groups_task_name,
+                get_checkpointed_task(
+                    checkpoint_store,
+                    repeating_groups_task_name,
+                    detect_stitched_page_repeating_groups,
+                    get_ai_model_input_key()
+                ),
+                array_adjacent_page_task_names + [array_stitching_task_names[page_index + 1]]
+            ))
+            continue
+        array_repeating_groups_task_names.append(scheduler.add_task(
+            repeating_groups_task_name,
+            get_checkpointed_task(
+                checkpoint_store,
+                repeating_groups_task_name,
+                detect_page_repeating_groups,
+                get_ai_model_input_key()
+            ),
+            array_adjacent_page_task_names
+        ))
+
+    number_pages = len(array_page_task_names)
+    # groups still open at the end of their two pages are closed here, where the table breaks are known
+    array_table_break_task_names = [] if array_stitching_task_names is None else array_stitching_task_names[1:]
+
+    def build_sbe_message_components(*task_results):
+        json_array_document_fields_pages = [
+            get_stage_output(page_task_result, []) for page_task_result in task_results[:number_pages]
+        ]
+        json_array_sbe_fields = [
+            sbe_field
+            for json_array_sbe_fields_page in task_results[number_pages:2 * number_pages]
+            for sbe_field in json_array_sbe_fields_page
+        ]
+        array_repeating_groups_task_results = task_results[2 * number_pages:3 * number_pages]
+        array_is_page_continued = None
+        if array_table_break_task_names:
+            array_is_page_continued = [False] + [
+                stitched_text["continues_previous_page"] for stitched_text in task_results[3 * number_pages:]
+            ]
+        json_array_repeating_groups = repeating_group_detector.close_open_repeating_groups(
+            repeating_group_detector.merge_repeating_groups(array_repeating_groups_task_results),
+            json_array_document_fields_pages,
+            array_is_page_continued
+        )
 
-    for i in range(len(json_array_document_fields_pages) - 1):
-        current_json_array_document_fields_page = json_array_document_fields_pages[i]
-        next_json_array_document_fields_page = json_array_document_fields_pages[i + 1]
-        json_array_document_fields_of_adjacent_pages = current_json_array_document_fields_page + next_json_array_document_fields_page
-        print(f"- {i} {i + 1} #")
+        sbe_message_components = assemble_sbe_message_components(json_array_sbe_fields, json_array_repeating_groups)
 
-        partial_json_array_repeating_groups = generate_repeating_groups(json_array_document_fields_of_adjacent_pages)
+        log_sbe_message_components_usage(json_array_document_fields_pages, json_array_repeating_groups, usage_snapshot)
 
-        for repeating_group in partial_json_array_repeating_groups:
-            if repeating_group["group_id"] not in json_array_repeating_groups:
-                json_array_repeating_groups.append(repeating_group)
+        return sbe_message_components
 
-    json_array_sbe_fields = []
+    return scheduler.add_task(
+        "sbe_message_components",
+        build_sbe_message_components,
+        array_page_task_names + array_sbe_fields_task_names + array_repeating_groups_task_names
+        + array_table_break_task_names
+    )
 
-    for json_array_document_fields_page in json_array_document_fields_pages:
-        partial_json_array_sbe_fields = generate_sbe_fields(json_array_document_fields_page)
-        json_array_sbe_fields.extend(partial_json_array_sbe_fields)
 
-    for repeating_group in json_array_repeating_groups:
-        repeating_group["items"] = generate_sbe_fields(repeating_group["items"])
-        with open('sbe_fields_repeating_group.json', 'r') as file:
-            file_content = file.read()
-            repeating_group["items"] = json.loads(file_content)
+def get_stage_output(task_result, default=None):
+    # the page tasks of process return typed results, the ones of generate_sbe_message_components plain fields
+    if isinstance(task_result, StageResult):
+        return task_result.get_output(default)
+    return task_result
+
 
-    ids_to_remove = set()
-    names_to_remove = set()
+def generate_page_sbe_fields(json_array_document_fields_page):
+    json_array_document_fields_page = get_stage_output(json_array_document_fields_page, [])
+    if not json_array_document_fields_page:
+        return []
+    return list(stream_sbe_fields(json_array_document_fields_page, utils.ai_model_sbe_batch_size))
 
+
+def detect_stitched_page_repeating_groups(json_array_document_fields_page, json_array_document_fields_next_page,
+                                          stitched_text_next_page):
+    # a group can only run into the next page if the table does
+    if not stitched_text_next_page["continues_previous_page"]:
+        return detect_page_repeating_groups(json_array_document_fields_page)
+    return detect_page_repeating_groups(json_array_document_fields_page, json_array_document_fields_next_page)
+
+
+def detect_page_repeating_groups(json_array_document_fields_page, *json_array_next_pages):
+    json_array_document_fields_page = get_stage_output(json_array_document_fields_page, [])
+    if not json_array_document_fields_page:
+        return []
+
+    json_array_document_fields = json_array_document_fields_page + [
+        document_field
+        for json_array_next_page in json_array_next_pages
+        for document_field in get_stage_output(json_array_next_page, [])
+    ]
+
+    return repeating_group_detector.detect_repeating_groups(
+        json_array_document_fields,
+        generate_repeating_groups,
+        scan_end=len(json_array_document_fields_page),
+        is_end_open=bool(json_array_next_pages)
+    )
+
+
+def get_field_key(field_id, field_name):
+    # fields without a tag are told apart by their name instead of all sharing the key "None"
+    if field_id is not None:
+        return str(field_id)
+    return None, re.sub(r"\s+", "", str(field_name or "")).lower()
+
+
+def get_document_field_key(document_field):
+    return get_field_key(
+        utils.get_document_field_id(document_field),
+        utils.get_document_field_value(document_field, utils.document_field_name_keys)
+    )
+
+
+def get_sbe_field_key(sbe_field):
+    return get_field_key(sbe_field.get("field_id"), sbe_field.get("field_name"))
+
+
+def assemble_sbe_message_components(json_array_sbe_fields, json_array_repeating_groups):
+    dict_sbe_fields = {get_sbe_field_key(sbe_field): sbe_field for sbe_field in json_array_sbe_fields}
+    group_field_keys = set()
+
+    for repeating_group in json_array_repeating_groups:
+        group_field_keys.update(
+            get_document_field_key(document_field)
+            for document_field in repeating_group["items"]
+        )
+
+    # items proposed by the model for ambiguous windows may not be part of any page: type only those
+    array_untyped_document_fields = []
     for repeating_group in json_array_repeating_groups:
-        for group_sbe_field in repeating_group["items"]:
-            ids_to_remove.add(group_sbe_field["field_id"])
-            names_to_remove.add(group_sbe_field["field_name"])
+        for document_field in repeating_group["items"]:
+            if get_document_field_key(document_field) not in dict_sbe_fields:
+                array_untyped_document_fields.append(document_field)
 
-    filtered_sbe_fields = []
+    if array_untyped_document_fields:
+        for sbe_field in stream_sbe_fields(array_untyped_document_fields, utils.ai_model_sbe_batch_size):
+            dict_sbe_fields.setdefault(get_sbe_field_key(sbe_field), sbe_field)
 
-    for field in json_array_sbe_fields:
-        if field["field_id"] not in ids_to_remove and field["field_name"] not in names_to_remove:
-            filtered_sbe_fields.append(field)
+    json_array_sbe_repeating_groups = []
+    for repeating_group in json_array_repeating_groups:
+        json_array_sbe_repeating_groups.append({
+            "group_id": repeating_group["group_id"],
+            "group_name": repeating_group["group_name"],
+            "items": [
+                dict_sbe_fields[field_key]
+                for field_key in (
+                    get_document_field_key(document_field)
+                    for document_field in repeating_group["items"]
+                )
+                if field_key in dict_sbe_fields
+            ]
+        })
 
     return {
-        "json_array_sbe_fields": filtered_sbe_fields,
-        "json_array_repeating_groups": json_array_repeating_groups
+        "json_array_sbe_fields": [
+            sbe_field for sbe_field in json_array_sbe_fields if get_sbe_field_key(sbe_field) not in group_field_keys
+        ],
+        "json_array_repeating_groups": json_array_sbe_repeating_groups
     }
 
 
-def generate_repeating_groups(array_document_fields):
+def log_sbe_message_components_usage(json_array_document_fields_pages, json_array_repeating_groups, usage_snapshot):
+    # cost of the former strategy: one group call per adjacent page pair, every page typed, every group typed again
+    legacy_calls = max(len(json_array_document_fields_pages) - 1, 0) + len(json_array_document_fields_pages) \
+        + len(json_array_repeating_groups)
+    legacy_input_tokens = 0
+    for i in range(len(json_array_document_fields_pages) - 1):
+        adjacent_pages = json_array_document_fields_pages[i] + json_array_document_fields_pages[i + 1]
+        legacy_input_tokens += estimate_tokens("".join(f"{document_field} " for document_field in adjacent_pages))
+    for json_array_document_fields_page in json_array_document_fields_pages:
+        legacy_input_tokens += estimate_tokens(
+            "".join(f"{document_field} " for document_field in json_array_document_fields_page))
+    for repeating_group in json_array_repeating_groups:
+        legacy_input_tokens += estimate_tokens("".join(f"{document_field} " for document_field in repeating_group["items"]))
+
+    usage = get_run_usage().get_difference(usage_snapshot)
+    logger.info(
+        f"SBE message components AI model usage: {usage['calls']} calls / ~{usage['input_tokens']} input tokens "
+        f"(pairwise strategy: {legacy_calls} calls / ~{legacy_input_tokens} input tokens)"
+    )
+
+
+def generate_repeating_groups(array_document_fields, repair_attempts=1, resume_attempts=2):
     system_message = """
 Sei esperto in sistemi di trading elettronico e conosci approfonditamente i protocolli FIX e SBE. Devi analizzare un array JSON contenente informazioni sui campi di un messaggio SBE per identificare se alcuni di essi formano un repeating group, basandoti su criteri specifici:
 - Pattern nei Nomi: Campi con nomi simili, come PartyIDGroup, PartyIDSource, PartyIDRole, PartyIDRoleQualifier, indicano un insieme comune.
@@ -1195,41 +1570,225 @@ Segui gli esempi che ti sono stati forniti.
 ### OUTPUT JSON ###
     """
 
-    # ai_model = ChatOpenAI(
-    #     openai_api_key=utils.openai_api_key,
-    #     model=utils.ai_model_name,
-    #     temperature=0,
-    #     top_p=0
-    # )
-    #
-    # json_array_repeating_groups = ai_model([
-    #     SystemMessage(content=utils.replace_newlines_with_space(system_message)),
-    #     HumanMessage(content=example_1_human_message),
-    #     AIMessage(content=example_1_assistant_message),
-    #     HumanMessage(content=example_2_human_message),
-    #     AIMessage(content=example_2_assistant_message),
-    #     HumanMessage(content=example_3_human_message),
-    #     AIMessage(content=example_3_assistant_message),
-    #     HumanMessage(content=example_4_human_message),
-    #     AIMessage(content=example_4_assistant_message),
-    #     HumanMessage(content=human_message
-    # )
-    # ])
-    #
-    # data = json.loads(json_array_repeating_groups.content)
-    #
-    # with open('repeating_groups_output.json', 'w') as file:
-    #     json.dump(data, file, indent=4)
-    #
-    # return json.loads(json_array_repeating_groups.content)
-
-    with open('repeating_groups.json', 'r') as file:
-        data = json.load(file)
-
-    return data
-
-
-def generate_sbe_fields(array_document_fields):
+    ai_model_usage.record_call("generate_repeating_groups", human_message)
+
+    array_messages = [
+        SystemMessage(content=utils.replace_newlines_with_space(system_message)),
+        HumanMessage(content=example_1_human_message),
+        AIMessage(content=example_1_assistant_message),
+        HumanMessage(content=example_2_human_message),
+        AIMessage(content=example_2_assistant_message),
+        HumanMessage(content=example_3_human_message),
+        AIMessage(content=example_3_assistant_message),
+        HumanMessage(content=example_4_human_message),
+        AIMessage(content=example_4_assistant_message),
+        HumanMessage(content=human_message)
+    ]
+
+    parser = JsonArrayStreamParser()
+    dict_repeating_groups = {}
+    array_invalid_objects = []
+    for json_object in parser.iterate(
+            stream_ai_model_response(array_messages, 'repeating_groups.json', stage_name="generate_repeating_groups")
+    ):
+        repeating_group, array_errors = ai_output_validator.validate_repeating_group(json_object)
+        if array_errors:
+            array_invalid_objects.append({"json_object": json_object, "errors": array_errors})
+            continue
+        if repeating_group["group_id"] not in dict_repeating_groups:
+            dict_repeating_groups[repeating_group["group_id"]] = repeating_group
+            yield repeating_group
+
+    invalid_group_ids = log_stage_output_validation(
+        "generate_repeating_groups",
+        len(dict_repeating_groups),
+        array_invalid_objects,
+        parser.array_unparsable_objects
+    )
+    array_document_field_ids = [
+        utils.get_document_field_id(document_field) for document_field in array_document_fields
+    ]
+
+    def request_remaining_repeating_groups(window_start, next_repair_attempts, next_resume_attempts):
+        for remaining_repeating_group in generate_repeating_groups(
+                array_document_fields[window_start:],
+                next_repair_attempts,
+                next_resume_attempts
+        ):
+            if remaining_repeating_group["group_id"] not in dict_repeating_groups:
+                dict_repeating_groups[remaining_repeating_group["group_id"]] = remaining_repeating_group
+                yield remaining_repeating_group
+
+    if invalid_group_ids and repair_attempts > 0:
+        # a broken group is asked again from its counter field on, the groups before it are kept
+        window_start = min(
+            (
+                array_document_field_ids.index(group_id)
+                for group_id in invalid_group_ids if group_id in array_document_field_ids
+            ),
+            default=0
+        )
+        yield from request_remaining_repeating_groups(window_start, repair_attempts - 1, resume_attempts)
+
+    if not parser.is_complete and resume_attempts > 0:
+        # the groups parsed so far are kept: ask again only for the fields after the last complete group
+        logger.warning(f"AI model answer truncated after {len(dict_repeating_groups)} repeating groups")
+        array_parsed_field_ids = [
+            field_id
+            for repeating_group in dict_repeating_groups.values()
+            for field_id in [repeating_group["group_id"]] + [
+                utils.get_document_field_id(document_field) for document_field in repeating_group["items"]
+            ]
+        ]
+        window_start = max(
+            (
+                array_document_field_ids.index(field_id) + 1
+                for field_id in array_parsed_field_ids if field_id in array_document_field_ids
+            ),
+            default=0
+        )
+        if window_start < len(array_document_fields):
+            yield from request_remaining_repeating_groups(window_start, repair_attempts, resume_attempts - 1)
+
+
+def get_fix_tag_knowledge_base():
+    global fix_tag_knowledge_base
+    with local_caches_lock:
+        if fix_tag_knowledge_base is None:
+            fix_tag_knowledge_base = FixTagKnowledgeBase(utils.fix_tag_knowledge_base_path)
+        return fix_tag_knowledge_base
+
+
+def get_field_similarity_index():
+    global field_similarity_index
+    with local_caches_lock:
+        if field_similarity_index is None:
+            field_similarity_index = FieldSimilarityIndex(utils.field_similarity_index_path)
+        return field_similarity_index
+
+
+def save_local_caches():
+    # a cache nobody used in this process was never read, so there is nothing of it to write
+    if fix_tag_knowledge_base is not None:
+        fix_tag_knowledge_base.save()
+    if field_similarity_index is not None:
+        field_similarity_index.save()
+
+
+def resolve_sbe_field_locally(document_field):
+    known_sbe_field = get_fix_tag_knowledge_base().lookup(document_field)
+    cache_lookups_counter.inc(cache="fix_tag_knowledge_base", result="miss" if known_sbe_field is None else "hit")
+    if known_sbe_field is not None:
+        return known_sbe_field, "knowledge_base"
+
+    inferred_sbe_field = sbe_type_inference.infer_sbe_field(document_field)
+    if inferred_sbe_field is not None:
+        return inferred_sbe_field, "rules"
+
+    similar_sbe_field = get_field_similarity_index().find_near_duplicate(document_field)
+    cache_lookups_counter.inc(cache="field_similarity_index", result="miss" if similar_sbe_field is None else "hit")
+    if similar_sbe_field is not None:
+        return similar_sbe_field, "similarity"
+
+    return None, "ai_model"
+
+
+def stream_sbe_fields(iterable_document_fields, ai_model_batch_size=None):
+    # fields are yielded in input order: a field typed locally waits only for the ambiguous ones before it
+    array_pending_fields = []
+    array_ambiguous_document_fields = []
+    array_verified_fields = []
+    dict_resolution_counts = {"knowledge_base": 0, "rules": 0, "similarity": 0, "ai_model": 0}
+
+    def request_ambiguous_sbe_fields():
+        # answers are matched by tag or name: a field the model leaves out does not shift the others onto it
+        dict_ai_model_sbe_fields = {}
+        for sbe_field in request_sbe_fields_from_ai_model(array_ambiguous_document_fields):
+            dict_ai_model_sbe_fields.setdefault(get_sbe_field_key(sbe_field), sbe_field)
+        requested_field_keys = set()
+        for pending_field in array_pending_fields:
+            document_field = pending_field["document_field"]
+            if document_field is None:
+                continue
+            field_key = get_document_field_key(document_field)
+            requested_field_keys.add(field_key)
+            sbe_field = dict_ai_model_sbe_fields.get(field_key)
+            if sbe_field is None:
+                logger.warning(f"AI model left the SBE field {field_key} unresolved")
+                continue
+            pending_field["sbe_field"], array_errors = ai_output_validator.validate_sbe_field_for_document(
+                sbe_field,
+                document_field
+            )
+            if array_errors:
+                logger.warning(f"AI model SBE field {field_key} not learned: {array_errors}")
+                continue
+            # the knowledge base is keyed by FIX tag: a field without one is only remembered by similarity
+            if pending_field["sbe_field"]["field_id"] is not None:
+                get_fix_tag_knowledge_base().record_sbe_field(document_field, pending_field["sbe_field"])
+            get_field_similarity_index().add_sbe_field(document_field, pending_field["sbe_field"])
+        array_unrequested_field_keys = [
+            field_key for field_key in dict_ai_model_sbe_fields if field_key not in requested_field_keys
+        ]
+        if array_unrequested_field_keys:
+            logger.warning(f"AI model SBE fields not requested, dropped: {array_unrequested_field_keys}")
+        array_ambiguous_document_fields.clear()
+
+    for document_field in iterable_document_fields:
+        sbe_field, resolution_source = resolve_sbe_field_locally(document_field)
+        dict_resolution_counts[resolution_source] = dict_resolution_counts[resolution_source] + 1
+        if resolution_source == "similarity" and get_field_similarity_index().is_sampled_for_verification():
+            array_verified_fields.append((document_field, sbe_field))
+        if sbe_field is None:
+            array_ambiguous_document_fields.append(document_field)
+        elif not array_pending_fields:
+            yield sbe_field
+            continue
+        array_pending_fields.append({
+            "sbe_field": sbe_field,
+            "document_field": document_field if sbe_field is None else None
+        })
+
+        if ai_model_batch_size and len(array_ambiguous_document_fields) >= ai_model_batch_size:
+            request_ambiguous_sbe_fields()
+            for pending_field in array_pending_fields:
+                if pending_field["sbe_field"] is not None:
+                    yield pending_field["sbe_field"]
+            array_pending_fields.clear()
+
+    number_document_fields = sum(dict_resolution_counts.values())
+    number_local_sbe_fields = number_document_fields - dict_resolution_counts["ai_model"]
+    local_ratio = number_local_sbe_fields / number_document_fields if number_document_fields else 1.0
+    logger.info(
+        f"local SBE typing resolved {number_local_sbe_fields}/{number_document_fields} fields ({local_ratio:.0%}): "
+        f"{dict_resolution_counts['knowledge_base']} from the FIX tag knowledge base, "
+        f"{dict_resolution_counts['rules']} by rules, {dict_resolution_counts['similarity']} from similar fields, "
+        f"{dict_resolution_counts['ai_model']} sent to the AI model"
+    )
+    stage_tracer.set_span_attributes(**{
+        f"{resolution_source}_fields": count for resolution_source, count in dict_resolution_counts.items()
+    })
+
+    if array_verified_fields:
+        json_array_verification_sbe_fields = request_sbe_fields_from_ai_model(
+            [document_field for document_field, _ in array_verified_fields]
+        )
+        dict_verification_sbe_fields = {
+            get_sbe_field_key(sbe_field): sbe_field for sbe_field in json_array_verification_sbe_fields
+        }
+        for document_field, reused_sbe_field in array_verified_fields:
+            ai_model_sbe_field = dict_verification_sbe_fields.get(get_document_field_key(document_field))
+            if ai_model_sbe_field is not None:
+                get_field_similarity_index().record_verification(reused_sbe_field, ai_model_sbe_field)
+
+    if array_ambiguous_document_fields:
+        request_ambiguous_sbe_fields()
+    for pending_field in array_pending_fields:
+        if pending_field["sbe_field"] is not None:
+            yield pending_field["sbe_field"]
+
+
+def request_sbe_fields_from_ai_model(array_document_fields, repair_attempts=1):
     system_message = """
 Sei un esperto in sistemi di trading elettronico con una profonda conoscenza dei protocolli FIX e SBE. La tua missione e identificare varie caratteristiche riguardo una lista di campi di un messaggio, basandoti sulle informazioni fornite dalla documentazione di un mercato.
 
@@ -1517,91 +2076,763 @@ Assicurati di includere solo ed esclusivamente un array JSON nel codice fornito.
 ### OUTPUT JSON ###
         """
 
-    # ai_model = ChatOpenAI(
-    #     openai_api_key=utils.openai_api_key,
-    #     model=utils.ai_model_name,
-    #     temperature=0,
-    #     top_p=0
-    # )
-    #
-    # json_array_sbe_fields = ai_model([
-    #     SystemMessage(content=utils.replace_newlines_with_space(system_message)),
-    #     HumanMessage(content=example_1_human_message),
-    #     AIMessage(content=example_1_assistant_message),
-    #     HumanMessage(content=example_2_human_message),
-    #     AIMessage(content=example_2_assistant_message),
-    #     HumanMessage(content=example_3_human_message),
-    #     AIMessage(content=example_3_assistant_message),
-    #     HumanMessage(content=human_message)
-    # ])
-    #
-    # data = json.loads(json_array_sbe_fields.content)
-    #
-    # with open('sbe_fields_output.json', 'w') as file:
-    #     json.dump(data, file, indent=4)
-    #
-    # return json.loads(json_array_sbe_fields.content)
-
-    with open('sbe_fields.json', 'r') as file:
-        data = json.load(file)
-
-    return data
+    ai_model_usage.record_call("generate_sbe_fields", human_message)
+
+    array_messages = [
+        SystemMessage(content=utils.replace_newlines_with_space(system_message)),
+        HumanMessage(content=example_1_human_message),
+        AIMessage(content=example_1_assistant_message),
+        HumanMessage(content=example_2_human_message),
+        AIMessage(content=example_2_assistant_message),
+        HumanMessage(content=example_3_human_message),
+        AIMessage(content=example_3_assistant_message),
+        HumanMessage(content=human_message)
+    ]
+
+    parser = JsonArrayStreamParser()
+    json_array_sbe_fields, array_invalid_objects = ai_output_validator.validate_stage_output(
+        "generate_sbe_fields",
+        parser.iterate(stream_ai_model_response(array_messages, 'sbe_fields.json', stage_name="generate_sbe_fields"))
+    )
+    log_stage_output_validation(
+        "generate_sbe_fields",
+        len(json_array_sbe_fields),
+        array_invalid_objects,
+        parser.array_unparsable_objects
+    )
+
+    # answers are keyed like the fields they were sent for: by tag, or by name for a field without one
+    dict_sbe_fields = {}
+    for sbe_field in json_array_sbe_fields:
+        dict_sbe_fields.setdefault(get_sbe_field_key(sbe_field), sbe_field)
+    array_missing_document_fields = [
+        document_field for document_field in array_document_fields
+        if get_document_field_key(document_field) not in dict_sbe_fields
+    ]
+    if (array_invalid_objects or parser.array_unparsable_objects or not parser.is_complete) \
+            and array_missing_document_fields and repair_attempts > 0:
+        for sbe_field in request_sbe_fields_from_ai_model(array_missing_document_fields, repair_attempts - 1):
+            dict_sbe_fields.setdefault(get_sbe_field_key(sbe_field), sbe_field)
+
+    array_requested_field_keys = [get_document_field_key(document_field) for document_field in array_document_fields]
+    return [
+        dict_sbe_fields.pop(field_key) for field_key in array_requested_field_keys if field_key in dict_sbe_fields
+    ] + list(dict_sbe_fields.values())
+
+
+async def forward_ai_model_response(array_messages, queue_chunks):
+    try:
+        async for chunk in ai_model_client.stream_async(array_messages):
+            queue_chunks.put(("chunk", chunk))
+    except Exception as e:
+        queue_chunks.put(("error", e))
+    else:
+        queue_chunks.put(("end", None))
+
+
+def stream_ai_model_response(array_messages, recorded_response_path, recorded_chunk_size=256, stage_name=None):
+    # the span stays open while the caller parses: the duration metric only counts the time spent waiting on the model
+    with stage_tracer.trace_detached_span(
+            "ai_model_call",
+            "ai_model",
+            stage_name=stage_name,
+            use_recorded_ai_model_response=utils.use_recorded_ai_model_responses,
+            input_tokens=sum(estimate_tokens(str(message.content)) for message in array_messages)
+    ) as span:
+        iterator_chunks = request_ai_model_response(array_messages, recorded_response_path, recorded_chunk_size)
+        wait_duration = 0.0
+        number_characters = 0
+        is_failed = False
+        try:
+            while True:
+                wait_start_time = time.perf_counter()
+                chunk = next(iterator_chunks, None)
+                wait_duration = wait_duration + time.perf_counter() - wait_start_time
+                if chunk is None:
+                    break
+                number_characters = number_characters + len(chunk)
+                yield chunk
+        except Exception as e:
+            stage_errors_counter.inc(stage=f"{stage_name}_ai_model_call")
+            if number_characters == 0 or not is_transient_error(e):
+                is_failed = True
+                raise
+            # the objects parsed so far are kept: the caller sees an unfinished array and asks only for the rest
+            logger.warning(
+                f"{stage_name}: AI model stream cut after {number_characters} characters ({type(e).__name__}: {e})"
+            )
+            span.set_attributes(is_truncated=True)
+        finally:
+            if not is_failed:
+                span.set_attributes(output_tokens=estimate_tokens_from_length(number_characters))
+                stage_duration_histogram.observe(wait_duration, stage=f"{stage_name}_ai_model_call")
+                ai_model_calls_counter.inc(stage=stage_name)
+                ai_model_input_tokens_counter.inc(span.attributes["input_tokens"], stage=stage_name)
+                ai_model_output_tokens_counter.inc(span.attributes["output_tokens"], stage=stage_name)
+
+
+def request_ai_model_response(array_messages, recorded_response_path, recorded_chunk_size):
+    if not utils.use_recorded_ai_model_responses:
+        event_loop = ai_model_event_loop.get()
+        if event_loop is None:
+            yield from ai_model_client.stream(array_messages)
+            return
+        # the request is awaited on the event loop with the others, the worker thread parses the chunks as they come
+        queue_chunks = queue.Queue()
+        future = asyncio.run_coroutine_threadsafe(forward_ai_model_response(array_messages, queue_chunks), event_loop)
+        try:
+            while True:
+                message_type, value = queue_chunks.get()
+                if message_type == "end":
+                    return
+                if message_type == "error":
+                    raise value
+                yield value
+        finally:
+            future.cancel()
+
+    with open(recorded_response_path, 'r') as file:
+        recorded_response = file.read()
+
+    for index in range(0, len(recorded_response), recorded_chunk_size):
+        yield recorded_response[index:index + recorded_chunk_size]
+
+
+def stitch_page_text(has_previous_page, has_next_page, ocr_result_page, *neighbour_results):
+    neighbour_results = list(neighbour_results)
+    stitched_text_previous_page = neighbour_results.pop(0) if has_previous_page else None
+    ocr_output_next_page = get_stage_output(neighbour_results.pop(0), empty_ocr_output) if has_next_page else None
+    return table_stitcher.stitch_page_text_tables(
+        get_stage_output(ocr_result_page, empty_ocr_output),
+        stitched_text_previous_page,
+        ocr_output_next_page
+    )
+
+
+def deduplicate_page_text(stitched_text_page, *ocr_result_neighbour_pages):
+    deduplicated_text = page_text_deduplicator.deduplicate_page_text_tables(
+        stitched_text_page["text_tables"],
+        [
+            get_stage_output(ocr_result_neighbour_page, empty_ocr_output)["text_tables"]
+            for ocr_result_neighbour_page in ocr_result_neighbour_pages
+        ]
+    )
+    # a page continuing the table of the previous one has no column names of its own
+    deduplicated_text["column_header"] = deduplicated_text["column_header"] or stitched_text_page["column_header"]
+    return deduplicated_text
+
+
+def extract_page_fields(ocr_result_page, deduplicated_text_page):
+    # empty and failed pages stop here: no AI model request is made for them
+    if not ocr_result_page.is_ok:
+        return ocr_result_page
+    if not deduplicated_text_page["text_tables"]:
+        return StageResult.empty("generate_document_fields", "no table text left once page furniture is removed")
+
+    json_array_document_fields = []
+
+    def iterate_document_fields():
+        for document_field in generate_document_fields(deduplicated_text_page):
+            json_array_document_fields.append(document_field)
+            yield document_field
+
+    # each field is typed as soon as it is parsed, the ambiguous ones are sent to the AI model in batches
+    json_array_sbe_fields = list(stream_sbe_fields(iterate_document_fields(), utils.ai_model_sbe_batch_size))
+    if not json_array_document_fields:
+        return StageResult.empty("generate_document_fields", "the AI model found no field in the tables")
+    return StageResult.ok(
+        "generate_document_fields",
+        {"document_fields": json_array_document_fields, "sbe_fields": json_array_sbe_fields}
+    )
+
+
+def get_page_document_fields(page_fields_result):
+    if not page_fields_result.is_ok:
+        return page_fields_result
+    return StageResult.ok(page_fields_result.stage_name, page_fields_result.output["document_fields"])
+
+
+def get_page_sbe_fields(page_fields_result):
+    return get_stage_output(page_fields_result, {}).get("sbe_fields", [])
 
 
 def execute_pipeline_filters(file_name, folder_path, pipeline_filters):
 
     image_path = os.path.join(folder_path, file_name)
-    data = image_path
     logger.info(f"current image path: {image_path}")
 
+    return run_pipeline_filters(pipeline_filters, image_path)
+
+
+def execute_page_pipeline_filters(pdf_path, folder_path, page_number, pipeline_filters):
+    # the page is rasterized by its own task: pages restored from a checkpoint are never converted
+    start_time = time.perf_counter()
+    try:
+        with stage_tracer.trace_span("rasterize_pdf_page"), \
+                stage_memory_profiler.profile_stage("rasterize_pdf_page"):
+            image_path = rasterize_pdf_page(pdf_path, folder_path, page_number)
+    except Exception as e:
+        stage_errors_counter.inc(stage="rasterize_pdf_page")
+        return StageResult.failed("rasterize_pdf_page", e)
+    stage_duration_histogram.observe(time.perf_counter() - start_time, stage="rasterize_pdf_page")
+    logger.info(f"current image path: {image_path}")
+
+    return run_pipeline_filters(pipeline_filters, image_path)
+
+
+def run_pipeline_filters(pipeline_filters, data):
+    # the first filter that fails or finds nothing ends the pipeline: the next one would only get garbage
     i = 1
     for function in pipeline_filters:
+        start_time = time.perf_counter()
         try:
-            data = function(data)
-            logger.info(f"num filter: {i}")
-            i = i + 1
-        except FileNotFoundError as e:
-            print(e)
+            with stage_tracer.trace_span(function.__name__), \
+                    stage_memory_profiler.profile_stage(function.__name__):
+                data = function(data)
         except Exception as e:
-            print(f"Errore nel processare l'immagine {file_name}: {e}")
+            print(f"Errore nel filtro {function.__name__}: {e}")
+            stage_errors_counter.inc(stage=function.__name__)
+            return StageResult.failed(function.__name__, e)
+        stage_duration_histogram.observe(time.perf_counter() - start_time, stage=function.__name__)
+
+        if data is None:
+            stage_errors_counter.inc(stage=function.__name__)
+            return StageResult.failed(function.__name__, "no output")
+        if isinstance(data, StageResult):
+            if not data.is_ok:
+                logger.info(f"filter {function.__name__} stopped the pipeline: {data.status}, {data.reason}")
+                return data
+            data = data.output
+        logger.info(f"num filter: {i}")
+        i = i + 1
+
+    return StageResult.ok(pipeline_filters[-1].__name__, data)
+
+
+def get_ai_model_input_key():
+    # the answers of another model are not the answers the checkpoints were saved from
+    return {
+        "ai_model_name": utils.ai_model_name,
+        "use_recorded_ai_model_responses": utils.use_recorded_ai_model_responses
+    }
+
+
+def get_checkpointed_task(checkpoint_store, task_name, function, input_key=None, is_stage_result=False):
+    # a stage whose inputs hash as in the checkpoint is not run again, a failed stage is not saved so it is retried
+    # the metrics are per stage, not per page
+    stage_name = re.sub(r"_(document_fields_)?page_\d+", "", task_name)
+
+    def load_checkpoint(task_results):
+        if checkpoint_store is None:
+            return None, False, None
+        input_hash = get_input_hash(task_name, input_key, task_results)
+        is_loaded, output = checkpoint_store.load(task_name, input_hash)
+        cache_lookups_counter.inc(cache="checkpoint", result="hit" if is_loaded else "miss")
+        if is_loaded and is_stage_result:
+            output = StageResult.from_dict(output)
+        if is_loaded:
+            stage_tracer.set_span_attributes(checkpoint="restored")
+        return input_hash, is_loaded, output
+
+    def save_checkpoint(input_hash, output):
+        if checkpoint_store is None:
+            return output
+        if not is_stage_result:
+            checkpoint_store.save(task_name, input_hash, output)
+        elif not output.is_failed:
+            checkpoint_store.save(task_name, input_hash, output.to_dict())
+        return output
+
+    if inspect.iscoroutinefunction(function):
+        async def run_checkpointed_task_async(*task_results):
+            input_hash, is_loaded, output = load_checkpoint(task_results)
+            if is_loaded:
+                return output
+            try:
+                output = await function(*task_results)
+            except Exception as e:
+                if not is_stage_result:
+                    raise
+                print(f"Errore nel processare {task_name}: {e}")
+                stage_errors_counter.inc(stage=stage_name)
+                return StageResult.failed(task_name, e)
+            return save_checkpoint(input_hash, output)
+
+        return run_checkpointed_task_async
+
+    def run_checkpointed_task(*task_results):
+        input_hash, is_loaded, output = load_checkpoint(task_results)
+        if is_loaded:
+            return output
+        try:
+            output = function(*task_results)
+        except Exception as e:
+            if not is_stage_result:
+                raise
+            print(f"Errore nel processare {task_name}: {e}")
+            stage_errors_counter.inc(stage=stage_name)
+            return StageResult.failed(task_name, e)
+        return save_checkpoint(input_hash, output)
+
+    return run_checkpointed_task
+
+
+def get_ocr_input_key(pdf_hash, page_number):
+    return {"pdf_hash": pdf_hash, "page_number": page_number}
+
 
-    return data
+async def run_in_page_process_pool(page_process_pool, function):
+    return await asyncio.wrap_future(page_process_pool.submit(function))
 
-def process(pdf_path, starting_page, ending_page, folder_path="extracted_pdf_pages"):
 
-    convert_pdf_pages_to_jpg(pdf_path, starting_page, ending_page, folder_path)
+def start_stage_pipeline(pdf_path, folder_path, array_page_numbers, stage_workers):
+    # rasterizing is I/O and poppler bound and stays in a thread, the other CV stages get their own processes
+    array_process_pools = [
+        create_page_process_pool(stage_workers["preprocess"], is_loading_models=False),
+        create_page_process_pool(stage_workers["detect_tables"]),
+        create_page_process_pool(stage_workers["ocr_tables"])
+    ]
+    trace_context = stage_tracer.get_trace_context()
+    stage_pipeline_runner = StagePipelineRunner([
+        PipelineStage(
+            "rasterize",
+            partial(stage_tracer.run_traced, trace_context, "rasterize_pdf_page", {},
+                    partial(rasterize_pdf_page, pdf_path, folder_path)),
+            stage_workers["rasterize"]
+        ),
+        PipelineStage(
+            "preprocess",
+            partial(stage_tracer.run_traced, trace_context, "preprocess_page_image", {}, preprocess_page_image),
+            stage_workers["preprocess"],
+            array_process_pools[0]
+        ),
+        PipelineStage(
+            "detect_tables",
+            partial(stage_tracer.run_traced, trace_context, "detect_tables", {}, detect_tables),
+            stage_workers["detect_tables"],
+            array_process_pools[1]
+        ),
+        PipelineStage(
+            "ocr_tables",
+            partial(stage_tracer.run_traced, trace_context, "ocr_tables", {}, ocr_tables),
+            stage_workers["ocr_tables"],
+            array_process_pools[2]
+        )
+    ], queue_size=utils.stage_queue_size)
+
+    return stage_pipeline_runner, stage_pipeline_runner.start(array_page_numbers), array_process_pools
+
+
+async def get_stage_pipeline_result(future):
+    try:
+        stage_result = await asyncio.wrap_future(future)
+    except Exception as e:
+        return StageResult.failed("stage_pipeline", e)
+    # a stage that found nothing ends the pipeline early with its own result
+    return stage_result if isinstance(stage_result, StageResult) else StageResult.ok("ocr_tables", stage_result)
+
+
+# the options are keyword-only: the fourth positional parameter used to be the folder of the page images
+def process(pdf_path, starting_page, ending_page, *, workspace_directory=None, run_report=None,
+            number_page_workers=None, page_process_pool=None, stage_workers=None, run_directory=None, resume=False,
+            memory_profile=False):
+    return asyncio.run(process_async(
+        pdf_path,
+        starting_page,
+        ending_page,
+        workspace_directory=workspace_directory,
+        run_report=run_report,
+        number_page_workers=number_page_workers,
+        page_process_pool=page_process_pool,
+        stage_workers=stage_workers,
+        run_directory=run_directory,
+        resume=resume,
+        memory_profile=memory_profile
+    ))
+
+
+async def process_async(pdf_path, starting_page, ending_page, *, workspace_directory=None, run_report=None,
+                        number_page_workers=None, page_process_pool=None, stage_workers=None, run_directory=None,
+                        resume=False, memory_profile=False):
+    if workspace_directory is not None:
+        utils.create_directory_if_not_exists(workspace_directory)
+
+    pdf_hash = await asyncio.to_thread(get_file_hash, pdf_path)
+    run_directory, run_directory_lock = lock_run_directory(run_directory, pdf_path, pdf_hash, starting_page, ending_page)
+    try:
+        return await process_in_run_directory(
+            pdf_path,
+            pdf_hash,
+            starting_page,
+            ending_page,
+            workspace_directory,
+            run_report,
+            number_page_workers,
+            page_process_pool,
+            stage_workers,
+            run_directory,
+            resume,
+            memory_profile
+        )
+    finally:
+        utils.release_file_lock(run_directory_lock)
+
+
+async def process_in_run_directory(pdf_path, pdf_hash, starting_page, ending_page, workspace_directory, run_report,
+                                   number_page_workers, page_process_pool, stage_workers, run_directory, resume,
+                                   memory_profile):
+    if memory_profile:
+        # the memory of a process is shared by whatever runs in it: the stages run one at a time in this process,
+        # so the RSS that moves during a stage moves because of it
+        if page_process_pool is not None or stage_workers is not None or (number_page_workers or 1) > 1:
+            logger.info("memory profiling: the pages run one at a time in this process, without workers")
+        number_page_workers = 1
+        page_process_pool = None
+        stage_workers = None
+    ai_model_event_loop_token = ai_model_event_loop.set(asyncio.get_running_loop())
+    # every run rasterizes into a folder of its own: concurrent runs never see or overwrite each other's pages
+    with tempfile.TemporaryDirectory(prefix="pdf_pages_", dir=workspace_directory) as folder_path, \
+            stage_tracer.start_trace(
+                run_directory if utils.trace_runs else None,
+                "run",
+                pdf_path=pdf_path,
+                starting_page=starting_page,
+                ending_page=ending_page
+            ), \
+            stage_memory_profiler.start_memory_profile(run_directory if memory_profile else None), \
+            track_run_usage(), \
+            track_run_statistics():
+        try:
+            return await run_process_scheduler(
+                pdf_path,
+                pdf_hash,
+                starting_page,
+                ending_page,
+                folder_path,
+                run_report,
+                number_page_workers,
+                page_process_pool,
+                stage_workers,
+                run_directory,
+                resume
+            )
+        finally:
+            ai_model_event_loop.reset(ai_model_event_loop_token)
+            # what the run learned is written once, merged with what other runs saved in the meantime
+            await asyncio.to_thread(save_local_caches)
+
+
+def get_page_outcomes(array_page_numbers, array_page_results):
+    return [
+        {
+            "page_number": page_number,
+            "status": page_result.status,
+            "stage_name": page_result.stage_name,
+            "reason": page_result.reason,
+            "document_fields": len(page_result.get_output([]))
+        }
+        for page_number, page_result in zip(array_page_numbers, array_page_results)
+    ]
+
+
+def log_page_outcomes(array_page_outcomes):
+    dict_status_counts = {status: 0 for status in stage_result.stage_statuses}
+    for page_outcome in array_page_outcomes:
+        dict_status_counts[page_outcome["status"]] = dict_status_counts[page_outcome["status"]] + 1
+        if page_outcome["status"] == stage_result.stage_status_failed:
+            logger.warning(
+                f"page {page_outcome['page_number']} failed in {page_outcome['stage_name']}: {page_outcome['reason']}"
+            )
+        elif page_outcome["status"] == stage_result.stage_status_empty:
+            logger.info(
+                f"page {page_outcome['page_number']} skipped after {page_outcome['stage_name']}: "
+                f"{page_outcome['reason']}"
+            )
+
+    logger.info("page outcomes: " + ", ".join(f"{count} {status}" for status, count in dict_status_counts.items()))
+
+
+def get_run_directory(pdf_path, pdf_hash, starting_page, ending_page):
+    # keyed by content: two PDFs with the same file name never share checkpoints, a renamed one still resumes
+    return os.path.join(
+        utils.runs_directory,
+        f"{os.path.splitext(os.path.basename(pdf_path))[0]}_{pdf_hash[:12]}_{starting_page}_{ending_page}"
+    )
+
+
+def lock_run_directory(run_directory, pdf_path, pdf_hash, starting_page, ending_page):
+    # the checkpoints, the manifest and the trace of a run directory belong to one run at a time
+    is_default_run_directory = run_directory is None
+    run_directory = run_directory or get_run_directory(pdf_path, pdf_hash, starting_page, ending_page)
+    os.makedirs(run_directory, exist_ok=True)
+    run_directory_lock = utils.acquire_file_lock(os.path.join(run_directory, run_lock_file_name), is_blocking=False)
+    if run_directory_lock is not None:
+        return run_directory, run_directory_lock
+    if not is_default_run_directory:
+        raise RuntimeError(f"run directory {run_directory} is in use by another run")
+
+    # the same pages of the same PDF are being processed right now: this run starts from a directory of its own
+    run_directory = tempfile.mkdtemp(prefix=f"{os.path.basename(run_directory)}_", dir=utils.runs_directory)
+    logger.info(f"default run directory in use by another run, checkpoints of this run kept in {run_directory}")
+    return run_directory, utils.acquire_file_lock(os.path.join(run_directory, run_lock_file_name))
+
+
+async def run_process_scheduler(pdf_path, pdf_hash, starting_page, ending_page, folder_path, run_report,
+                                number_page_workers, page_process_pool, stage_workers, run_directory, resume):
+    number_page_workers = utils.number_page_workers if number_page_workers is None else number_page_workers
 
-    array_file_names = [file for file in os.listdir(folder_path) if file.endswith(('.jpg', '.jpeg', '.png'))]
+    if starting_page > ending_page:
+        raise ValueError("Starting page cannot be greater than ending page.")
+    array_page_numbers = list(range(starting_page, ending_page + 1))
 
-    pipeline_filters = [
+    checkpoint_store = StageCheckpointStore(
+        run_directory,
+        {"pdf_path": pdf_path, "pdf_hash": pdf_hash, "starting_page": starting_page, "ending_page": ending_page},
+        is_resuming=resume
+    )
+    # only the pages without an up to date OCR checkpoint go through rasterizing and the CV stages
+    array_ocr_page_numbers = [
+        page_number for page_number in array_page_numbers
+        if not checkpoint_store.is_saved(
+            f"ocr_page_{page_number}",
+            get_input_hash(f"ocr_page_{page_number}", get_ocr_input_key(pdf_hash, page_number), ())
+        )
+    ]
+    logger.info(
+        f"{len(array_page_numbers) - len(array_ocr_page_numbers)}/{len(array_page_numbers)} pages restored "
+        f"from the OCR checkpoints in {checkpoint_store.run_directory}"
+    )
+
+    stage_pipeline_runner = None
+    array_stage_process_pools = []
+    dict_ocr_futures = {}
+
+    if stage_workers is not None and array_ocr_page_numbers:
+        # every CV stage has its own workers: pages flow through them instead of one page per worker end to end
+        stage_pipeline_runner, array_ocr_futures, array_stage_process_pools = start_stage_pipeline(
+            pdf_path,
+            folder_path,
+            array_ocr_page_numbers,
+            {**utils.stage_workers, **stage_workers}
+        )
+        dict_ocr_futures = dict(zip(array_ocr_page_numbers, array_ocr_futures))
+
+    ocr_pipeline_filters = [
         convert_grayscale,
         increase_contrast,
         thresholding,
         detect_tables,
-        ocr_tables,
-        generate_document_fields
+        ocr_tables
     ]
 
-    array_document_fields_pages = []
-    for file_name in array_file_names:
-        array_document_fields = execute_pipeline_filters(file_name, folder_path, pipeline_filters)
-        array_document_fields_pages.append(array_document_fields)
+    # the CV stages hold the GIL: with more than one worker they run in a pool of processes with their own models
+    is_page_process_pool_owned = page_process_pool is None and number_page_workers > 1 and stage_workers is None \
+        and len(array_ocr_page_numbers) > 0
+    if is_page_process_pool_owned:
+        page_process_pool = create_page_process_pool(number_page_workers)
+
+    # one page worker runs the stages one after the other, in this thread pool as in the process pool
+    scheduler = DagScheduler(max_workers=1 if number_page_workers == 1 else max(8, 2 * number_page_workers))
+
+    array_page_names = [f"page_{page_number}" for page_number in array_page_numbers]
+    array_ocr_task_names = []
+    trace_context = stage_tracer.get_trace_context()
+    for page_number, page_name in zip(array_page_numbers, array_page_names):
+        # the page span is opened where the page runs, in a worker process or in a thread of the run
+        execute_ocr_pipeline_filters = partial(
+            stage_tracer.run_traced,
+            trace_context,
+            page_name,
+            {"page_number": page_number},
+            partial(execute_page_pipeline_filters, pdf_path, folder_path, page_number, ocr_pipeline_filters)
+        )
+        if page_number in dict_ocr_futures:
+            execute_ocr_pipeline_filters = partial(get_stage_pipeline_result, dict_ocr_futures[page_number])
+        elif page_process_pool is not None:
+            execute_ocr_pipeline_filters = partial(
+                run_in_page_process_pool,
+                page_process_pool,
+                execute_ocr_pipeline_filters
+            )
+        ocr_task_name = f"ocr_{page_name}"
+        array_ocr_task_names.append(scheduler.add_task(
+            ocr_task_name,
+            get_checkpointed_task(
+                checkpoint_store,
+                ocr_task_name,
+                execute_ocr_pipeline_filters,
+                get_ocr_input_key(pdf_hash, page_number),
+                is_stage_result=True
+            )
+        ))
+
+    array_stitching_task_names = []
+    array_deduplication_task_names = []
+    array_page_task_names = []
+    array_sbe_fields_task_names = []
+    for page_index, page_name in enumerate(array_page_names):
+        # rows cut by a page break are joined back before either page is extracted
+        array_stitching_task_names.append(scheduler.add_task(
+            f"stitched_text_{page_name}",
+            partial(stitch_page_text, page_index > 0, page_index < len(array_page_names) - 1),
+            [array_ocr_task_names[page_index]] + array_stitching_task_names[page_index - 1:page_index]
+            + array_ocr_task_names[page_index + 1:page_index + 2]
+        ))
+
+        # header and footer lines are recognised on the neighbour pages: extraction does not wait for the whole
+        # document
+        array_neighbour_task_names = array_ocr_task_names[max(page_index - 1, 0):page_index] \
+            + array_ocr_task_names[page_index + 1:page_index + 2]
+        array_deduplication_task_names.append(scheduler.add_task(
+            f"deduplicated_text_{page_name}",
+            deduplicate_page_text,
+            [array_stitching_task_names[page_index]] + array_neighbour_task_names
+        ))
+        typed_fields_task_name = f"typed_fields_{page_name}"
+        scheduler.add_task(
+            typed_fields_task_name,
+            get_checkpointed_task(
+                checkpoint_store,
+                typed_fields_task_name,
+                extract_page_fields,
+                get_ai_model_input_key(),
+                is_stage_result=True
+            ),
+            [array_ocr_task_names[page_index], array_deduplication_task_names[-1]]
+        )
+        array_page_task_names.append(scheduler.add_task(
+            f"document_fields_{page_name}",
+            get_page_document_fields,
+            [typed_fields_task_name]
+        ))
+        array_sbe_fields_task_names.append(scheduler.add_task(
+            f"sbe_fields_document_fields_{page_name}",
+            get_page_sbe_fields,
+            [typed_fields_task_name]
+        ))
+
+    sbe_message_components_task_name = schedule_sbe_message_components(
+        scheduler,
+        array_page_task_names,
+        array_stitching_task_names,
+        checkpoint_store,
+        array_sbe_fields_task_names
+    )
+    try:
+        task_results = await scheduler.run_async()
+    finally:
+        if stage_pipeline_runner is not None:
+            await asyncio.to_thread(stage_pipeline_runner.join)
+        for process_pool in array_stage_process_pools + ([page_process_pool] if is_page_process_pool_owned else []):
+            process_pool.shutdown()
+
+    if stage_pipeline_runner is not None:
+        stage_pipeline_report = stage_pipeline_runner.get_report()
+        for stage_report in stage_pipeline_report["stages"]:
+            logger.info(
+                f"stage {stage_report['stage_name']}: {stage_report['workers']} workers, "
+                f"{stage_report['items']} pages, utilization {stage_report['utilization']:.0%}, "
+                f"blocked {stage_report['blocked_seconds']}s, input queue depth mean "
+                f"{stage_report['mean_queue_depth']} / max {stage_report['max_queue_depth']}"
+            )
+        if run_report is not None:
+            run_report["stage_pipeline"] = stage_pipeline_report
+    sbe_message_components = task_results[sbe_message_components_task_name]
+
+    number_repeated_lines = sum(
+        len(task_results[task_name]["removed_lines"]) for task_name in array_deduplication_task_names
+    )
+    repeated_text_tokens_saved = sum(
+        task_results[task_name]["tokens_saved"] for task_name in array_deduplication_task_names
+    )
+    number_stitched_pages = sum(
+        task_results[task_name]["continues_previous_page"] for task_name in array_stitching_task_names
+    )
+    logger.info(f"{number_stitched_pages} pages continue the table of the previous page")
+    logger.info(
+        f"repeated page headers and footers: {number_repeated_lines} lines removed before extraction, "
+        f"~{repeated_text_tokens_saved} input tokens saved"
+    )
 
-    sbe_message_components = generate_sbe_message_components(array_document_fields_pages)
+    critical_path = scheduler.get_critical_path()
+    logger.info("critical path: " + " -> ".join(
+        f"{task['task_name']} ({task['duration']:.2f}s)" for task in critical_path
+    ))
+    field_similarity_report = get_field_similarity_index().get_run_report()
+    logger.info(
+        f"similar field reuse: {field_similarity_report['reused']}/{field_similarity_report['lookups']} lookups "
+        f"({field_similarity_report['reuse_rate']:.0%}), false matches {field_similarity_report['false_matches']}/"
+        f"{field_similarity_report['verified']} verified against the AI model"
+    )
 
-    json_array_sbe_fields = sbe_message_components["json_array_sbe_fields"]
-    json_array_repeating_groups = sbe_message_components["json_array_repeating_groups"]
+    array_page_outcomes = get_page_outcomes(
+        array_page_numbers,
+        [task_results[page_task_name] for page_task_name in array_page_task_names]
+    )
+    log_page_outcomes(array_page_outcomes)
+    for page_outcome in array_page_outcomes:
+        pages_processed_counter.inc(status=page_outcome["status"])
+
+    checkpoint_report = checkpoint_store.get_report()
+    logger.info(
+        f"checkpoints: {checkpoint_report['reused']} stages restored, {checkpoint_report['saved']} saved "
+        f"in {checkpoint_report['run_directory']}"
+    )
 
-    with open('deprecated/proof_data.txt', 'a', encoding="utf-8") as file:
-        file.write("array_sbe_fields:\n")
-        for data in json_array_sbe_fields:
-            file.write(f"{data}\n")
-        file.write("array_repeating_groups:\n")
-        for data in json_array_repeating_groups:
-            file.write(f"{data}\n")
+    if run_report is not None:
+        run_report["critical_path"] = critical_path
+        run_report["field_similarity"] = field_similarity_report
+        run_report["repeated_text_tokens_saved"] = repeated_text_tokens_saved
+        run_report["checkpoints"] = checkpoint_report
+        run_report["page_outcomes"] = array_page_outcomes
+        if utils.trace_runs:
+            run_report["trace_path"] = os.path.join(checkpoint_store.run_directory, stage_tracer.trace_file_name)
+        if stage_memory_profiler.is_profiling():
+            run_report["memory_profile_path"] = os.path.join(
+                checkpoint_store.run_directory,
+                stage_memory_profiler.memory_profile_file_name
+            )
+    stage_tracer.set_span_attributes(
+        **{
+            f"{status}_pages": sum(page_outcome["status"] == status for page_outcome in array_page_outcomes)
+            for status in stage_result.stage_statuses
+        },
+        restored_stages=checkpoint_report["reused"]
+    )
 
-    return json_array_sbe_fields, json_array_repeating_groups
+    return sbe_message_components["json_array_sbe_fields"], sbe_message_components["json_array_repeating_groups"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract the SBE fields and repeating groups of a page range of a PDF.")
+    parser.add_argument("--pdf", default="pdf_documents/drop_copy_service.pdf")
+    parser.add_argument("--pages", default="24-26")
+    parser.add_argument("--workspace-directory",
+                        help="where the temporary page images of the run are written, by default the system temp folder")
+    parser.add_argument("--run-directory", help="where the checkpoints of the run are kept, by default under "
+                                                f"{utils.runs_directory}/ per PDF content and page range")
+    parser.add_argument("--resume", action="store_true",
+                        help="reuse the checkpoints of an earlier run for every stage whose inputs are unchanged")
+    parser.add_argument("--metrics-port", type=int,
+                        help="serve the engine metrics in the Prometheus text format on this local port")
+    parser.add_argument("--memory-profile", action="store_true",
+                        help="run the stages one at a time and write their RSS and top allocations "
+                             f"to {stage_memory_profiler.memory_profile_file_name} in the run directory")
+    arguments = parser.parse_args()
+
+    if arguments.metrics_port is not None:
+        start_metrics_server(arguments.metrics_port)
+    starting_page, ending_page = (int(page) for page in arguments.pages.split("-"))
+    asyncio.run(process_async(
+        arguments.pdf,
+        starting_page,
+        ending_page,
+        workspace_directory=arguments.workspace_directory,
+        run_directory=arguments.run_directory,
+        resume=arguments.resume,
+        memory_profile=arguments.memory_profile
+    ))
 
 
 if __name__ == "__main__":
-    process("pdf_documents/drop_copy_service.pdf", 24, 26, "extracted_pdf_pages")
+    main()
@@ -0,0 +1,337 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+
+from langchain_community.chat_models.openai import ChatOpenAI
+
+import utils
+from ai_model_usage import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+throttling_status_codes = [429]
+transient_status_codes = [408, 409, 500, 502, 503, 504]
+transient_error_names = ["RateLimitError", "APITimeoutError", "APIConnectionError", "Timeout", "TimeoutError",
+                         "ConnectionError", "InternalServerError", "ServiceUnavailableError"]
+
+
+class AIModelCircuitOpenError(Exception):
+    pass
+
+
+def get_status_code(error):
+    status_code = getattr(error, "status_code", None)
+    if status_code is None and getattr(error, "response", None) is not None:
+        status_code = getattr(error.response, "status_code", None)
+    return status_code
+
+
+def is_throttling_error(error):
+    return get_status_code(error) in throttling_status_codes or type(error).__name__ == "RateLimitError"
+
+
+def is_transient_error(error):
+    return is_throttling_error(error) or get_status_code(error) in transient_status_codes \
+        or type(error).__name__ in transient_error_names
+
+
+def get_retry_after(error):
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    def __init__(self, capacity_per_minute):
+        self.capacity = float(capacity_per_minute)
+        self.refill_rate = capacity_per_minute / 60.0
+        self.available = self.capacity
+        self.last_refill_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, amount):
+        # a single request larger than the whole budget waits for a full bucket instead of forever
+        amount = min(amount, self.capacity)
+        with self.lock:
+            now = time.monotonic()
+            self.available = min(self.capacity, self.available + (now - self.last_refill_time) * self.refill_rate)
+            self.last_refill_time = now
+            if self.available >= amount:
+                self.available = self.available - amount
+                return 0.0
+            return (amount - self.available) / self.refill_rate
+
+    def acquire(self, amount=1):
+        wait_time = self.reserve(amount)
+        while wait_time > 0:
+            time.sleep(wait_time)
+            wait_time = self.reserve(amount)
+
+    async def acquire_async(self, amount=1):
+        wait_time = self.reserve(amount)
+        while wait_time > 0:
+            await asyncio.sleep(wait_time)
+            wait_time = self.reserve(amount)
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.consecutive_failures = 0
+        self.opened_time = None
+        self.lock = threading.Lock()
+
+    def before_call(self):
+        with self.lock:
+            if self.opened_time is None:
+                return
+            if time.monotonic() - self.opened_time < self.reset_timeout:
+                raise AIModelCircuitOpenError("AI model circuit breaker is open, call rejected.")
+            # half open: let calls through, the next failure opens the circuit again
+            self.opened_time = None
+            self.consecutive_failures = self.failure_threshold - 1
+
+    def record_success(self):
+        with self.lock:
+            self.consecutive_failures = 0
+
+    def record_failure(self):
+        with self.lock:
+            self.consecutive_failures = self.consecutive_failures + 1
+            if self.consecutive_failures >= self.failure_threshold and self.opened_time is None:
+                self.opened_time = time.monotonic()
+                logger.warning(f"AI model circuit breaker opened after {self.consecutive_failures} failures")
+
+
+class AdaptiveConcurrencyLimiter:
+    def __init__(self, initial_limit=4, min_limit=1, max_limit=64):
+        self.limit = initial_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.in_flight = 0
+        self.successes_since_increase = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= self.limit:
+                self.condition.wait()
+            self.in_flight = self.in_flight + 1
+
+    def try_acquire(self):
+        with self.condition:
+            if self.in_flight >= self.limit:
+                return False
+            self.in_flight = self.in_flight + 1
+            return True
+
+    async def acquire_async(self, poll_interval=0.01):
+        while not self.try_acquire():
+            await asyncio.sleep(poll_interval)
+
+    def release(self):
+        with self.condition:
+            self.in_flight = self.in_flight - 1
+            self.condition.notify_all()
+
+    def record_success(self):
+        # additive increase: one more slot after a full window of successful calls
+        with self.condition:
+            self.successes_since_increase = self.successes_since_increase + 1
+            if self.successes_since_increase >= self.limit and self.limit < self.max_limit:
+                self.limit = self.limit + 1
+                self.successes_since_increase = 0
+                self.condition.notify_all()
+
+    def record_throttling(self):
+        # multiplicative decrease as soon as the provider pushes back
+        with self.condition:
+            self.limit = max(self.min_limit, self.limit // 2)
+            self.successes_since_increase = 0
+        logger.info(f"AI model throttled, concurrency limit lowered to {self.limit}")
+
+
+class AIModelClient:
+    def __init__(
+            self,
+            requests_per_minute=500,
+            tokens_per_minute=150000,
+            max_retries=6,
+            base_delay=1.0,
+            max_delay=60.0,
+            initial_concurrency=4,
+            max_concurrency=64,
+            failure_threshold=5,
+            reset_timeout=30.0,
+            expected_output_tokens=1500,
+            ai_model_factory=None
+    ):
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.expected_output_tokens = expected_output_tokens
+        self.circuit_breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.concurrency_limiter = AdaptiveConcurrencyLimiter(initial_concurrency, max_limit=max_concurrency)
+        self.ai_model_factory = ai_model_factory or self.create_ai_model
+        self.ai_model = None
+        self.ai_model_lock = threading.Lock()
+
+    @staticmethod
+    def create_ai_model():
+        return ChatOpenAI(
+            openai_api_key=utils.openai_api_key,
+            openai_api_base=utils.openai_api_base or None,
+            model=utils.ai_model_name,
+            temperature=0,
+            top_p=0,
+            max_retries=0
+        )
+
+    def get_ai_model(self):
+        with self.ai_model_lock:
+            if self.ai_model is None:
+                self.ai_model = self.ai_model_factory()
+            return self.ai_model
+
+    def get_retry_delay(self, attempt, error):
+        retry_after = get_retry_after(error)
+        if retry_after is not None:
+            return retry_after
+        # full jitter keeps the workers that were throttled together from retrying together
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def get_estimated_tokens(self, array_messages):
+        return sum(estimate_tokens(str(message.content)) for message in array_messages) + self.expected_output_tokens
+
+    def record_failure(self, attempt, error):
+        if is_throttling_error(error):
+            self.concurrency_limiter.record_throttling()
+        else:
+            self.circuit_breaker.record_failure()
+        if not is_transient_error(error) or attempt == self.max_retries:
+            raise error
+        retry_delay = self.get_retry_delay(attempt, error)
+        logger.warning(f"AI model call failed ({type(error).__name__}), retry {attempt + 1} in {retry_delay:.1f}s")
+        return retry_delay
+
+    def record_stream_failure(self, error):
+        # a stream cut after its first chunk is not retried here, it still counts against the provider
+        if is_throttling_error(error):
+            self.concurrency_limiter.record_throttling()
+        else:
+            self.circuit_breaker.record_failure()
+
+    def record_success(self):
+        self.circuit_breaker.record_success()
+        self.concurrency_limiter.record_success()
+
+    def call_with_retries(self, array_messages, ai_model_call, is_slot_kept=False):
+        estimated_tokens = self.get_estimated_tokens(array_messages)
+
+        for attempt in range(self.max_retries + 1):
+            self.circuit_breaker.before_call()
+            self.request_bucket.acquire()
+            self.token_bucket.acquire(estimated_tokens)
+            self.concurrency_limiter.acquire()
+            is_call_failed = True
+            try:
+                result = ai_model_call(self.get_ai_model(), array_messages)
+                is_call_failed = False
+            except Exception as e:
+                retry_delay = self.record_failure(attempt, e)
+            else:
+                self.record_success()
+                return result
+            finally:
+                # a kept slot is released by the caller once the stream is over
+                if is_call_failed or not is_slot_kept:
+                    self.concurrency_limiter.release()
+            time.sleep(retry_delay)
+
+    async def call_with_retries_async(self, array_messages, ai_model_call, is_slot_kept=False):
+        estimated_tokens = self.get_estimated_tokens(array_messages)
+
+        for attempt in range(self.max_retries + 1):
+            self.circuit_breaker.before_call()
+            await self.request_bucket.acquire_async()
+            await self.token_bucket.acquire_async(estimated_tokens)
+            await self.concurrency_limiter.acquire_async()
+            is_call_failed = True
+            try:
+                result = await ai_model_call(self.get_ai_model(), array_messages)
+                is_call_failed = False
+            except Exception as e:
+                retry_delay = self.record_failure(attempt, e)
+            else:
+                self.record_success()
+                return result
+            finally:
+                if is_call_failed or not is_slot_kept:
+                    self.concurrency_limiter.release()
+            await asyncio.sleep(retry_delay)
+
+    def invoke(self, array_messages):
+        return self.call_with_retries(
+            array_messages,
+            lambda ai_model, messages: ai_model.invoke(messages).content
+        )
+
+    @staticmethod
+    def start_stream(ai_model, array_messages):
+        iterator_chunks = iter(ai_model.stream(array_messages))
+        return iterator_chunks, next(iterator_chunks, None)
+
+    def stream(self, array_messages):
+        # retries cover the request up to its first chunk, the chunks after it are yielded as they arrive
+        iterator_chunks, first_chunk = self.call_with_retries(array_messages, self.start_stream, is_slot_kept=True)
+        try:
+            if first_chunk is None:
+                return
+            yield first_chunk.content
+            for chunk in iterator_chunks:
+                yield chunk.content
+        except Exception as e:
+            self.record_stream_failure(e)
+            raise
+        finally:
+            self.concurrency_limiter.release()
+
+    async def invoke_async(self, array_messages):
+        async def invoke_ai_model(ai_model, messages):
+            return (await ai_model.ainvoke(messages)).content
+
+        return await self.call_with_retries_async(array_messages, invoke_ai_model)
+
+    @staticmethod
+    async def start_stream_async(ai_model, array_messages):
+        iterator_chunks = ai_model.astream(array_messages).__aiter__()
+        try:
+            return iterator_chunks, await iterator_chunks.__anext__()
+        except StopAsyncIteration:
+            return iterator_chunks, None
+
+    async def stream_async(self, array_messages):
+        iterator_chunks, first_chunk = await self.call_with_retries_async(
+            array_messages,
+            self.start_stream_async,
+            is_slot_kept=True
+        )
+        try:
+            if first_chunk is None:
+                return
+            yield first_chunk.content
+            async for chunk in iterator_chunks:
+                yield chunk.content
+        except Exception as e:
+            self.record_stream_failure(e)
+            raise
+        finally:
+            self.concurrency_limiter.release()
@@ -1,8 +1,12 @@
 import multiprocessing
+import time
 import layoutparser as lp
 
+from metrics_registry import model_inference_histogram, model_load_histogram
+
 class AIModelHandler:
     def __init__(self):
+        start_time = time.perf_counter()
         self.detectron2_model = lp.Detectron2LayoutModel(
             config_path='config.yaml',
             extra_config=["MODEL.ROI_HEADS.SCORE_THRESH_TEST", 0.65],
@@ -14,15 +18,24 @@ class AIModelHandler:
                 4: "Figure"
             }
         )
+        model_load_histogram.observe(time.perf_counter() - start_time, model="detectron2")
+        start_time = time.perf_counter()
         self.tesseract_model = lp.TesseractAgent(languages='eng')
+        model_load_histogram.observe(time.perf_counter() - start_time, model="tesseract")
 
         self.detectron2_lock = multiprocessing.Lock()
         self.tesseract_lock = multiprocessing.Lock()
 
     def use_detectron2(self, image):
         with self.detectron2_lock:
-            return self.detectron2_model.detect(image)
+            start_time = time.perf_counter()
+            layout = self.detectron2_model.detect(image)
+            model_inference_histogram.observe(time.perf_counter() - start_time, model="detectron2")
+            return layout
 
     def use_tesseract(self, image):
         with self.tesseract_lock:
-            return self.tesseract_model.detect(image)
\ No newline at end of file
+            start_time = time.perf_counter()
+            text = self.tesseract_model.detect(image)
+            model_inference_histogram.observe(time.perf_counter() - start_time, model="tesseract")
+            return text
\ No newline at end of file
@@ -0,0 +1,67 @@
+import contextvars
+import threading
+from contextlib import contextmanager
+
+# concurrent runs share the process-wide usage, each also counts its own calls
+active_run_usage = contextvars.ContextVar("active_run_usage", default=None)
+
+
+def estimate_tokens(text):
+    return estimate_tokens_from_length(len(text) if text else 0)
+
+
+def estimate_tokens_from_length(number_characters):
+    # ~4 characters per token for the English/JSON mix we send to the model
+    return max(1, number_characters // 4) if number_characters else 0
+
+
+class AIModelUsage:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.input_tokens = {}
+
+    def add_call(self, stage_name, input_tokens):
+        with self.lock:
+            self.calls[stage_name] = self.calls.get(stage_name, 0) + 1
+            self.input_tokens[stage_name] = self.input_tokens.get(stage_name, 0) + input_tokens
+
+    def record_call(self, stage_name, human_message):
+        input_tokens = estimate_tokens(human_message)
+        self.add_call(stage_name, input_tokens)
+        run_usage = active_run_usage.get()
+        if run_usage is not None and run_usage is not self:
+            run_usage.add_call(stage_name, input_tokens)
+
+    def get_snapshot(self):
+        with self.lock:
+            return {
+                "calls": sum(self.calls.values()),
+                "input_tokens": sum(self.input_tokens.values()),
+                "calls_per_stage": dict(self.calls),
+                "input_tokens_per_stage": dict(self.input_tokens)
+            }
+
+    def get_difference(self, snapshot):
+        current_snapshot = self.get_snapshot()
+        return {
+            "calls": current_snapshot["calls"] - snapshot["calls"],
+            "input_tokens": current_snapshot["input_tokens"] - snapshot["input_tokens"]
+        }
+
+
+ai_model_usage = AIModelUsage()
+
+
+def get_run_usage():
+    run_usage = active_run_usage.get()
+    return ai_model_usage if run_usage is None else run_usage
+
+
+@contextmanager
+def track_run_usage():
+    run_usage_token = active_run_usage.set(AIModelUsage())
+    try:
+        yield
+    finally:
+        active_run_usage.reset(run_usage_token)
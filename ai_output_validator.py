@@ -0,0 +1,193 @@
+import json
+import re
+
+import sbe_type_inference
+import utils
+
+sbe_presences = ["mandatory", "optional", "constant"]
+code_fence_pattern = re.compile(r"```[a-zA-Z]*")
+object_text_field_id_keys = ["group_id", "field_id"] + utils.document_field_tag_keys
+object_text_field_id_pattern = re.compile(
+    r'"(?:{})"\s*:\s*"?\s*(\d+)'.format("|".join(map(re.escape, object_text_field_id_keys))),
+    re.IGNORECASE
+)
+
+
+def strip_code_fences(text):
+    return code_fence_pattern.sub("", text).strip()
+
+
+def remove_trailing_commas(text):
+    characters = []
+    is_in_string = False
+    is_escaped = False
+
+    for character in text:
+        if is_in_string:
+            if is_escaped:
+                is_escaped = False
+            elif character == "\\":
+                is_escaped = True
+            elif character == '"':
+                is_in_string = False
+        elif character == '"':
+            is_in_string = True
+        elif character in "}]":
+            # drop the comma (and the blanks after it) closing the previous value
+            index = len(characters) - 1
+            while index >= 0 and characters[index].isspace():
+                index = index - 1
+            if index >= 0 and characters[index] == ",":
+                del characters[index]
+        characters.append(character)
+
+    return "".join(characters)
+
+
+def load_json_repaired(text):
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return json.loads(remove_trailing_commas(strip_code_fences(text)))
+
+
+def coerce_integer(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str) and re.fullmatch(r"\s*-?\d+(\.0+)?\s*", value):
+        return int(float(value))
+    return None
+
+
+def validate_sbe_field(json_object):
+    if not isinstance(json_object, dict):
+        return None, [f"not a JSON object: {json_object!r}"]
+
+    sbe_field = dict(json_object)
+    array_errors = []
+
+    for key in ["field_id", "length"]:
+        # a field the document lists without a tag comes back without one, its name tells it apart
+        if key == "field_id" and sbe_field.get(key) in [None, ""]:
+            sbe_field[key] = None
+            continue
+        value = coerce_integer(sbe_field.get(key))
+        if value is None:
+            array_errors.append(f"{key} is not an integer: {sbe_field.get(key)!r}")
+        sbe_field[key] = value
+
+    for key in ["field_name", "data_type", "encoding_type"]:
+        value = sbe_field.get(key)
+        if not isinstance(value, str) or not value.strip():
+            array_errors.append(f"{key} is missing")
+        else:
+            sbe_field[key] = value.strip()
+
+    presence = str(sbe_field.get("presence", "")).strip().lower()
+    if presence not in sbe_presences:
+        array_errors.append(f"presence is not one of {sbe_presences}: {sbe_field.get('presence')!r}")
+    sbe_field["presence"] = presence
+
+    structure = sbe_field.get("structure")
+    if structure in [None, "", []]:
+        structure = {}
+    elif isinstance(structure, str):
+        try:
+            structure = load_json_repaired(structure)
+        except json.JSONDecodeError:
+            pass
+    if not isinstance(structure, dict):
+        array_errors.append(f"structure is not a JSON object: {structure!r}")
+    else:
+        structure = {str(value): str(name) for value, name in structure.items()}
+    sbe_field["structure"] = structure
+
+    return sbe_field, array_errors
+
+
+def validate_sbe_field_for_document(sbe_field, document_field):
+    # an answer is only learned by the local caches once it agrees with the row it was asked for
+    sbe_field = dict(sbe_field)
+    kind = sbe_type_inference.get_custom_type_kind(sbe_field["data_type"])
+    field_name = sbe_type_inference.parse_field_name(document_field) or sbe_field["field_name"]
+    if kind is not None:
+        sbe_field["data_type"] = sbe_type_inference.get_custom_data_type(field_name, kind)
+
+    return sbe_field, sbe_type_inference.get_document_disagreements(document_field, sbe_field)
+
+
+def validate_document_field(json_object):
+    if not isinstance(json_object, dict):
+        return None, [f"not a JSON object: {json_object!r}"]
+
+    # columns are free text: values the model returned as numbers or nulls are read back as text
+    document_field = {
+        str(key): "" if value is None else value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+        for key, value in json_object.items()
+    }
+
+    if utils.get_document_field_id(document_field) is None \
+            and utils.get_document_field_value(document_field, utils.document_field_name_keys) is None:
+        return document_field, ["neither a tag nor a field name"]
+    return document_field, []
+
+
+def validate_repeating_group(json_object):
+    if not isinstance(json_object, dict):
+        return None, [f"not a JSON object: {json_object!r}"]
+
+    repeating_group = dict(json_object)
+    array_errors = []
+
+    if coerce_integer(repeating_group.get("group_id")) is None:
+        array_errors.append(f"group_id is not a tag: {repeating_group.get('group_id')!r}")
+    else:
+        repeating_group["group_id"] = str(coerce_integer(repeating_group["group_id"]))
+
+    if not isinstance(repeating_group.get("group_name"), str) or not repeating_group["group_name"].strip():
+        array_errors.append("group_name is missing")
+
+    items = repeating_group.get("items")
+    if not isinstance(items, list) or not items:
+        array_errors.append("items is not a non-empty JSON array")
+    else:
+        repeating_group["items"] = []
+        for item in items:
+            document_field, array_item_errors = validate_document_field(item)
+            if array_item_errors:
+                array_errors.append(f"item {array_item_errors[0]}")
+            repeating_group["items"].append(document_field)
+
+    return repeating_group, array_errors
+
+
+stage_validators = {
+    "generate_document_fields": validate_document_field,
+    "generate_repeating_groups": validate_repeating_group,
+    "generate_sbe_fields": validate_sbe_field
+}
+
+
+def validate_stage_output(stage_name, json_objects):
+    validate_function = stage_validators[stage_name]
+    array_valid_objects = []
+    array_invalid_objects = []
+
+    for json_object in json_objects:
+        repaired_object, array_errors = validate_function(json_object)
+        if array_errors:
+            array_invalid_objects.append({"json_object": json_object, "errors": array_errors})
+        else:
+            array_valid_objects.append(repaired_object)
+
+    return array_valid_objects, array_invalid_objects
+
+
+def get_object_text_field_id(object_text):
+    # unparsable objects still name their row most of the time
+    match = object_text_field_id_pattern.search(object_text)
+    return str(int(match.group(1))) if match else None
@@ -0,0 +1,268 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+
+import ai_engine_module
+import repeating_group_detector
+import table_page_scout
+import utils
+from json_schema_handler import JsonSchemaHandler
+from metrics_registry import start_metrics_server
+
+logger = logging.getLogger(__name__)
+
+
+def parse_page_range(page_range):
+    starting_page, _, ending_page = str(page_range).partition("-")
+    return int(starting_page), int(ending_page or starting_page)
+
+
+def load_batch_manifest(manifest_path):
+    with open(manifest_path, 'r', encoding='utf-8') as file:
+        manifest = json.load(file)
+
+    array_messages = []
+    for message in manifest["messages"]:
+        if not message.get("pdf_path") or not message.get("message_name"):
+            raise ValueError(f"every message of {manifest_path} needs pdf_path and message_name: {message}")
+        page_ranges = message.get("page_ranges", "auto")
+        array_messages.append({
+            **message,
+            "page_ranges": None if page_ranges == "auto"
+            else [parse_page_range(page_range) for page_range in page_ranges]
+        })
+    return array_messages
+
+
+def resolve_message_page_ranges(array_messages, max_page_gap=0):
+    # messages without page ranges are scouted once per PDF: only its table pages go through the full pipeline
+    dict_discovered_page_ranges = {}
+    array_resolved_messages = []
+    array_failed_message_results = []
+
+    for message in array_messages:
+        if message["page_ranges"] is not None:
+            array_resolved_messages.append(message)
+            continue
+
+        try:
+            if message["pdf_path"] not in dict_discovered_page_ranges:
+                dict_discovered_page_ranges[message["pdf_path"]] = table_page_scout.discover_table_page_ranges(
+                    message["pdf_path"],
+                    max_page_gap=max_page_gap
+                )
+        except Exception as e:
+            logger.error(f"cannot scout the table pages of {message['pdf_path']}: {e}")
+            array_failed_message_results.append({"message": {**message, "page_ranges": []}, "error": str(e)})
+            continue
+        array_page_ranges = dict_discovered_page_ranges[message["pdf_path"]]
+
+        if not message.get("split_messages"):
+            array_resolved_messages.append({**message, "page_ranges": array_page_ranges})
+            continue
+        # every table found becomes a message of its own
+        for page_range_index, (starting_page, ending_page) in enumerate(array_page_ranges):
+            array_resolved_messages.append({
+                **message,
+                "message_name": f"{message['message_name']}_{starting_page}_{ending_page}",
+                "template_id": message.get("template_id", 0) + page_range_index,
+                "page_ranges": [(starting_page, ending_page)]
+            })
+
+    return array_resolved_messages, array_failed_message_results
+
+
+def merge_sbe_message_components(array_sbe_message_components):
+    # a field printed on two page ranges of the same message is kept once, untagged fields by their name
+    dict_sbe_fields = {}
+    for json_array_sbe_fields, _ in array_sbe_message_components:
+        for sbe_field in json_array_sbe_fields:
+            dict_sbe_fields.setdefault(ai_engine_module.get_sbe_field_key(sbe_field), sbe_field)
+    json_array_repeating_groups = repeating_group_detector.merge_repeating_groups(
+        [json_array_repeating_groups for _, json_array_repeating_groups in array_sbe_message_components]
+    )
+    return list(dict_sbe_fields.values()), json_array_repeating_groups
+
+
+def get_number_fields(json_array_sbe_fields, json_array_repeating_groups):
+    return len(json_array_sbe_fields) + sum(
+        len(repeating_group["items"]) for repeating_group in json_array_repeating_groups
+    )
+
+
+async def process_message(message, page_process_pool, number_page_workers, resume):
+    start_time = time.perf_counter()
+    array_run_reports = [{} for _ in message["page_ranges"]]
+
+    # the page ranges of every message run at once: their pages share the global pool with all the other messages
+    array_sbe_message_components = await asyncio.gather(*[
+        ai_engine_module.process_async(
+            message["pdf_path"],
+            starting_page,
+            ending_page,
+            run_report=run_report,
+            number_page_workers=number_page_workers,
+            page_process_pool=page_process_pool,
+            resume=resume
+        )
+        for (starting_page, ending_page), run_report in zip(message["page_ranges"], array_run_reports)
+    ])
+    json_array_sbe_fields, json_array_repeating_groups = merge_sbe_message_components(array_sbe_message_components)
+
+    return {
+        "message": message,
+        "json_array_sbe_fields": json_array_sbe_fields,
+        "json_array_repeating_groups": json_array_repeating_groups,
+        "pages": sum(ending_page - starting_page + 1 for starting_page, ending_page in message["page_ranges"]),
+        "fields": get_number_fields(json_array_sbe_fields, json_array_repeating_groups),
+        "seconds": round(time.perf_counter() - start_time, 2),
+        "restored_stages": sum(run_report["checkpoints"]["reused"] for run_report in array_run_reports)
+    }
+
+
+async def process_message_safely(message, page_process_pool, number_page_workers, resume):
+    try:
+        return await process_message(message, page_process_pool, number_page_workers, resume)
+    except Exception as e:
+        # one broken document does not stop the rest of the batch
+        logger.error(f"message '{message['message_name']}' of {message['pdf_path']} failed: {e}")
+        return {"message": message, "error": str(e)}
+
+
+def write_message_output(output_directory, message_result):
+    message = message_result["message"]
+    message_directory = os.path.join(output_directory, message.get("json_schema_name") or "messages")
+    utils.create_directory_if_not_exists(message_directory)
+
+    output_path = os.path.join(message_directory, f"{message['message_name']}.json")
+    utils.write_text_file_atomically(output_path, json.dumps({
+        "pdf_path": message["pdf_path"],
+        "page_ranges": [f"{starting_page}-{ending_page}" for starting_page, ending_page in message["page_ranges"]],
+        "message_name": message["message_name"],
+        "template_id": message.get("template_id"),
+        "json_array_sbe_fields": message_result["json_array_sbe_fields"],
+        "json_array_repeating_groups": message_result["json_array_repeating_groups"]
+    }, indent=4, ensure_ascii=False))
+    return output_path
+
+
+def add_message_to_json_schema(message_result):
+    message = message_result["message"]
+    try:
+        json_handler = JsonSchemaHandler(message["json_schema_name"])
+    except KeyError as e:
+        logger.warning(f"message '{message['message_name']}' is not added to a JSON schema: {e}")
+        return
+
+    json_handler.add_document_message(message["message_name"], message.get("template_id", 0))
+
+    json_handler.add_sbe_fields_to_message(message["message_name"], message_result["json_array_sbe_fields"])
+
+    for repeating_group in message_result["json_array_repeating_groups"]:
+        json_handler.add_repeating_group_to_message(
+            message["message_name"],
+            repeating_group["group_name"],
+            repeating_group["group_id"]
+        )
+        json_handler.add_sbe_fields_to_repeating_group(
+            message["message_name"],
+            repeating_group["group_id"],
+            repeating_group["items"]
+        )
+
+
+async def run_batch(array_messages, output_directory, number_page_workers, resume, max_page_gap=0):
+    start_time = time.perf_counter()
+    array_messages, array_failed_message_results = await asyncio.to_thread(
+        resolve_message_page_ranges,
+        array_messages,
+        max_page_gap
+    )
+
+    # one pool for the whole batch: the pages of every document are spread over the same warm workers
+    page_process_pool = ai_engine_module.create_page_process_pool(number_page_workers) \
+        if number_page_workers > 1 else None
+    try:
+        array_message_results = await asyncio.gather(*[
+            process_message_safely(message, page_process_pool, number_page_workers, resume)
+            for message in array_messages
+        ])
+    finally:
+        if page_process_pool is not None:
+            page_process_pool.shutdown()
+    elapsed_time = time.perf_counter() - start_time
+    array_message_results = array_message_results + array_failed_message_results
+
+    for message_result in array_message_results:
+        if "error" in message_result:
+            continue
+        message_result["output_path"] = write_message_output(output_directory, message_result)
+        if message_result["message"].get("json_schema_name"):
+            add_message_to_json_schema(message_result)
+
+    return array_message_results, elapsed_time
+
+
+def print_batch_report(array_message_results, elapsed_time):
+    array_done_results = [message_result for message_result in array_message_results if "error" not in message_result]
+    number_pages = sum(message_result["pages"] for message_result in array_done_results)
+    number_fields = sum(message_result["fields"] for message_result in array_done_results)
+
+    print(f"{'document':<40} {'message':<30} {'pages':>6} {'fields':>7} {'restored':>9} {'seconds':>9}")
+    for message_result in array_message_results:
+        message = message_result["message"]
+        if "error" in message_result:
+            print(f"{message['pdf_path']:<40} {message['message_name']:<30} failed: {message_result['error']}")
+            continue
+        print(
+            f"{message['pdf_path']:<40} {message['message_name']:<30} {message_result['pages']:>6} "
+            f"{message_result['fields']:>7} {message_result['restored_stages']:>9} {message_result['seconds']:>9}"
+        )
+    print(
+        f"{len(array_done_results)}/{len(array_message_results)} messages, {number_pages} pages, "
+        f"{number_fields} fields in {elapsed_time:.2f}s: {number_pages / max(elapsed_time, 1e-9):.3f} pages/s, "
+        f"{number_fields / max(elapsed_time, 1e-9):.3f} fields/s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Extract the SBE messages listed in a manifest: PDF, page ranges and target schema/message."
+    )
+    parser.add_argument("manifest", help="JSON file with a 'messages' list of pdf_path, message_name and optionally "
+                                         "page_ranges (found by scouting the PDF when missing or 'auto'), "
+                                         "split_messages, json_schema_name and template_id")
+    parser.add_argument("--output-directory", default="batch_output")
+    parser.add_argument("--workers", type=int, default=utils.number_page_workers)
+    parser.add_argument("--max-page-gap", type=int, default=0,
+                        help="pages without a table allowed inside one scouted page range")
+    parser.add_argument("--resume", action="store_true",
+                        help="reuse the checkpoints of an earlier run for every stage whose inputs are unchanged")
+    parser.add_argument("--metrics-port", type=int,
+                        help="serve the engine metrics in the Prometheus text format on this local port")
+    arguments = parser.parse_args()
+
+    if arguments.metrics_port is not None:
+        start_metrics_server(arguments.metrics_port)
+    array_messages = load_batch_manifest(arguments.manifest)
+    array_message_results, elapsed_time = asyncio.run(
+        run_batch(
+            array_messages,
+            arguments.output_directory,
+            arguments.workers,
+            arguments.resume,
+            arguments.max_page_gap
+        )
+    )
+    print_batch_report(array_message_results, elapsed_time)
+
+    if any("error" in message_result for message_result in array_message_results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
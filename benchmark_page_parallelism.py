@@ -0,0 +1,89 @@
+import argparse
+import logging
+import os
+import time
+
+import ai_engine_module
+import utils
+
+logger = logging.getLogger(__name__)
+
+
+def get_worker_pid(_):
+    # long enough for every worker of the pool to take one
+    time.sleep(0.2)
+    return os.getpid()
+
+
+def create_warm_page_process_pool(number_page_workers):
+    # the workers are spawned and load their models before the clock starts: only the throughput is measured
+    page_process_pool = ai_engine_module.create_page_process_pool(number_page_workers)
+    number_warm_workers = len(set(page_process_pool.map(get_worker_pid, range(number_page_workers))))
+    logger.info(f"{number_warm_workers} of {number_page_workers} page workers warm")
+    return page_process_pool
+
+
+def measure_throughput(pdf_path, starting_page, ending_page, number_page_workers, page_process_pool=None):
+    # one worker is the serial baseline: one page thread and no process pool
+    start_time = time.perf_counter()
+    ai_engine_module.process(
+        pdf_path,
+        starting_page,
+        ending_page,
+        number_page_workers=number_page_workers,
+        page_process_pool=page_process_pool
+    )
+    elapsed_time = time.perf_counter() - start_time
+
+    number_pages = ending_page - starting_page + 1
+    return {
+        "pages": f"{starting_page}-{ending_page}",
+        "workers": number_page_workers,
+        "seconds": round(elapsed_time, 2),
+        "pages_per_second": round(number_pages / elapsed_time, 3)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare serial and parallel page processing throughput.")
+    parser.add_argument("--pdf", default="pdf_documents/drop_copy_service.pdf")
+    parser.add_argument("--page-ranges", nargs="+", default=["24-26", "10-40"])
+    parser.add_argument("--workers", type=int, default=utils.number_page_workers)
+    arguments = parser.parse_args()
+
+    # the serial baseline loads its models in this process, also before the clock starts
+    ai_engine_module.get_ai_model_handler()
+    page_process_pool = create_warm_page_process_pool(arguments.workers) if arguments.workers > 1 else None
+
+    array_results = []
+    try:
+        for page_range in arguments.page_ranges:
+            starting_page, ending_page = (int(page) for page in page_range.split("-"))
+            for number_page_workers in sorted({1, arguments.workers}):
+                result = measure_throughput(
+                    arguments.pdf,
+                    starting_page,
+                    ending_page,
+                    number_page_workers,
+                    page_process_pool if number_page_workers > 1 else None
+                )
+                logger.info(f"benchmark result: {result}")
+                array_results.append(result)
+    finally:
+        if page_process_pool is not None:
+            page_process_pool.shutdown()
+
+    print(f"{'pages':>8} {'workers':>8} {'seconds':>9} {'pages/s':>8} {'speedup':>8}")
+    for result in array_results:
+        serial_result = next(
+            serial_result for serial_result in array_results
+            if serial_result["pages"] == result["pages"] and serial_result["workers"] == 1
+        )
+        print(
+            f"{result['pages']:>8} {result['workers']:>8} {result['seconds']:>9} {result['pages_per_second']:>8} "
+            f"{result['pages_per_second'] / serial_result['pages_per_second']:>7.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
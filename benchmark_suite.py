@@ -0,0 +1,330 @@
+import argparse
+import json
+import logging
+import math
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+import ai_engine_module
+import batch_module
+import utils
+from field_similarity_index import FieldSimilarityIndex
+from fix_tag_knowledge_base import FixTagKnowledgeBase
+from json_schema_handler import JsonSchemaHandler
+from stage_memory_profiler import PeakMemorySampler
+from stage_result import StageResult
+from xml_sbe_schema_handler import XmlSbeSchemaHandler, generate_sbe_data_type_definitions, \
+    generate_xml_schema_from_json_schema
+
+logger = logging.getLogger(__name__)
+
+default_page_sets = [
+    "pdf_documents/drop_copy_service.pdf:24-26",
+    "pdf_documents/fix.pdf:5-7",
+    "pdf_documents/xetra.pdf:21-23"
+]
+image_stage_names = ["convert_grayscale", "increase_contrast", "thresholding", "detect_tables", "ocr_tables"]
+default_results_path = "benchmark_results.json"
+default_baseline_path = "benchmark_baseline.json"
+
+
+def parse_page_set(page_set):
+    pdf_path, _, page_range = page_set.rpartition(":")
+    starting_page, ending_page = batch_module.parse_page_range(page_range)
+    return {"page_set": page_set, "pdf_path": pdf_path, "starting_page": starting_page, "ending_page": ending_page}
+
+
+def get_percentile(array_values, percentile):
+    # nearest rank: with a handful of repetitions an interpolated p95 would be made up
+    array_sorted_values = sorted(array_values)
+    return array_sorted_values[max(math.ceil(percentile / 100 * len(array_sorted_values)) - 1, 0)]
+
+
+def measure_stage(dict_stage_measurements, stage_name, number_pages, function, *args):
+    with PeakMemorySampler() as memory_sampler:
+        start_time = time.perf_counter()
+        output = function(*args)
+        elapsed_time = time.perf_counter() - start_time
+
+    stage_measurements = dict_stage_measurements.setdefault(
+        stage_name,
+        {"seconds": [], "pages": 0, "peak_memory": None, "peak_memory_increase": None}
+    )
+    stage_measurements["seconds"].append(elapsed_time)
+    stage_measurements["pages"] = stage_measurements["pages"] + number_pages
+    if memory_sampler.peak_memory is not None:
+        stage_measurements["peak_memory"] = max(stage_measurements["peak_memory"] or 0, memory_sampler.peak_memory)
+        stage_measurements["peak_memory_increase"] = max(
+            stage_measurements["peak_memory_increase"] or 0,
+            memory_sampler.peak_memory - memory_sampler.starting_memory
+        )
+    return output
+
+
+def reset_sbe_typing_caches(folder_path):
+    # every repetition types the fields from the same seeded caches, and the caches of the user are never touched
+    ai_engine_module.fix_tag_knowledge_base = FixTagKnowledgeBase(
+        os.path.join(folder_path, "fix_tag_knowledge_base.json")
+    )
+    ai_engine_module.field_similarity_index = FieldSimilarityIndex(
+        os.path.join(folder_path, "field_similarity_index.json")
+    )
+
+
+def generate_json_schema(json_schema_name, sbe_message_components):
+    JsonSchemaHandler(
+        json_schema_name,
+        "http://fixprotocol.io/2016/sbe",
+        "enx",
+        "http://exslt.org/strings",
+        "http://exslt.org/common",
+        f"{json_schema_name}.benchmark",
+        "1",
+        "1",
+        "1.0.0",
+        "benchmark schema",
+        "littleEndian"
+    )
+    batch_module.add_message_to_json_schema({
+        "message": {"json_schema_name": json_schema_name, "message_name": "BenchmarkMessage", "template_id": 1},
+        **sbe_message_components
+    })
+
+    json_handler = JsonSchemaHandler(json_schema_name)
+    json_handler.iterate_sbe_fields_of_document_messages(
+        lambda sbe_field: generate_sbe_data_type_definitions(json_handler, sbe_field)
+    )
+    return json_handler
+
+
+def generate_xml_schema(json_schema_name, json_handler):
+    xml_handler = XmlSbeSchemaHandler(json_schema_name)
+    generate_xml_schema_from_json_schema(json_handler, xml_handler)
+    return xml_handler
+
+
+def remove_schema_files(json_schema_name):
+    for file_path in [
+        f"{json_schema_name.lower()}_json_schema.json",
+        f"{json_schema_name.lower()}_sbe_xml_schema.xml"
+    ]:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+
+def run_page_set_pass(page_set, folder_path, dict_stage_measurements):
+    starting_page, ending_page = page_set["starting_page"], page_set["ending_page"]
+    number_pages = ending_page - starting_page + 1
+
+    measure_stage(
+        dict_stage_measurements,
+        "convert_pdf_pages_to_jpg",
+        number_pages,
+        ai_engine_module.convert_pdf_pages_to_jpg,
+        page_set["pdf_path"],
+        starting_page,
+        ending_page,
+        folder_path
+    )
+
+    json_array_document_fields_pages = []
+    for page_number in range(starting_page, ending_page + 1):
+        data = os.path.join(folder_path, f"page_{page_number}.jpg")
+        for stage_name in image_stage_names:
+            data = measure_stage(dict_stage_measurements, stage_name, 1, getattr(ai_engine_module, stage_name), data)
+            # a page without tables stops where the engine stops it
+            if data is None or isinstance(data, StageResult):
+                break
+        else:
+            json_array_document_fields_pages.append(measure_stage(
+                dict_stage_measurements,
+                "generate_document_fields",
+                1,
+                lambda data: list(ai_engine_module.generate_document_fields(data)),
+                data
+            ))
+
+    reset_sbe_typing_caches(folder_path)
+    sbe_message_components = measure_stage(
+        dict_stage_measurements,
+        "generate_sbe_message_components",
+        number_pages,
+        ai_engine_module.generate_sbe_message_components,
+        json_array_document_fields_pages
+    )
+
+    json_schema_name = f"benchmark_{os.getpid()}"
+    try:
+        json_handler = measure_stage(
+            dict_stage_measurements,
+            "generate_json_schema",
+            number_pages,
+            generate_json_schema,
+            json_schema_name,
+            sbe_message_components
+        )
+        measure_stage(
+            dict_stage_measurements,
+            "generate_xml_schema",
+            number_pages,
+            generate_xml_schema,
+            json_schema_name,
+            json_handler
+        )
+    finally:
+        remove_schema_files(json_schema_name)
+
+
+def get_stage_results(dict_stage_measurements):
+    dict_stage_results = {}
+    for stage_name, stage_measurements in dict_stage_measurements.items():
+        array_seconds = stage_measurements["seconds"]
+        dict_stage_results[stage_name] = {
+            "calls": len(array_seconds),
+            "pages": stage_measurements["pages"],
+            "median_seconds": round(statistics.median(array_seconds), 6),
+            "p95_seconds": round(get_percentile(array_seconds, 95), 6),
+            "pages_per_second": round(stage_measurements["pages"] / max(sum(array_seconds), 1e-9), 3),
+            "peak_memory_mb": None if stage_measurements["peak_memory"] is None
+            else round(stage_measurements["peak_memory"] / 2 ** 20, 1),
+            "peak_memory_increase_mb": None if stage_measurements["peak_memory_increase"] is None
+            else round(stage_measurements["peak_memory_increase"] / 2 ** 20, 1)
+        }
+    return dict_stage_results
+
+
+def run_benchmark(array_page_sets, number_repetitions, number_warmup_repetitions=1):
+    # the AI model stages are timed on the recorded answers: no network, no cost, the same input every time
+    utils.use_recorded_ai_model_responses = True
+    ai_engine_module.get_ai_model_handler()
+
+    dict_results = {}
+    saved_knowledge_base, saved_similarity_index = \
+        ai_engine_module.fix_tag_knowledge_base, ai_engine_module.field_similarity_index
+    try:
+        for page_set in array_page_sets:
+            dict_stage_measurements = {}
+            for repetition in range(number_warmup_repetitions + number_repetitions):
+                with tempfile.TemporaryDirectory(prefix="benchmark_pages_") as folder_path:
+                    # the warm-up passes load the models and fill the OS caches, they are not measured
+                    run_page_set_pass(
+                        page_set,
+                        folder_path,
+                        dict_stage_measurements if repetition >= number_warmup_repetitions else {}
+                    )
+            dict_results[page_set["page_set"]] = get_stage_results(dict_stage_measurements)
+            logger.info(f"benchmark of {page_set['page_set']} done")
+    finally:
+        ai_engine_module.fix_tag_knowledge_base, ai_engine_module.field_similarity_index = \
+            saved_knowledge_base, saved_similarity_index
+
+    return {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python_version": platform.python_version(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "repetitions": number_repetitions,
+        "page_sets": dict_results
+    }
+
+
+def is_regression(current_value, baseline_value, tolerance, min_difference):
+    # tiny stages are all noise: a regression has to be worse in relative and in absolute terms
+    if current_value is None or baseline_value is None:
+        return False
+    return current_value > baseline_value * (1 + tolerance) and current_value - baseline_value > min_difference
+
+
+def find_regressions(benchmark_results, baseline_results, tolerance, min_regression_seconds, min_regression_mb=1.0):
+    array_regressions = []
+    for page_set, dict_stage_results in benchmark_results["page_sets"].items():
+        dict_baseline_stage_results = baseline_results["page_sets"].get(page_set, {})
+        for stage_name, stage_result in dict_stage_results.items():
+            baseline_stage_result = dict_baseline_stage_results.get(stage_name)
+            if baseline_stage_result is None:
+                continue
+            for metric, min_difference in [
+                ("median_seconds", min_regression_seconds),
+                ("peak_memory_increase_mb", min_regression_mb)
+            ]:
+                if is_regression(stage_result[metric], baseline_stage_result.get(metric), tolerance, min_difference):
+                    array_regressions.append({
+                        "page_set": page_set,
+                        "stage_name": stage_name,
+                        "metric": metric,
+                        "baseline": baseline_stage_result[metric],
+                        "current": stage_result[metric]
+                    })
+    return array_regressions
+
+
+def print_benchmark_results(benchmark_results):
+    print(f"{'page set':<45} {'stage':<33} {'calls':>5} {'median ms':>10} {'p95 ms':>10} {'pages/s':>10} "
+          f"{'peak MB':>8} {'+MB':>7}")
+    for page_set, dict_stage_results in benchmark_results["page_sets"].items():
+        for stage_name, stage_result in dict_stage_results.items():
+            print(
+                f"{page_set:<45} {stage_name:<33} {stage_result['calls']:>5} "
+                f"{stage_result['median_seconds'] * 1000:>10.1f} {stage_result['p95_seconds'] * 1000:>10.1f} "
+                f"{stage_result['pages_per_second']:>10.1f} {str(stage_result['peak_memory_mb']):>8} "
+                f"{str(stage_result['peak_memory_increase_mb']):>7}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time every stage of the engine on fixed page sets and compare them with a stored baseline."
+    )
+    parser.add_argument("--page-sets", nargs="+", default=default_page_sets, help="pdf_path:starting-ending")
+    parser.add_argument("--repetitions", type=int, default=5)
+    parser.add_argument("--warmup-repetitions", type=int, default=1)
+    parser.add_argument("--output", default=default_results_path)
+    parser.add_argument("--baseline", default=default_baseline_path)
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="how much slower or hungrier than the baseline a stage may get, 0.2 is 20%%")
+    parser.add_argument("--min-regression-seconds", type=float, default=0.005,
+                        help="a slower median below this many seconds is not a regression")
+    arguments = parser.parse_args()
+
+    benchmark_results = run_benchmark(
+        [parse_page_set(page_set) for page_set in arguments.page_sets],
+        arguments.repetitions,
+        arguments.warmup_repetitions
+    )
+    utils.write_text_file_atomically(arguments.output, json.dumps(benchmark_results, indent=4))
+    print_benchmark_results(benchmark_results)
+
+    if arguments.save_baseline:
+        utils.write_text_file_atomically(arguments.baseline, json.dumps(benchmark_results, indent=4))
+        print(f"baseline saved to {arguments.baseline}")
+        return
+    if not os.path.exists(arguments.baseline):
+        print(f"no baseline in {arguments.baseline}: run with --save-baseline to store one")
+        return
+
+    with open(arguments.baseline, 'r', encoding='utf-8') as file:
+        baseline_results = json.load(file)
+    array_regressions = find_regressions(
+        benchmark_results,
+        baseline_results,
+        arguments.tolerance,
+        arguments.min_regression_seconds
+    )
+    for regression in array_regressions:
+        print(
+            f"REGRESSION {regression['page_set']} {regression['stage_name']}: {regression['metric']} "
+            f"{regression['baseline']} -> {regression['current']}"
+        )
+    if array_regressions:
+        sys.exit(1)
+    print(f"no stage regressed more than {arguments.tolerance:.0%} against {arguments.baseline}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
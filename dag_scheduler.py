@@ -0,0 +1,160 @@
+import asyncio
+import contextvars
+import inspect
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import stage_memory_profiler
+import stage_tracer
+
+logger = logging.getLogger(__name__)
+
+
+class DagScheduler:
+    def __init__(self, max_workers=8):
+        self.max_workers = max_workers
+        self.tasks = {}
+        self.results = {}
+        self.timings = {}
+
+    def add_task(self, task_name, function, dependencies=()):
+        if task_name in self.tasks:
+            raise ValueError(f"Task '{task_name}' already exists in the scheduler.")
+        for dependency in dependencies:
+            if dependency not in self.tasks:
+                raise KeyError(f"Dependency '{dependency}' of task '{task_name}' not found.")
+        self.tasks[task_name] = {
+            "function": function,
+            "dependencies": list(dependencies)
+        }
+        return task_name
+
+    def run_task(self, task_name):
+        task = self.tasks[task_name]
+        dependency_results = [self.results[dependency] for dependency in task["dependencies"]]
+        start_time = time.perf_counter()
+        try:
+            with stage_tracer.trace_span(task_name, "task"), \
+                    stage_memory_profiler.profile_stage(task_name):
+                return task["function"](*dependency_results)
+        finally:
+            self.timings[task_name] = (start_time, time.perf_counter())
+
+    async def run_task_async(self, task_name, executor):
+        task = self.tasks[task_name]
+        if not inspect.iscoroutinefunction(task["function"]):
+            # blocking tasks go to the executor with the caller's context variables
+            return await asyncio.get_running_loop().run_in_executor(
+                executor,
+                contextvars.copy_context().run,
+                self.run_task,
+                task_name
+            )
+
+        dependency_results = [self.results[dependency] for dependency in task["dependencies"]]
+        start_time = time.perf_counter()
+        try:
+            with stage_tracer.trace_span(task_name, "task"), \
+                    stage_memory_profiler.profile_stage(task_name):
+                return await task["function"](*dependency_results)
+        finally:
+            self.timings[task_name] = (start_time, time.perf_counter())
+
+    def get_dependents(self):
+        dependents = {task_name: [] for task_name in self.tasks}
+        for task_name, task in self.tasks.items():
+            for dependency in task["dependencies"]:
+                dependents[dependency].append(task_name)
+        return dependents
+
+    async def run_async(self):
+        self.run_start_time = time.perf_counter()
+        remaining_dependencies = {task_name: set(task["dependencies"]) for task_name, task in self.tasks.items()}
+        dependents = self.get_dependents()
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            running_tasks = {}
+
+            def start_ready_tasks():
+                for task_name in [name for name, dependencies in remaining_dependencies.items() if not dependencies]:
+                    del remaining_dependencies[task_name]
+                    running_tasks[asyncio.ensure_future(self.run_task_async(task_name, executor))] = task_name
+
+            start_ready_tasks()
+            while running_tasks:
+                done_tasks, _ = await asyncio.wait(running_tasks, return_when=asyncio.FIRST_COMPLETED)
+                for done_task in done_tasks:
+                    task_name = running_tasks.pop(done_task)
+                    try:
+                        self.results[task_name] = done_task.result()
+                    except Exception:
+                        for running_task in running_tasks:
+                            running_task.cancel()
+                        logger.error(f"task '{task_name}' failed, cancelling the remaining tasks")
+                        raise
+                    for dependent in dependents[task_name]:
+                        remaining_dependencies[dependent].discard(task_name)
+                start_ready_tasks()
+
+        if remaining_dependencies:
+            raise ValueError(f"Dependency cycle between tasks: {sorted(remaining_dependencies)}")
+
+        return self.results
+
+    def run(self):
+        self.run_start_time = time.perf_counter()
+        remaining_dependencies = {task_name: set(task["dependencies"]) for task_name, task in self.tasks.items()}
+        dependents = self.get_dependents()
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            running_futures = {}
+
+            def submit_ready_tasks():
+                for task_name in [name for name, dependencies in remaining_dependencies.items() if not dependencies]:
+                    del remaining_dependencies[task_name]
+                    # the tasks see the caller's context variables, as the per-run usage counters
+                    future = executor.submit(contextvars.copy_context().run, self.run_task, task_name)
+                    running_futures[future] = task_name
+
+            submit_ready_tasks()
+            while running_futures:
+                done_futures, _ = wait(running_futures, return_when=FIRST_COMPLETED)
+                for future in done_futures:
+                    task_name = running_futures.pop(future)
+                    try:
+                        self.results[task_name] = future.result()
+                    except Exception:
+                        for running_future in running_futures:
+                            running_future.cancel()
+                        logger.error(f"task '{task_name}' failed, cancelling the remaining tasks")
+                        raise
+                    for dependent in dependents[task_name]:
+                        remaining_dependencies[dependent].discard(task_name)
+                submit_ready_tasks()
+
+        if remaining_dependencies:
+            raise ValueError(f"Dependency cycle between tasks: {sorted(remaining_dependencies)}")
+
+        return self.results
+
+    def get_critical_path(self):
+        if not self.timings:
+            return []
+
+        task_name = max(self.timings, key=lambda name: self.timings[name][1])
+        critical_path = []
+        while task_name is not None:
+            start_time, end_time = self.timings[task_name]
+            critical_path.append({
+                "task_name": task_name,
+                "start": round(start_time - self.run_start_time, 4),
+                "end": round(end_time - self.run_start_time, 4),
+                "duration": round(end_time - start_time, 4)
+            })
+            dependencies = self.tasks[task_name]["dependencies"]
+            # the dependency that finished last is the one the task was actually waiting for
+            task_name = max(dependencies, key=lambda name: self.timings[name][1]) if dependencies else None
+
+        critical_path.reverse()
+        return critical_path
@@ -0,0 +1,139 @@
+import argparse
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeAIModelServer(ThreadingHTTPServer):
+    def __init__(self, server_address, recorded_response_path="sbe_fields.json", requests_per_second=5,
+                 max_concurrent_requests=4, response_delay=0.2):
+        super().__init__(server_address, FakeAIModelRequestHandler)
+        with open(recorded_response_path, 'r') as file:
+            self.recorded_response = file.read()
+        self.requests_per_second = requests_per_second
+        self.max_concurrent_requests = max_concurrent_requests
+        self.response_delay = response_delay
+        self.request_times = deque()
+        self.concurrent_requests = 0
+        self.statistics = {"accepted": 0, "throttled": 0}
+        self.lock = threading.Lock()
+
+    def try_accept_request(self):
+        with self.lock:
+            now = time.monotonic()
+            while self.request_times and now - self.request_times[0] > 1.0:
+                self.request_times.popleft()
+            if len(self.request_times) >= self.requests_per_second \
+                    or self.concurrent_requests >= self.max_concurrent_requests:
+                self.statistics["throttled"] += 1
+                return False
+            self.request_times.append(now)
+            self.concurrent_requests = self.concurrent_requests + 1
+            self.statistics["accepted"] += 1
+            return True
+
+    def release_request(self):
+        with self.lock:
+            self.concurrent_requests = self.concurrent_requests - 1
+
+
+class FakeAIModelRequestHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status_code, json_body, headers=None):
+        body = json.dumps(json_body).encode("utf-8")
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for header_name, header_value in (headers or {}).items():
+            self.send_header(header_name, header_value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        request_body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+
+        if not self.path.endswith("/chat/completions"):
+            self.send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+            return
+
+        if not self.server.try_accept_request():
+            self.send_json(
+                429,
+                {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                {"retry-after": "1"}
+            )
+            return
+
+        try:
+            time.sleep(self.server.response_delay)
+            if request_body.get("stream"):
+                self.send_stream(request_body)
+            else:
+                self.send_json(200, {
+                    "id": "chatcmpl-fake",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": request_body.get("model"),
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": self.server.recorded_response},
+                        "finish_reason": "stop"
+                    }],
+                    "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+                })
+        finally:
+            self.server.release_request()
+
+    def send_stream(self, request_body, chunk_size=256):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+
+        recorded_response = self.server.recorded_response
+        array_deltas = [{"role": "assistant", "content": ""}] + [
+            {"content": recorded_response[index:index + chunk_size]}
+            for index in range(0, len(recorded_response), chunk_size)
+        ]
+        for index, delta in enumerate(array_deltas):
+            chunk = {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": request_body.get("model"),
+                "choices": [{
+                    "index": 0,
+                    "delta": delta,
+                    "finish_reason": "stop" if index == len(array_deltas) - 1 else None
+                }]
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        self.wfile.write(b"data: [DONE]\n\n")
+
+
+def start_fake_ai_model_server(port=0, **kwargs):
+    server = FakeAIModelServer(("127.0.0.1", port), **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAI compatible server that throttles like the real API.")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--recorded-response", default="sbe_fields.json")
+    parser.add_argument("--requests-per-second", type=int, default=5)
+    parser.add_argument("--max-concurrent-requests", type=int, default=4)
+    arguments = parser.parse_args()
+
+    fake_server = FakeAIModelServer(
+        ("127.0.0.1", arguments.port),
+        recorded_response_path=arguments.recorded_response,
+        requests_per_second=arguments.requests_per_second,
+        max_concurrent_requests=arguments.max_concurrent_requests
+    )
+    print(f"fake AI model server listening on http://127.0.0.1:{arguments.port}/v1, "
+          f"set utils.openai_api_base to it and utils.use_recorded_ai_model_responses to False")
+    fake_server.serve_forever()
@@ -0,0 +1,219 @@
+import contextvars
+import hashlib
+import json
+import random
+import re
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+import utils
+from sbe_type_inference import (
+    get_custom_data_type, get_custom_type_kind, get_document_disagreements, normalize_format, parse_integer,
+    parse_presence, parse_field_name
+)
+
+mersenne_prime = (1 << 61) - 1
+number_permutations = 64
+number_bands = 16
+similarity_threshold = 0.8
+
+# the index is shared by the runs of a process, the statistics are counted per run
+active_run_statistics = contextvars.ContextVar("active_run_statistics", default=None)
+
+
+def get_field_shingles(document_field):
+    field_name = utils.get_document_field_value(document_field, utils.document_field_name_keys, "")
+    document_format = utils.get_document_field_value(document_field, utils.document_field_format_keys, "")
+    description = utils.get_document_field_value(
+        document_field,
+        utils.document_field_description_keys,
+        "",
+        match_key_prefix=True
+    )
+
+    # OCR splits and misreads names ("ClientMessageSen dingTime", "SecuritylD"): compare them as character trigrams
+    normalized_name = re.sub(r"[^a-z0-9]", "", str(field_name).lower())
+    shingles = {f"name:{normalized_name[index:index + 3]}" for index in range(max(len(normalized_name) - 2, 1))}
+    shingles.add(f"format:{normalize_format(document_format)}")
+
+    description_words = re.findall(r"[a-z0-9]+", str(description).lower())
+    shingles.update(f"description:{first} {second}" for first, second in zip(description_words, description_words[1:]))
+
+    return shingles
+
+
+def get_entry_key(entry):
+    return json.dumps([entry["signature"], entry["document_length"], entry["sbe_field"]], sort_keys=True)
+
+
+def get_empty_run_statistics():
+    return {"lookups": 0, "reused": 0, "verified": 0, "false_matches": 0}
+
+
+@contextmanager
+def track_run_statistics():
+    run_statistics_token = active_run_statistics.set(get_empty_run_statistics())
+    try:
+        yield
+    finally:
+        active_run_statistics.reset(run_statistics_token)
+
+
+def hash_shingle(shingle):
+    return int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class FieldSimilarityIndex:
+    def __init__(self, file_path="field_similarity_index.json", threshold=similarity_threshold, verification_rate=0.1,
+                 seed=42):
+        self.file_path = Path(file_path)
+        self.threshold = threshold
+        self.verification_rate = verification_rate
+        self.lock = threading.Lock()
+        random_generator = random.Random(seed)
+        self.permutations = [
+            (random_generator.randrange(1, mersenne_prime), random_generator.randrange(0, mersenne_prime))
+            for _ in range(number_permutations)
+        ]
+        self.rows_per_band = number_permutations // number_bands
+        self.entries = []
+        self.entry_keys = set()
+        self.dict_buckets = {}
+        self.is_modified = False
+        # what is looked up outside of a tracked run
+        self.run_statistics = get_empty_run_statistics()
+
+        if self.file_path.exists():
+            for entry in json.loads(self.file_path.read_text(encoding='utf-8'))["entries"]:
+                self.add_entry(entry)
+            self.is_modified = False
+
+    def get_run_statistics(self):
+        run_statistics = active_run_statistics.get()
+        return self.run_statistics if run_statistics is None else run_statistics
+
+    def get_signature(self, document_field):
+        array_hashes = [hash_shingle(shingle) for shingle in get_field_shingles(document_field)]
+        return [
+            min((a * shingle_hash + b) % mersenne_prime for shingle_hash in array_hashes)
+            for a, b in self.permutations
+        ]
+
+    def get_band_keys(self, signature):
+        return [
+            (band_index, tuple(signature[band_index * self.rows_per_band:(band_index + 1) * self.rows_per_band]))
+            for band_index in range(number_bands)
+        ]
+
+    def add_entry(self, entry):
+        entry_key = get_entry_key(entry)
+        if entry_key in self.entry_keys:
+            return
+        self.entry_keys.add(entry_key)
+        entry_index = len(self.entries)
+        self.entries.append(entry)
+        for band_key in self.get_band_keys(entry["signature"]):
+            self.dict_buckets.setdefault(band_key, []).append(entry_index)
+        self.is_modified = True
+
+    def add_sbe_field(self, document_field, sbe_field):
+        signature = self.get_signature(document_field)
+        with self.lock:
+            self.add_entry({
+                "signature": signature,
+                "document_length": parse_integer(
+                    utils.get_document_field_value(document_field, utils.document_field_length_keys)
+                ),
+                "sbe_field": sbe_field
+            })
+
+    def find_near_duplicate(self, document_field):
+        signature = self.get_signature(document_field)
+        document_length = parse_integer(utils.get_document_field_value(document_field, utils.document_field_length_keys))
+
+        run_statistics = self.get_run_statistics()
+        with self.lock:
+            run_statistics["lookups"] += 1
+            candidate_indexes = {
+                entry_index
+                for band_key in self.get_band_keys(signature)
+                for entry_index in self.dict_buckets.get(band_key, [])
+            }
+
+            array_similar_entries = []
+            for entry_index in candidate_indexes:
+                entry = self.entries[entry_index]
+                if document_length is not None and entry["document_length"] not in [None, document_length]:
+                    continue
+                similarity = sum(
+                    first == second for first, second in zip(signature, entry["signature"])
+                ) / number_permutations
+                if similarity >= self.threshold:
+                    array_similar_entries.append((similarity, entry_index))
+
+        # a similar name does not make the same values: the most similar field the document agrees with is reused
+        for _, entry_index in sorted(array_similar_entries, reverse=True):
+            reused_sbe_field = self.reuse_sbe_field(document_field, self.entries[entry_index]["sbe_field"])
+            if not get_document_disagreements(document_field, reused_sbe_field):
+                with self.lock:
+                    run_statistics["reused"] += 1
+                return reused_sbe_field
+        return None
+
+    def reuse_sbe_field(self, document_field, known_sbe_field):
+        field_name = parse_field_name(document_field) or known_sbe_field["field_name"]
+        field_id = parse_integer(utils.get_document_field_id(document_field))
+        # custom types are named after their field
+        kind = get_custom_type_kind(known_sbe_field["data_type"])
+
+        return {
+            "field_id": field_id if field_id is not None else known_sbe_field["field_id"],
+            "field_name": field_name,
+            "data_type": get_custom_data_type(field_name, kind) if kind is not None else known_sbe_field["data_type"],
+            "encoding_type": known_sbe_field["encoding_type"],
+            "length": known_sbe_field["length"],
+            "presence": parse_presence(document_field) or known_sbe_field["presence"],
+            "structure": dict(known_sbe_field.get("structure", {}))
+        }
+
+    def is_sampled_for_verification(self):
+        # one reuse every 1 / verification_rate is also sent to the model to measure the false-match rate
+        if self.verification_rate <= 0:
+            return False
+        run_statistics = self.get_run_statistics()
+        with self.lock:
+            return run_statistics["reused"] % max(round(1 / self.verification_rate), 1) == 0
+
+    def record_verification(self, reused_sbe_field, ai_model_sbe_field):
+        compared_keys = ["data_type", "encoding_type", "length", "structure"]
+        is_false_match = any(reused_sbe_field.get(key) != ai_model_sbe_field.get(key) for key in compared_keys)
+        run_statistics = self.get_run_statistics()
+        with self.lock:
+            run_statistics["verified"] += 1
+            run_statistics["false_matches"] += int(is_false_match)
+        return is_false_match
+
+    def get_run_report(self):
+        with self.lock:
+            run_statistics = dict(self.get_run_statistics())
+        run_statistics["reuse_rate"] = run_statistics["reused"] / run_statistics["lookups"] \
+            if run_statistics["lookups"] else 0.0
+        run_statistics["false_match_rate"] = run_statistics["false_matches"] / run_statistics["verified"] \
+            if run_statistics["verified"] else None
+        return run_statistics
+
+    def save(self):
+        with self.lock:
+            if not self.is_modified:
+                return
+            # other processes add to the same file: what they saved since it was read is merged, not overwritten
+            with utils.file_lock(f"{self.file_path}.lock"):
+                if self.file_path.exists():
+                    for entry in json.loads(self.file_path.read_text(encoding='utf-8'))["entries"]:
+                        self.add_entry(entry)
+                utils.write_text_file_atomically(
+                    self.file_path,
+                    json.dumps({"entries": self.entries}, ensure_ascii=False)
+                )
+            self.is_modified = False
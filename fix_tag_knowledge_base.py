@@ -0,0 +1,233 @@
+import json
+import logging
+import re
+import threading
+from pathlib import Path
+
+from lxml import etree
+
+import utils
+from sbe_type_inference import (
+    sbe_primitive_type_lengths,
+    parse_integer,
+    parse_presence,
+    parse_field_name,
+    get_custom_data_type,
+    get_custom_type_kind,
+    get_document_disagreements
+)
+
+logger = logging.getLogger(__name__)
+
+default_seed_schema_paths = ["dcg_binary_sbe_input.xml", "bloomberg_schema.xml"]
+# version 2 keeps every seeded typing of a tag instead of the first one: older files are seeded again
+knowledge_base_version = 2
+
+
+def normalize_field_name(field_name):
+    return re.sub(r"[^a-z0-9]", "", str(field_name).lower())
+
+
+def get_local_tag_name(element):
+    return element.tag.split("}")[-1] if isinstance(element.tag, str) else ""
+
+
+def get_custom_type_name(type_name, suffix):
+    if type_name.lower().endswith(suffix):
+        return type_name
+    return f"{type_name[0].lower()}{type_name[1:]}{suffix}"
+
+
+def get_entry_type_key(entry):
+    # custom type names are rebuilt from the document: two entries differing only by name type alike
+    return (
+        get_custom_type_kind(entry["data_type"]) or entry["data_type"],
+        entry["encoding_type"],
+        entry["length"],
+        tuple(sorted(entry["structure"]))
+    )
+
+
+def read_sbe_xml_types(xml_root):
+    dict_types = {}
+
+    for element in xml_root.iter():
+        tag_name = get_local_tag_name(element)
+        type_name = element.get("name")
+
+        if tag_name == "type" and element.get("primitiveType"):
+            primitive_type = element.get("primitiveType")
+            length = parse_integer(element.get("length")) if primitive_type == "char" else None
+            dict_types[type_name] = {
+                "data_type": primitive_type,
+                "encoding_type": primitive_type,
+                "length": length or sbe_primitive_type_lengths.get(primitive_type),
+                "structure": {}
+            }
+
+        elif tag_name in ["enum", "set"]:
+            encoding_type = element.get("encodingType")
+            dict_types[type_name] = {
+                "data_type": get_custom_type_name(type_name, f"_{tag_name}"),
+                "encoding_type": encoding_type,
+                "length": sbe_primitive_type_lengths.get(encoding_type),
+                "structure": {
+                    (value_element.text or "").strip(): value_element.get("name")
+                    for value_element in element
+                    if get_local_tag_name(value_element) in ["validValue", "choice"]
+                }
+            }
+
+    return dict_types
+
+
+class FixTagKnowledgeBase:
+    def __init__(self, file_path="fix_tag_knowledge_base.json", seed_schema_paths=None):
+        self.file_path = Path(file_path)
+        self.lock = threading.Lock()
+        self.dict_entries_by_tag = {}
+        self.dict_entries_by_name = {}
+        self.is_modified = False
+
+        dict_knowledge_base = {}
+        if self.file_path.exists():
+            dict_knowledge_base = json.loads(self.file_path.read_text(encoding='utf-8'))
+            for entry in dict_knowledge_base["entries"]:
+                self.add_entry(entry)
+            self.is_modified = False
+        if dict_knowledge_base.get("version") != knowledge_base_version:
+            for schema_path in seed_schema_paths or default_seed_schema_paths:
+                self.seed_from_sbe_xml_schema(schema_path)
+            # written with what the run learns, when the run saves its caches
+            self.is_modified = True
+
+    def add_entry(self, entry):
+        field_id = str(entry["field_id"])
+        normalized_name = normalize_field_name(entry["field_name"])
+        array_entries = self.dict_entries_by_tag.setdefault(field_id, [])
+
+        # a second typing of the same field is kept: the document decides between them at lookup
+        for known_entry in array_entries:
+            if normalize_field_name(known_entry["field_name"]) == normalized_name \
+                    and known_entry.get("document_length") == entry.get("document_length") \
+                    and get_entry_type_key(known_entry) == get_entry_type_key(entry):
+                return False
+
+        array_entries.append(entry)
+        self.dict_entries_by_name.setdefault(normalized_name, []).append(entry)
+        self.is_modified = True
+        return True
+
+    def seed_from_sbe_xml_schema(self, schema_path):
+        try:
+            xml_root = etree.parse(str(schema_path)).getroot()
+        except (OSError, etree.ParseError) as e:
+            logger.warning(f"cannot seed the FIX tag knowledge base from {schema_path}: {e}")
+            return
+
+        dict_types = read_sbe_xml_types(xml_root)
+        number_entries = 0
+
+        for element in xml_root.iter():
+            if get_local_tag_name(element) != "field" or element.get("type") not in dict_types:
+                continue
+            field_id = parse_integer(element.get("id"))
+            if field_id is None:
+                continue
+
+            sbe_type = dict_types[element.get("type")]
+            is_added = self.add_entry({
+                "field_id": field_id,
+                "field_name": element.get("name"),
+                "data_type": sbe_type["data_type"],
+                "encoding_type": sbe_type["encoding_type"],
+                "length": sbe_type["length"],
+                "presence": "optional" if element.get("presence") == "optional" else "mandatory",
+                "structure": sbe_type["structure"],
+                "document_length": None,
+                "source": str(schema_path)
+            })
+            number_entries = number_entries + int(is_added)
+
+        logger.info(f"FIX tag knowledge base seeded with {number_entries} fields from {schema_path}")
+
+    def find_entries(self, field_id, field_name):
+        entry_ids_by_name = {id(entry) for entry in self.dict_entries_by_name.get(normalize_field_name(field_name), [])}
+        return [entry for entry in self.dict_entries_by_tag.get(str(field_id), []) if id(entry) in entry_ids_by_name]
+
+    def lookup(self, document_field):
+        field_id = utils.get_document_field_id(document_field)
+        field_name = utils.get_document_field_value(document_field, utils.document_field_name_keys)
+        if field_id is None or field_name is None:
+            return None
+
+        document_length = parse_integer(
+            utils.get_document_field_value(document_field, utils.document_field_length_keys)
+        )
+
+        array_matching_entries = []
+        for entry in self.find_entries(field_id, field_name):
+            # learned entries remember the documented length, seeded ones only know the SBE length
+            known_length = entry["document_length"] if entry["document_length"] is not None else entry["length"]
+            if document_length is not None and document_length != known_length:
+                continue
+            # the format and the values listed by the document win over any known typing
+            if get_document_disagreements(document_field, entry):
+                continue
+            array_matching_entries.append(entry)
+
+        # schemas typing the same tag differently leave the choice to the rules or the AI model
+        if len({get_entry_type_key(entry) for entry in array_matching_entries}) != 1:
+            return None
+
+        entry = array_matching_entries[0]
+        field_name = parse_field_name(document_field) or entry["field_name"]
+        kind = get_custom_type_kind(entry["data_type"])
+        presence = parse_presence(document_field) or entry["presence"]
+        return {
+            "field_id": entry["field_id"],
+            "field_name": field_name,
+            "data_type": get_custom_data_type(field_name, kind) if kind is not None else entry["data_type"],
+            "encoding_type": entry["encoding_type"],
+            "length": entry["length"],
+            "presence": presence,
+            "structure": dict(entry["structure"])
+        }
+
+    def record_sbe_field(self, document_field, sbe_field, source="ai_model"):
+        with self.lock:
+            return self.add_entry({
+                "field_id": sbe_field["field_id"],
+                "field_name": sbe_field["field_name"],
+                "data_type": sbe_field["data_type"],
+                "encoding_type": sbe_field["encoding_type"],
+                "length": sbe_field["length"],
+                "presence": sbe_field["presence"],
+                "structure": sbe_field.get("structure", {}),
+                "document_length": parse_integer(
+                    utils.get_document_field_value(document_field, utils.document_field_length_keys)
+                ),
+                "source": source
+            })
+
+    def save(self):
+        with self.lock:
+            if not self.is_modified:
+                return
+            # other processes learn into the same file: what they saved since it was read is merged, not overwritten
+            with utils.file_lock(f"{self.file_path}.lock"):
+                if self.file_path.exists():
+                    for entry in json.loads(self.file_path.read_text(encoding='utf-8'))["entries"]:
+                        self.add_entry(entry)
+                array_entries = [
+                    entry for array_entries in self.dict_entries_by_tag.values() for entry in array_entries
+                ]
+                utils.write_text_file_atomically(
+                    self.file_path,
+                    json.dumps(
+                        {"version": knowledge_base_version, "entries": array_entries},
+                        indent=4,
+                        ensure_ascii=False
+                    )
+                )
+            self.is_modified = False
@@ -2,13 +2,15 @@
 import ai_engine_module
 import streamlit as st
 import json
+import asyncio
 
-from langchain_community.chat_models.openai import ChatOpenAI
 from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
 
 import utils
+import table_page_scout
 from json_schema_handler import JsonSchemaHandler
-from xml_sbe_schema_handler import XmlSbeSchemaHandler
+from xml_sbe_schema_handler import XmlSbeSchemaHandler, generate_sbe_data_type_definitions, \
+    generate_xml_schema_from_json_schema
 
 tab_new_json_schema = "Add New JSON Schema File"
 tab_new_document_message = "Add New Document Message"
@@ -18,9 +20,6 @@ tab_new_document_repeating_group = "Add New Document Repeating Group"
 tab_new_document_composite = "Add New Document Composite"
 tab_generate_sbe_xml_schema = "Generate SBE XML Schema"
 
-ai_model_name = "gpt-4-0125-preview"
-openai_api_key = ""
-
 
 def generate_sbe_field(document_field):
     system_message = """
@@ -159,14 +158,7 @@ Assicurati di includere solo ed esclusivamente il codice JSON con le informazion
 ### OUTPUT JSON CON LE INFORMAZIONI RICHIESTE ###
     """
 
-    ai_model = ChatOpenAI(
-        openai_api_key=openai_api_key,
-        model=ai_model_name,
-        temperature=0,
-        top_p=0
-    )
-
-    formatted_report_text = ai_model([
+    formatted_report_text = ai_engine_module.ai_model_client.invoke([
         SystemMessage(content=system_message),
         HumanMessage(content=example_1_human_message),
         AIMessage(content=example_1_assistant_message),
@@ -177,71 +169,21 @@ Assicurati di includere solo ed esclusivamente il codice JSON con le informazion
         HumanMessage(content=human_message)
     ])
 
-    return replace_newlines_with_space(formatted_report_text.content)
-
-
-def replace_newlines_with_space(input_string):
-    return input_string.replace('\n', ' ')
-
-
-def generate_sbe_data_type_definitions(json_handler, sbe_field):
-
-    if sbe_field["data_type"].lower() == "char":
-        json_handler.add_primitive_data_type("array_string_data_types", sbe_field)
-
-    elif sbe_field["data_type"].lower() in ["int8", "int16",
-                                            "int32", "int64",
-                                            "uint8",
-                                            "uint16",
-                                            "uint32",
-                                            "uint64"] and sbe_field["presence"] == "optional":
-        json_handler.add_primitive_data_type("array_number_data_types", sbe_field)
+    return replace_newlines_with_space(formatted_report_text)
 
-    elif sbe_field["data_type"].lower().endswith("_enum"):
-        json_handler.add_custom_data_type("array_enum_data_types", sbe_field["encoding_type"],
-                                          sbe_field["data_type"],
-                                          sbe_field["structure"])
 
-    elif sbe_field["data_type"].lower().endswith("_set"):
-        json_handler.add_custom_data_type("array_set_data_types", sbe_field["encoding_type"],
-                                          sbe_field["data_type"],
-                                          sbe_field["structure"])
+@st.cache_data(show_spinner="Ricerca delle pagine con tabelle di campi...")
+def discover_table_page_ranges(pdf_path, file_size):
+    # the file size is part of the cache key: another upload with the same name is scouted again
+    try:
+        return table_page_scout.discover_table_page_ranges(pdf_path)
+    except Exception as e:
+        print(f"Error while scouting the table pages of {pdf_path}: {e}")
+        return []
 
 
-def generate_xml_schema_from_json_schema(json_handler, xml_handler):
-    number_data_types = json_handler.get_schema_array_iterator("array_number_data_types")
-    for number_data_type in number_data_types:
-        xml_handler.generate_sbe_number_definition(number_data_type["name_type"], number_data_type["data_type"],
-                                                   number_data_type["presence"])
-
-    string_data_types = json_handler.get_schema_array_iterator("array_string_data_types")
-    for string_data_type in string_data_types:
-        xml_handler.generate_sbe_string_definition(string_data_type["name_type"], string_data_type["data_type"],
-                                                   string_data_type["length"],
-                                                   string_data_type["presence"])
-
-    enum_data_types = json_handler.get_schema_array_iterator("array_enum_data_types")
-    for enum_data_type in enum_data_types:
-        xml_handler.generate_sbe_enum_definition(enum_data_type["encoding_type"], enum_data_type["data_type"],
-                                                 enum_data_type["structure"])
-
-    set_data_types = json_handler.get_schema_array_iterator("array_set_data_types")
-    for set_data_type in set_data_types:
-        xml_handler.generate_sbe_set_definition(set_data_type["encoding_type"], set_data_type["data_type"],
-                                                set_data_type["structure"])
-
-    xml_handler.generate_sbe_default_composites()
-
-    document_messages = json_handler.get_schema_array_iterator("array_document_messages")
-    for document_message in document_messages:
-        xml_handler.generate_sbe_message_xml(
-            document_message["message_name"],
-            document_message["template_id"],
-            json_handler.get_message_array_iterator(document_message["message_name"],
-                                                    "array_sbe_fields"),
-            json_handler.get_message_array_iterator(document_message["message_name"],
-                                                    "array_sbe_repeating_groups")
-        )
+def replace_newlines_with_space(input_string):
+    return input_string.replace('\n', ' ')
 
 
 def add_sbe_field(json_handler, document_message, document_field):
@@ -370,16 +312,26 @@ def form_new_sbe_message():
                 pdf_path = utils.save_uploaded_file("pdf_documents", uploaded_file)
                 st.success(f"File salvato in: {pdf_path}")
 
+                # the pages found by the scouting pass are proposed, the user can still change them
+                array_page_ranges = discover_table_page_ranges(pdf_path, uploaded_file.size)
+                if array_page_ranges:
+                    st.write("Pagine con tabelle di campi trovate: " + ", ".join(
+                        f"{first_page}-{last_page}" for first_page, last_page in array_page_ranges
+                    ))
+                default_starting_page, default_ending_page = array_page_ranges[0] if array_page_ranges else (1, 1)
+
                 starting_page = st.number_input(
                     "Pagina di inizio della tabella",
                     key="starting_page_form_new_sbe_message",
                     min_value=1,
+                    value=default_starting_page,
                     format="%d"
                 )
                 ending_page = st.number_input(
                     "Pagina di fine della tabella",
                     key="ending_page_form_new_sbe_message",
                     min_value=1,
+                    value=default_ending_page,
                     format="%d"
                 )
 
@@ -396,10 +348,11 @@ def form_new_sbe_message():
 
                     if st.button(f"Generate SBE XML Schema \'{json_schema_name}\'"):
 
-                        json_array_sbe_fields, json_array_repeating_groups = ai_engine_module.process(pdf_path, starting_page, ending_page)
+                        json_array_sbe_fields, json_array_repeating_groups = asyncio.run(
+                            ai_engine_module.process_async(pdf_path, starting_page, ending_page)
+                        )
 
-                        for sbe_field in json_array_sbe_fields:
-                            json_handler.add_sbe_field_to_message(message_name, sbe_field)
+                        json_handler.add_sbe_fields_to_message(message_name, json_array_sbe_fields)
 
                         for repeating_group in json_array_repeating_groups:
                             json_handler.add_repeating_group_to_message(
@@ -408,12 +361,11 @@ def form_new_sbe_message():
                                 repeating_group["group_id"]
                             )
 
-                            for sbe_field in repeating_group["items"]:
-                                json_handler.add_sbe_field_to_repeating_group(
-                                    message_name,
-                                    repeating_group["group_id"],
-                                    sbe_field
-                                )
+                            json_handler.add_sbe_fields_to_repeating_group(
+                                message_name,
+                                repeating_group["group_id"],
+                                repeating_group["items"]
+                            )
 
                         st.success(json_handler.load_schema())
 
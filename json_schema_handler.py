@@ -160,6 +160,20 @@ class JsonSchemaHandler:
         message['array_sbe_fields'].append(json_sbe_field)
         self.save_schema()
 
+    def add_sbe_fields_to_message(self, message_key, iterable_sbe_fields):
+        # the fields are taken one at a time from any iterable, the schema is written once at the end
+        message = self.find_document_message_in_json_schema(message_key)
+        if message is None:
+            raise KeyError(f"Message '{message_key}' not found in schema.")
+        for json_sbe_field in iterable_sbe_fields:
+            if json_sbe_field in message['array_sbe_fields']:
+                print(
+                    f"SBE Field already exists in the message '{message_key}' "
+                    f"of the JSON schema '{self.json_schema_name}'")
+                continue
+            message['array_sbe_fields'].append(json_sbe_field)
+        self.save_schema()
+
     def iterate_sbe_fields_of_document_messages(self, process_field_function):
         document_messages = self.get_schema_array_iterator("array_document_messages")
         for document_message in document_messages:
@@ -221,6 +235,18 @@ class JsonSchemaHandler:
         else:
             print(f"Repeating group {id_num_in_group_field} not found.")
 
+    def add_sbe_fields_to_repeating_group(self, message_key, id_num_in_group_field, iterable_sbe_fields):
+        message = self.find_document_message_in_json_schema(message_key)
+        if message is None:
+            raise KeyError(f"Message '{message_key}' not found in schema.")
+        for repeating_group in self.get_message_array_iterator(message_key, "array_sbe_repeating_groups"):
+            if repeating_group["group_id"] == id_num_in_group_field:
+                repeating_group["items"].extend(iterable_sbe_fields)
+                self.save_schema()
+                break
+        else:
+            print(f"Repeating group {id_num_in_group_field} not found.")
+
     def add_sbe_field_to_composite(self, name_composite, json_sbe_field):
         for composite in self.get_schema_array_iterator("array_composite_data_types"):
             if composite["name_composite"] == name_composite:
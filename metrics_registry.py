@@ -0,0 +1,306 @@
+import atexit
+import bisect
+import json
+import logging
+import multiprocessing
+import multiprocessing.util
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import utils
+
+logger = logging.getLogger(__name__)
+
+metric_type_counter = "counter"
+metric_type_gauge = "gauge"
+metric_type_histogram = "histogram"
+default_latency_buckets = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0]
+
+
+def get_label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def escape_label_value(label_value):
+    return str(label_value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(label_key, extra_labels=()):
+    array_labels = [
+        f'{label_name}="{escape_label_value(label_value)}"'
+        for label_name, label_value in list(label_key) + list(extra_labels)
+    ]
+    return "{" + ",".join(array_labels) + "}" if array_labels else ""
+
+
+def format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    def __init__(self, registry, name, documentation):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.metric_type = metric_type_counter
+
+    def inc(self, amount=1, **labels):
+        # only the thread's own values are touched: no lock on the hot path
+        values = self.registry.get_thread_values()
+        key = (self.name, get_label_key(labels))
+        values[key] = values.get(key, 0) + amount
+
+
+class Gauge:
+    def __init__(self, registry, name, documentation):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.metric_type = metric_type_gauge
+
+    def set(self, value, **labels):
+        # the last value wins whichever thread set it: a plain dict assignment is atomic
+        self.registry.gauge_values[(self.name, get_label_key(labels))] = value
+
+
+class Histogram:
+    def __init__(self, registry, name, documentation, buckets=None):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.metric_type = metric_type_histogram
+        self.buckets = sorted(buckets or default_latency_buckets)
+
+    def observe(self, value, **labels):
+        values = self.registry.get_thread_values()
+        key = (self.name, get_label_key(labels))
+        histogram_values = values.get(key)
+        if histogram_values is None:
+            # one count per bucket then +Inf, the sum and the count
+            histogram_values = values[key] = [0] * (len(self.buckets) + 3)
+        histogram_values[bisect.bisect_left(self.buckets, value)] += 1
+        histogram_values[-2] += value
+        histogram_values[-1] += 1
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.dict_metrics = {}
+        self.gauge_values = {}
+        self.thread_values = threading.local()
+        self.array_thread_values = []
+        self.retired_values = {}
+        self.lock = threading.Lock()
+        self.worker_metrics_directory = None
+        self.worker_metrics_path = None
+
+    def register(self, metric):
+        with self.lock:
+            return self.dict_metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, documentation):
+        return self.register(Counter(self, name, documentation))
+
+    def gauge(self, name, documentation):
+        return self.register(Gauge(self, name, documentation))
+
+    def histogram(self, name, documentation, buckets=None):
+        return self.register(Histogram(self, name, documentation, buckets))
+
+    def get_thread_values(self):
+        try:
+            return self.thread_values.values
+        except AttributeError:
+            values = self.thread_values.values = {}
+            with self.lock:
+                self.retire_finished_thread_values()
+                self.array_thread_values.append((threading.current_thread(), values))
+            return values
+
+    def retire_finished_thread_values(self):
+        # the values of a thread outlive it, summed once into the retired ones: short-lived workers do not pile up
+        array_running_thread_values = []
+        for thread, values in self.array_thread_values:
+            if thread.is_alive():
+                array_running_thread_values.append((thread, values))
+            else:
+                add_metric_values(self.retired_values, values)
+        self.array_thread_values = array_running_thread_values
+
+    def get_process_values(self):
+        with self.lock:
+            self.retire_finished_thread_values()
+            process_values = {}
+            add_metric_values(process_values, self.retired_values)
+            array_thread_values = [values.copy() for _, values in self.array_thread_values]
+        for values in array_thread_values:
+            add_metric_values(process_values, values)
+        return process_values
+
+    def get_worker_metrics_directory(self):
+        # the page workers are other processes: they export their values there for the process that started them
+        with self.lock:
+            if self.worker_metrics_directory is None:
+                self.worker_metrics_directory = tempfile.mkdtemp(prefix="engine_metrics_")
+            return self.worker_metrics_directory
+
+    def read_worker_values(self):
+        worker_values = {}
+        if self.worker_metrics_directory is None:
+            return worker_values
+        for metrics_path in Path(self.worker_metrics_directory).glob("*.json"):
+            try:
+                array_entries = json.loads(metrics_path.read_text(encoding='utf-8'))
+            except (OSError, json.JSONDecodeError) as e:
+                logger.warning(f"metrics of a page worker cannot be read from {metrics_path}: {e}")
+                continue
+            add_metric_values(worker_values, {
+                (name, tuple(tuple(label) for label in label_key)): value for name, label_key, value in array_entries
+            })
+        return worker_values
+
+    def collect(self):
+        values = self.get_process_values()
+        add_metric_values(values, self.read_worker_values())
+        values.update(self.gauge_values.copy())
+        return values
+
+    def export_worker_values(self):
+        if self.worker_metrics_path is None:
+            return
+        utils.write_text_file_atomically(self.worker_metrics_path, json.dumps([
+            [name, label_key, value] for (name, label_key), value in self.get_process_values().items()
+        ]))
+
+    def start_worker_export(self, worker_metrics_directory, export_interval=None):
+        # a pid can be reused by a later worker: the file name must not be
+        self.worker_metrics_path = os.path.join(worker_metrics_directory, f"{os.getpid()}_{uuid.uuid4().hex}.json")
+        export_interval = utils.metrics_export_interval if export_interval is None else export_interval
+
+        def export_periodically():
+            while True:
+                time.sleep(export_interval)
+                self.export_worker_values()
+
+        threading.Thread(target=export_periodically, daemon=True).start()
+        # a worker of a pool that is shut down exits through the multiprocessing finalizers, not atexit
+        multiprocessing.util.Finalize(self, self.export_worker_values, exitpriority=10)
+
+    def render(self):
+        values = self.collect()
+        array_lines = []
+        with self.lock:
+            array_metrics = sorted(self.dict_metrics.values(), key=lambda metric: metric.name)
+        for metric in array_metrics:
+            array_lines.append(f"# HELP {metric.name} {metric.documentation}")
+            array_lines.append(f"# TYPE {metric.name} {metric.metric_type}")
+            for (name, label_key), value in sorted(values.items(), key=lambda item: item[0]):
+                if name != metric.name:
+                    continue
+                if metric.metric_type != metric_type_histogram:
+                    array_lines.append(f"{name}{format_labels(label_key)} {format_value(value)}")
+                    continue
+                cumulative_count = 0
+                for bucket, bucket_count in zip(metric.buckets + ["+Inf"], value[:-2]):
+                    cumulative_count = cumulative_count + bucket_count
+                    array_lines.append(
+                        f"{name}_bucket{format_labels(label_key, [('le', bucket)])} {cumulative_count}"
+                    )
+                array_lines.append(f"{name}_sum{format_labels(label_key)} {format_value(value[-2])}")
+                array_lines.append(f"{name}_count{format_labels(label_key)} {value[-1]}")
+        return "\n".join(array_lines) + "\n"
+
+    def dump(self, metrics_path):
+        utils.create_directory_if_not_exists(os.path.dirname(os.path.abspath(metrics_path)))
+        utils.write_text_file_atomically(metrics_path, self.render())
+
+    def dump_at_exit(self):
+        try:
+            if utils.metrics_dump_path:
+                self.dump(utils.metrics_dump_path)
+        finally:
+            if self.worker_metrics_directory is not None:
+                shutil.rmtree(self.worker_metrics_directory, ignore_errors=True)
+
+
+def add_metric_values(values, other_values):
+    for key, value in other_values.items():
+        if isinstance(value, list):
+            values[key] = [a + b for a, b in zip(values[key], value)] if key in values else list(value)
+        else:
+            values[key] = values.get(key, 0) + value
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics_registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def start_metrics_server(port, host="127.0.0.1"):
+    metrics_server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    threading.Thread(target=metrics_server.serve_forever, daemon=True).start()
+    logger.info(f"metrics served on http://{host}:{metrics_server.server_port}/metrics")
+    return metrics_server
+
+
+metrics_registry = MetricsRegistry()
+if multiprocessing.parent_process() is None:
+    atexit.register(metrics_registry.dump_at_exit)
+
+pages_processed_counter = metrics_registry.counter(
+    "engine_pages_processed_total",
+    "Pages through the whole engine, by outcome."
+)
+stage_duration_histogram = metrics_registry.histogram(
+    "engine_stage_duration_seconds",
+    "Latency of the page stages and of the AI model calls."
+)
+stage_errors_counter = metrics_registry.counter(
+    "engine_stage_errors_total",
+    "Stages that raised an error or returned no output."
+)
+stage_queue_depth_gauge = metrics_registry.gauge(
+    "engine_stage_queue_depth",
+    "Pages waiting in front of a stage of the stage pipeline."
+)
+ai_model_calls_counter = metrics_registry.counter(
+    "engine_ai_model_calls_total",
+    "Requests to the AI model, recorded answers included."
+)
+ai_model_input_tokens_counter = metrics_registry.counter(
+    "engine_ai_model_input_tokens_total",
+    "Estimated tokens sent to the AI model."
+)
+ai_model_output_tokens_counter = metrics_registry.counter(
+    "engine_ai_model_output_tokens_total",
+    "Estimated tokens answered by the AI model."
+)
+cache_lookups_counter = metrics_registry.counter(
+    "engine_cache_lookups_total",
+    "Lookups of the stage checkpoints, the FIX tag knowledge base and the similar field index, by result."
+)
+model_load_histogram = metrics_registry.histogram(
+    "engine_model_load_seconds",
+    "Time to load the layout and OCR models in a process."
+)
+model_inference_histogram = metrics_registry.histogram(
+    "engine_model_inference_seconds",
+    "Latency of one layout detection or OCR of the local models."
+)
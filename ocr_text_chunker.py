@@ -0,0 +1,154 @@
+import re
+
+import utils
+
+max_chunk_characters = 3000
+overlap_rows = 1
+
+# a table row starts with the field tag, possibly behind the group markers used by some venues (">", "+", "=>"),
+# a wrapped "1 = Buy" line of the possible values is not a row
+row_start_pattern = re.compile(r"^\s*(?:[>+=|]+\s*)?(\d{1,5})\b(?!\s*=)")
+header_keywords = ["tag", "field", "name", "format", "len", "description", "req", "type", "offset", "values"]
+
+
+def split_header_and_rows(text_table):
+    lines = [line for line in text_table.splitlines() if line.strip()]
+
+    first_row_index = next((index for index, line in enumerate(lines) if row_start_pattern.match(line)), None)
+    if first_row_index is None:
+        return "", []
+
+    header = "\n".join(lines[:first_row_index])
+    array_rows = []
+    for line in lines[first_row_index:]:
+        if row_start_pattern.match(line) or not array_rows:
+            array_rows.append(line)
+        else:
+            # lines without a leading tag are the wrapped cells of the previous row
+            array_rows[-1] = f"{array_rows[-1]}\n{line}"
+
+    return header, array_rows
+
+
+def get_row_field_id(row):
+    return str(int(row_start_pattern.match(row).group(1)))
+
+
+def is_table_header(header):
+    header = header.lower()
+    return sum(keyword in header for keyword in header_keywords) >= 2
+
+
+def get_text_chunk(text, overlap_field_ids=()):
+    # the overlap rows repeat the last rows of the previous chunk of the same table
+    return {"text": text, "overlap_field_ids": list(overlap_field_ids)}
+
+
+def chunk_text_table(text_table, chunk_characters=max_chunk_characters, chunk_overlap_rows=overlap_rows):
+    header, array_rows = split_header_and_rows(text_table)
+
+    # tables whose rows cannot be aligned are sent whole rather than cut mid-row
+    if len(text_table) <= chunk_characters or len(array_rows) < 2:
+        return [get_text_chunk(text_table)]
+
+    header = header if is_table_header(header) else ""
+    array_chunks = []
+    array_chunk_rows = []
+    array_overlap_rows = []
+    chunk_length = len(header)
+
+    for row in array_rows:
+        if array_chunk_rows and chunk_length + len(row) > chunk_characters:
+            array_chunks.append(get_text_chunk(
+                "\n".join([header] + array_chunk_rows if header else array_chunk_rows),
+                [get_row_field_id(overlap_row) for overlap_row in array_overlap_rows]
+            ))
+            array_overlap_rows = array_chunk_rows[-chunk_overlap_rows:] if chunk_overlap_rows else []
+            array_chunk_rows = list(array_overlap_rows)
+            chunk_length = len(header) + sum(len(chunk_row) for chunk_row in array_chunk_rows)
+        array_chunk_rows.append(row)
+        chunk_length = chunk_length + len(row)
+
+    array_chunks.append(get_text_chunk(
+        "\n".join([header] + array_chunk_rows if header else array_chunk_rows),
+        [get_row_field_id(overlap_row) for overlap_row in array_overlap_rows]
+    ))
+    return array_chunks
+
+
+def chunk_text_tables(text_tables, chunk_characters=max_chunk_characters, chunk_overlap_rows=overlap_rows):
+    array_chunks = []
+    for text_table in text_tables:
+        for chunk in chunk_text_table(text_table, chunk_characters, chunk_overlap_rows):
+            # small tables of the same page travel together instead of paying one request each,
+            # a chunk repeating rows of the previous one stays on its own for the stitching to find them
+            if array_chunks and not chunk["overlap_field_ids"] \
+                    and len(array_chunks[-1]["text"]) + len(chunk["text"]) <= chunk_characters:
+                array_chunks[-1]["text"] = f"{array_chunks[-1]['text']}\n{chunk['text']}"
+            else:
+                array_chunks.append(chunk)
+    return array_chunks
+
+
+def get_text_tables_after_field(text_tables, field_id):
+    if field_id is None:
+        return list(text_tables)
+
+    for table_index, text_table in enumerate(text_tables):
+        header, array_rows = split_header_and_rows(text_table)
+        for row_index, row in enumerate(array_rows):
+            if get_row_field_id(row) == field_id:
+                array_remaining_rows = array_rows[row_index + 1:]
+                array_remaining_text_tables = list(text_tables[table_index + 1:])
+                if array_remaining_rows:
+                    array_remaining_text_tables.insert(0, "\n".join([header] + array_remaining_rows))
+                return array_remaining_text_tables
+
+    # the last parsed field cannot be located in the OCR text: resuming would duplicate the whole table
+    return []
+
+
+def stitch_document_fields(iterable_json_array_document_fields, array_overlap_field_ids):
+    # only the overlap rows of a chunk are duplicates, of the last rows of the previous chunk of the same table:
+    # the same tag in two tables of a page is two fields
+    dict_held_document_fields = {}
+
+    for chunk_index, json_array_document_fields in enumerate(iterable_json_array_document_fields):
+        overlap_field_ids = array_overlap_field_ids[chunk_index]
+        next_overlap_field_ids = array_overlap_field_ids[chunk_index + 1] \
+            if chunk_index + 1 < len(array_overlap_field_ids) else []
+
+        # overlap rows the model left out of this chunk keep the copy of the previous one
+        chunk_field_ids = {utils.get_document_field_id(document_field) for document_field in json_array_document_fields}
+        for field_id in [field_id for field_id in dict_held_document_fields if field_id not in chunk_field_ids]:
+            yield dict_held_document_fields.pop(field_id)
+
+        for document_field in json_array_document_fields:
+            field_id = utils.get_document_field_id(document_field)
+            if field_id in overlap_field_ids and field_id in dict_held_document_fields:
+                previous_document_field = dict_held_document_fields.pop(field_id)
+                # the overlapping row is complete in only one of the two chunks: keep the richer copy
+                if len(str(previous_document_field)) >= len(str(document_field)):
+                    document_field = previous_document_field
+            if field_id in next_overlap_field_ids:
+                # held until the next chunk has been compared with it
+                if field_id in dict_held_document_fields:
+                    yield dict_held_document_fields.pop(field_id)
+                dict_held_document_fields[field_id] = document_field
+                continue
+            yield document_field
+
+    yield from dict_held_document_fields.values()
+
+
+def get_text_table_rows(text_tables, field_ids):
+    array_text_tables = []
+    for text_table in text_tables:
+        header, array_rows = split_header_and_rows(text_table)
+        array_selected_rows = [
+            row for row in array_rows
+            if get_row_field_id(row) in field_ids
+        ]
+        if array_selected_rows:
+            array_text_tables.append("\n".join([header] + array_selected_rows))
+    return array_text_tables
@@ -0,0 +1,115 @@
+import re
+
+import ocr_text_chunker
+from ai_model_usage import estimate_tokens
+
+position_window = 4
+
+
+def normalize_line(line):
+    # page numbers and dates change from page to page, the text around them does not
+    return re.sub(r"\d+", "#", re.sub(r"\s+", " ", line.strip().lower()))
+
+
+def get_page_lines(text_tables):
+    return [
+        (table_index, line)
+        for table_index, text_table in enumerate(text_tables)
+        for line in text_table.splitlines()
+        if line.strip()
+    ]
+
+
+def get_row_indexes(array_page_lines):
+    return [index for index, (_, line) in enumerate(array_page_lines) if ocr_text_chunker.row_start_pattern.match(line)]
+
+
+def is_between_rows(array_row_indexes, index):
+    return bool(array_row_indexes) and array_row_indexes[0] < index < array_row_indexes[-1]
+
+
+def get_positioned_line_keys(array_page_lines):
+    # the same line in the first or last few lines of two pages is page furniture, unless it sits between table rows
+    array_row_indexes = get_row_indexes(array_page_lines)
+    array_keys = []
+    for index, (_, line) in enumerate(array_page_lines):
+        keys = set()
+        if not is_between_rows(array_row_indexes, index):
+            if index < position_window:
+                keys.add(("top", normalize_line(line)))
+            if len(array_page_lines) - 1 - index < position_window:
+                keys.add(("bottom", normalize_line(line)))
+        array_keys.append(keys)
+    return array_keys
+
+
+def deduplicate_page_text_tables(text_tables, array_neighbour_text_tables):
+    array_page_lines = get_page_lines(text_tables)
+    array_neighbour_line_keys = [
+        {key for keys in get_positioned_line_keys(get_page_lines(neighbour_text_tables)) for key in keys}
+        for neighbour_text_tables in array_neighbour_text_tables
+    ]
+    neighbour_line_keys = set().union(*array_neighbour_line_keys)
+
+    array_row_indexes = get_row_indexes(array_page_lines)
+    array_line_keys = get_positioned_line_keys(array_page_lines)
+
+    array_line_kinds = []
+    array_header_lines = []
+    is_before_first_row = {}
+    for index, ((table_index, line), keys) in enumerate(zip(array_page_lines, array_line_keys)):
+        # table rows are never dropped, two messages can start with the same standard fields
+        if ocr_text_chunker.row_start_pattern.match(line):
+            is_before_first_row[table_index] = False
+            array_line_kinds.append("row")
+        elif keys & neighbour_line_keys and is_before_first_row.get(table_index, True) \
+                and any(keyword in line.lower() for keyword in ocr_text_chunker.header_keywords):
+            if normalize_line(line) not in map(normalize_line, array_header_lines):
+                array_header_lines.append(line)
+            array_line_kinds.append("header")
+        elif array_row_indexes and index > array_row_indexes[-1]:
+            # below the last row it may still wrap that row: only a footer every neighbour repeats goes
+            is_repeated = bool(keys & neighbour_line_keys) \
+                and all(keys & neighbour_keys for neighbour_keys in array_neighbour_line_keys)
+            array_line_kinds.append("repeated" if is_repeated else "kept")
+        elif keys & neighbour_line_keys:
+            array_line_kinds.append("repeated")
+        else:
+            array_line_kinds.append("kept")
+
+    column_header = "\n".join(array_header_lines)
+    if not ocr_text_chunker.is_table_header(column_header):
+        # repeated lines that only look like column names are dropped all the same
+        column_header = ""
+
+    # the other tables of the page repeat the column names above their own rows
+    header_line_keys = {normalize_line(line) for line in column_header.splitlines()}
+    is_before_first_row = {}
+    dict_table_lines = {table_index: [] for table_index in range(len(text_tables))}
+    array_removed_lines = []
+    for (table_index, line), line_kind in zip(array_page_lines, array_line_kinds):
+        if line_kind == "row":
+            is_before_first_row[table_index] = False
+        if line_kind in ["header", "repeated"] or (
+                line_kind == "kept" and is_before_first_row.get(table_index, True)
+                and normalize_line(line) in header_line_keys
+        ):
+            array_removed_lines.append(line)
+        else:
+            dict_table_lines[table_index].append(line)
+
+    deduplicated_text_tables = [
+        "\n".join(dict_table_lines[table_index]) for table_index in range(len(text_tables))
+        if dict_table_lines[table_index]
+    ]
+
+    # the column header is sent back once with every request instead of once per table and page
+    number_requests = len(ocr_text_chunker.chunk_text_tables(deduplicated_text_tables)) if column_header else 0
+
+    return {
+        "text_tables": deduplicated_text_tables,
+        "column_header": column_header,
+        "removed_lines": array_removed_lines,
+        "tokens_saved": estimate_tokens("\n".join(array_removed_lines))
+        - number_requests * estimate_tokens(column_header)
+    }
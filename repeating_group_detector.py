@@ -0,0 +1,196 @@
+import logging
+import re
+
+import utils
+from sbe_type_inference import normalize_format, parse_field_name
+
+logger = logging.getLogger(__name__)
+
+num_in_group_name_pattern = re.compile(r"^No[A-Z0-9]")
+num_in_group_description_pattern = re.compile(
+    r"(number of .*(entries|elements|items|identifiers|repeating))|(size of the repeating group)",
+    re.IGNORECASE
+)
+
+# two names sharing at least this many leading characters belong to the same group
+strong_prefix_length = 4
+# a shorter shared prefix right after the group means the boundary needs a second opinion
+weak_prefix_length = 2
+ambiguous_window_size = 12
+
+
+def is_num_in_group_field(document_field):
+    document_format = utils.get_document_field_value(document_field, utils.document_field_format_keys)
+    if document_format is not None and normalize_format(document_format) == "numingroup":
+        return True
+
+    field_name = parse_field_name(document_field)
+    if field_name is None or not num_in_group_name_pattern.match(field_name):
+        return False
+
+    description = utils.get_document_field_value(
+        document_field,
+        utils.document_field_description_keys,
+        "",
+        match_key_prefix=True
+    )
+    return document_format is None or bool(num_in_group_description_pattern.search(str(description))) \
+        or normalize_format(document_format) in ["int", "integer", "uint8", "uint16"]
+
+
+def get_group_stem(num_in_group_field):
+    return parse_field_name(num_in_group_field)[2:]
+
+
+def get_group_name(group_stem):
+    if group_stem.endswith("ies"):
+        group_stem = group_stem[:-3] + "y"
+    elif group_stem.endswith("s"):
+        group_stem = group_stem[:-1]
+    return f"{group_stem}Group"
+
+
+def get_shared_prefix_length(first_name, second_name):
+    shared_prefix_length = 0
+    for first_character, second_character in zip(first_name.lower(), second_name.lower()):
+        if first_character != second_character:
+            break
+        shared_prefix_length = shared_prefix_length + 1
+    return shared_prefix_length
+
+
+def get_group_end(array_document_fields, group_stem, items_start, fields_end):
+    j = items_start
+    while j < fields_end and not is_num_in_group_field(array_document_fields[j]):
+        field_name = parse_field_name(array_document_fields[j]) or ""
+        if get_shared_prefix_length(group_stem, field_name) < strong_prefix_length:
+            break
+        j = j + 1
+    return j
+
+
+def scan_repeating_groups(array_document_fields, scan_end=None, is_end_open=False):
+    # is_end_open: the table goes on after the last field, a group reaching it is not closed by it
+    array_confident_groups = []
+    array_ambiguous_windows = []
+    scan_end = len(array_document_fields) if scan_end is None else scan_end
+
+    i = 0
+    while i < scan_end:
+        if not is_num_in_group_field(array_document_fields[i]):
+            i = i + 1
+            continue
+
+        group_stem = get_group_stem(array_document_fields[i])
+        j = get_group_end(array_document_fields, group_stem, i + 1, len(array_document_fields))
+
+        if j == len(array_document_fields) and is_end_open:
+            # closed once every page is known, by close_open_repeating_groups
+            array_confident_groups.append({
+                "group_id": utils.get_document_field_id(array_document_fields[i]),
+                "group_name": get_group_name(group_stem),
+                "items": array_document_fields[i + 1:j],
+                "is_open": True
+            })
+            i = j
+            continue
+
+        boundary_field_name = ""
+        if j < len(array_document_fields):
+            boundary_field_name = parse_field_name(array_document_fields[j]) or ""
+        boundary_prefix_length = get_shared_prefix_length(group_stem, boundary_field_name)
+        is_weak_boundary = weak_prefix_length <= boundary_prefix_length < strong_prefix_length
+
+        if j == i + 1 or is_weak_boundary:
+            window_end = min(i + ambiguous_window_size, len(array_document_fields))
+            array_ambiguous_windows.append(array_document_fields[i:window_end])
+        else:
+            array_confident_groups.append({
+                "group_id": utils.get_document_field_id(array_document_fields[i]),
+                "group_name": get_group_name(group_stem),
+                "items": array_document_fields[i + 1:j]
+            })
+
+        i = j
+
+    return array_confident_groups, array_ambiguous_windows
+
+
+def detect_repeating_groups(array_document_fields, generate_repeating_groups_function, scan_end=None,
+                            is_end_open=False):
+    # groups are only started before scan_end, the fields after it are there to close them
+    array_confident_groups, array_ambiguous_windows = scan_repeating_groups(
+        array_document_fields,
+        scan_end,
+        is_end_open
+    )
+
+    logger.info(
+        f"repeating group scan over {len(array_document_fields)} fields: {len(array_confident_groups)} resolved "
+        f"locally, {len(array_ambiguous_windows)} ambiguous windows sent to the AI model"
+    )
+
+    dict_repeating_groups = {}
+    for repeating_group in array_confident_groups:
+        dict_repeating_groups.setdefault(str(repeating_group["group_id"]), repeating_group)
+
+    for ambiguous_window in array_ambiguous_windows:
+        for repeating_group in generate_repeating_groups_function(ambiguous_window):
+            dict_repeating_groups.setdefault(str(repeating_group["group_id"]), repeating_group)
+
+    return list(dict_repeating_groups.values())
+
+
+def merge_repeating_groups(array_json_array_repeating_groups):
+    dict_repeating_groups = {}
+    for json_array_repeating_groups in array_json_array_repeating_groups:
+        for repeating_group in json_array_repeating_groups:
+            dict_repeating_groups.setdefault(str(repeating_group["group_id"]), repeating_group)
+    return list(dict_repeating_groups.values())
+
+
+def find_group_index(array_document_fields, repeating_group):
+    array_group_field_ids = [str(repeating_group["group_id"])] + [
+        utils.get_document_field_id(document_field) for document_field in repeating_group["items"]
+    ]
+    for index, document_field in enumerate(array_document_fields):
+        if utils.get_document_field_id(document_field) == array_group_field_ids[0] and [
+            utils.get_document_field_id(group_field)
+            for group_field in array_document_fields[index:index + len(array_group_field_ids)]
+        ] == array_group_field_ids:
+            return index
+    return None
+
+
+def close_open_repeating_groups(json_array_repeating_groups, json_array_document_fields_pages,
+                                array_is_page_continued=None):
+    # a group still open at the end of its two pages goes on into the next ones, until its fields or the table stop
+    array_document_fields = []
+    array_table_starts = []
+    for page_index, json_array_document_fields_page in enumerate(json_array_document_fields_pages):
+        if page_index > 0 and array_is_page_continued is not None and not array_is_page_continued[page_index]:
+            array_table_starts.append(len(array_document_fields))
+        array_document_fields.extend(json_array_document_fields_page)
+    array_table_starts.append(len(array_document_fields))
+
+    json_array_closed_repeating_groups = []
+    for repeating_group in json_array_repeating_groups:
+        repeating_group = dict(repeating_group)
+        if not repeating_group.pop("is_open", False):
+            json_array_closed_repeating_groups.append(repeating_group)
+            continue
+
+        group_index = find_group_index(array_document_fields, repeating_group)
+        if group_index is not None:
+            items_end = group_index + 1 + len(repeating_group["items"])
+            table_end = next(table_start for table_start in array_table_starts if table_start >= items_end)
+            group_stem = get_group_stem(array_document_fields[group_index])
+            group_end = get_group_end(array_document_fields, group_stem, items_end, table_end)
+            repeating_group["items"] = array_document_fields[group_index + 1:group_end]
+
+        if not repeating_group["items"]:
+            logger.warning(f"repeating group {repeating_group['group_id']} has no item on the following pages")
+            continue
+        json_array_closed_repeating_groups.append(repeating_group)
+
+    return json_array_closed_repeating_groups
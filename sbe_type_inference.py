@@ -0,0 +1,264 @@
+import re
+
+import utils
+
+sbe_primitive_type_lengths = {
+    "char": 1,
+    "int8": 1,
+    "uint8": 1,
+    "int16": 2,
+    "uint16": 2,
+    "int32": 4,
+    "uint32": 4,
+    "int64": 8,
+    "uint64": 8,
+    "float": 4,
+    "double": 8
+}
+
+# (primitive type, min value, max value, null value) in order of increasing size
+sbe_integer_type_ranges = [
+    ("uint8", 0, 255, 255),
+    ("int8", -128, 127, -128),
+    ("uint16", 0, 65535, 65535),
+    ("int16", -32768, 32767, -32768),
+    ("uint32", 0, 4294967295, 4294967295),
+    ("int32", -2147483648, 2147483647, -2147483648),
+    ("uint64", 0, 18446744073709551615, 18446744073709551615),
+    ("int64", -9223372036854775808, 9223372036854775807, -9223372036854775808)
+]
+integer_encoding_types = [primitive_type for primitive_type, _, _, _ in sbe_integer_type_ranges]
+custom_type_kinds = ["enum", "set"]
+
+char_string_formats = ["utctimestamp", "utcdateonly", "utctimeonly", "localmktdate", "tztimeonly", "monthyear",
+                       "string", "alpha", "alphanumeric"]
+enum_formats = ["char", "int", "integer", "string", "uint8", "uint16", "uint32"]
+set_formats = ["multiplecharvalue", "multiplevaluestring", "multiplestringvalue"]
+integer_formats = ["int", "integer", "seqnum", "length"]
+
+mandatory_presence_values = ["m", "a", "y", "yes", "mandatory", "required"]
+optional_presence_values = ["c", "n", "o", "no", "optional"]
+
+enum_value_pattern = re.compile(r"(?:^|(?<=[\s,;]))([0-9A-Za-z]{1,3})\s?=\s?")
+range_pattern = re.compile(r"^from\s+(\S+(?:\s*[+-]\s*\d+)?)\s+to\s+(\S+(?:\s*[+-]\s*\d+)?)$", re.IGNORECASE)
+numeric_expression_pattern = re.compile(r"^(-)?(\d+)(?:\^(\d+))?(?:([+-])(\d+))?$")
+field_name_pattern = re.compile(r"^[A-Za-z][A-Za-z0-9_]*$")
+
+
+def normalize_format(document_format):
+    normalized_format = re.sub(r"\s+", "", str(document_format)).lower()
+    # OCR regularly truncates the last letter of "UTCTimestamp" on narrow columns
+    if normalized_format.startswith("utctimestam"):
+        return "utctimestamp"
+    return normalized_format
+
+
+def parse_integer(value):
+    try:
+        return int(str(value).strip())
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_presence(document_field):
+    # None when the document does not say: the caller knows which presence to fall back to
+    presence = utils.get_document_field_value(document_field, utils.document_field_presence_keys)
+    if presence is None:
+        return None
+    presence = str(presence).strip().lower()
+    if presence in mandatory_presence_values:
+        return "mandatory"
+    if presence in optional_presence_values:
+        return "optional"
+    return None
+
+
+def parse_field_name(document_field):
+    field_name = utils.get_document_field_value(document_field, utils.document_field_name_keys)
+    if field_name is None:
+        return None
+    field_name = re.sub(r"\s+", "", str(field_name))
+    if not field_name_pattern.match(field_name):
+        return None
+    return field_name
+
+
+def parse_numeric_expression(expression):
+    match = numeric_expression_pattern.match(re.sub(r"\s+", "", expression))
+    if match is None:
+        return None
+    sign, base, exponent, offset_sign, offset = match.groups()
+    # "2463-1" is how OCR renders "2^63-1": a bare literal with an offset is not trustworthy
+    if exponent is None and offset is not None:
+        return None
+    value = int(base) ** int(exponent) if exponent is not None else int(base)
+    if sign:
+        value = -value
+    if offset is not None:
+        value = value + int(offset) if offset_sign == "+" else value - int(offset)
+    return value
+
+
+def parse_range(possible_values):
+    match = range_pattern.match(str(possible_values).strip())
+    if match is None:
+        return None
+    min_value = parse_numeric_expression(match.group(1))
+    max_value = parse_numeric_expression(match.group(2))
+    if min_value is None or max_value is None or min_value > max_value:
+        return None
+    return min_value, max_value
+
+
+def parse_enum_structure(possible_values):
+    if isinstance(possible_values, dict):
+        return {str(key): str(value) for key, value in possible_values.items()} or None
+
+    possible_values = str(possible_values).strip()
+    matches = list(enum_value_pattern.finditer(possible_values))
+    if not matches or matches[0].start() != 0:
+        return None
+
+    structure = {}
+    for index, match in enumerate(matches):
+        end = matches[index + 1].start() if index + 1 < len(matches) else len(possible_values)
+        description = possible_values[match.end():end].strip(" ,;")
+        key = match.group(1)
+        if not description or key in structure:
+            return None
+        structure[key] = description
+    return structure
+
+
+def get_smallest_integer_type(min_value, max_value, presence):
+    for primitive_type, type_min_value, type_max_value, null_value in sbe_integer_type_ranges:
+        # the null value is reserved when the field is optional
+        if presence == "optional":
+            if null_value == type_min_value:
+                type_min_value = type_min_value + 1
+            else:
+                type_max_value = type_max_value - 1
+        if type_min_value <= min_value and max_value <= type_max_value:
+            return primitive_type
+    return None
+
+
+def get_custom_data_type(field_name, kind):
+    # prompt_data_type.md: the field name in camelCase followed by _enum or _set
+    return f"{field_name[0].lower()}{field_name[1:]}_{kind}"
+
+
+def get_custom_type_kind(data_type):
+    for kind in custom_type_kinds:
+        if str(data_type).lower().endswith(f"_{kind}"):
+            return kind
+    return None
+
+
+def get_document_disagreements(document_field, sbe_field):
+    # what the document states explicitly is checked, a column it leaves empty agrees with anything
+    array_disagreements = []
+    document_format = utils.get_document_field_value(document_field, utils.document_field_format_keys)
+    document_format = normalize_format(document_format) if document_format else None
+    possible_values = utils.get_document_field_value(document_field, utils.document_field_values_keys, "")
+    enum_structure = parse_enum_structure(possible_values) if possible_values else None
+    kind = get_custom_type_kind(sbe_field["data_type"])
+    encoding_type = sbe_field["encoding_type"]
+
+    if enum_structure is not None and set(enum_structure) != set(sbe_field.get("structure") or {}):
+        array_disagreements.append(
+            f"values {sorted(sbe_field.get('structure') or {})} are not the documented {sorted(enum_structure)}"
+        )
+    if document_format in set_formats and kind != "set":
+        array_disagreements.append(f"{sbe_field['data_type']} is not a set for format {document_format}")
+    elif document_format == "char" and encoding_type != "char":
+        array_disagreements.append(f"encoding {encoding_type} is not char for format {document_format}")
+    elif document_format in integer_formats and encoding_type not in integer_encoding_types:
+        array_disagreements.append(f"encoding {encoding_type} is not an integer for format {document_format}")
+    elif document_format in sbe_primitive_type_lengths and document_format != "char" \
+            and encoding_type != document_format:
+        array_disagreements.append(f"encoding {encoding_type} is not the documented {document_format}")
+
+    return array_disagreements
+
+
+def build_sbe_field(field_id, field_name, data_type, encoding_type, length, presence, structure=None):
+    return {
+        "field_id": field_id,
+        "field_name": field_name,
+        "data_type": data_type,
+        "encoding_type": encoding_type,
+        "length": length,
+        "presence": presence,
+        "structure": structure or {}
+    }
+
+
+def infer_sbe_field(document_field):
+    field_id = parse_integer(utils.get_document_field_value(document_field, utils.document_field_tag_keys))
+    field_name = parse_field_name(document_field)
+    presence = parse_presence(document_field)
+    if utils.get_document_field_value(document_field, utils.document_field_presence_keys) is None:
+        # a table without a presence column only lists mandatory fields, a value we cannot read is left to the model
+        presence = "mandatory"
+    document_format = utils.get_document_field_value(document_field, utils.document_field_format_keys)
+    if field_id is None or field_name is None or presence is None or document_format is None:
+        return None
+
+    document_format = normalize_format(document_format)
+    length = parse_integer(utils.get_document_field_value(document_field, utils.document_field_length_keys))
+    possible_values = utils.get_document_field_value(document_field, utils.document_field_values_keys, "")
+    enum_structure = parse_enum_structure(possible_values) if possible_values else None
+    value_range = parse_range(possible_values) if possible_values and enum_structure is None else None
+
+    if document_format in set_formats:
+        if enum_structure is None or length is None:
+            return None
+        return build_sbe_field(field_id, field_name, get_custom_data_type(field_name, "set"), "char", length, presence,
+                               enum_structure)
+
+    if enum_structure is not None:
+        if document_format not in enum_formats:
+            return None
+        if document_format in ["char", "string"]:
+            if length != 1:
+                return None
+            return build_sbe_field(field_id, field_name, get_custom_data_type(field_name, "enum"), "char", 1, presence,
+                                   enum_structure)
+        enum_values = [parse_integer(key) for key in enum_structure]
+        if None in enum_values:
+            return None
+        if document_format in sbe_primitive_type_lengths:
+            encoding_type = document_format
+        else:
+            encoding_type = get_smallest_integer_type(min(enum_values), max(enum_values), presence)
+        if encoding_type is None:
+            return None
+        return build_sbe_field(field_id, field_name, get_custom_data_type(field_name, "enum"), encoding_type,
+                               sbe_primitive_type_lengths[encoding_type], presence, enum_structure)
+
+    if document_format in sbe_primitive_type_lengths and document_format != "char":
+        return build_sbe_field(field_id, field_name, document_format, document_format,
+                               sbe_primitive_type_lengths[document_format], presence)
+
+    if document_format in integer_formats:
+        if value_range is None:
+            return None
+        data_type = get_smallest_integer_type(value_range[0], value_range[1], presence)
+        if data_type is None:
+            return None
+        return build_sbe_field(field_id, field_name, data_type, data_type, sbe_primitive_type_lengths[data_type],
+                               presence)
+
+    if document_format in char_string_formats or document_format == "char":
+        # numeric ranges on string columns usually hide an integer identifier: leave it to the model
+        if length is None or length <= 0 or re.search(r"\bfrom\b.*\bto\b", str(possible_values), re.IGNORECASE):
+            return None
+        return build_sbe_field(field_id, field_name, "char", "char", length, presence)
+
+    return None
+
+
+def infer_sbe_fields(array_document_fields):
+    return [infer_sbe_field(document_field) for document_field in array_document_fields]
+
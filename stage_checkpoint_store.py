@@ -0,0 +1,102 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from pathlib import Path
+
+import utils
+
+logger = logging.getLogger(__name__)
+
+manifest_file_name = "manifest.json"
+checkpoints_folder_name = "checkpoints"
+
+
+def get_file_hash(file_path, block_size=1 << 20):
+    file_hash = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b""):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def get_json_value(value):
+    # typed stage results are hashed through their JSON form
+    return value.to_dict() if hasattr(value, "to_dict") else str(value)
+
+
+def get_input_hash(*inputs):
+    # the outputs of the previous stages are JSON: the same fields in another key order are the same inputs
+    return hashlib.sha256(
+        json.dumps(inputs, sort_keys=True, ensure_ascii=False, default=get_json_value).encode('utf-8')
+    ).hexdigest()
+
+
+def write_json_file(file_path, data):
+    utils.write_text_file_atomically(file_path, json.dumps(data, indent=4, ensure_ascii=False))
+
+
+class StageCheckpointStore:
+    def __init__(self, run_directory, run_description=None, is_resuming=False):
+        self.run_directory = Path(run_directory)
+        self.manifest_path = self.run_directory / manifest_file_name
+        self.lock = threading.Lock()
+        self.run_description = run_description or {}
+        self.dict_checkpoints = {}
+        self.number_reused = 0
+        self.number_saved = 0
+
+        (self.run_directory / checkpoints_folder_name).mkdir(parents=True, exist_ok=True)
+        if is_resuming and self.manifest_path.exists():
+            self.dict_checkpoints = json.loads(self.manifest_path.read_text(encoding='utf-8'))["checkpoints"]
+            logger.info(f"resuming from {len(self.dict_checkpoints)} checkpoints in {self.run_directory}")
+        with self.lock:
+            self.save_manifest()
+
+    def get_checkpoint_path(self, task_name):
+        return self.run_directory / checkpoints_folder_name / f"{task_name}.json"
+
+    def save_manifest(self):
+        write_json_file(self.manifest_path, {"run": self.run_description, "checkpoints": self.dict_checkpoints})
+
+    def is_saved(self, task_name, input_hash):
+        with self.lock:
+            checkpoint = self.dict_checkpoints.get(task_name)
+        return checkpoint is not None and checkpoint["input_hash"] == input_hash \
+            and self.get_checkpoint_path(task_name).exists()
+
+    def load(self, task_name, input_hash):
+        if not self.is_saved(task_name, input_hash):
+            return False, None
+
+        try:
+            output = json.loads(self.get_checkpoint_path(task_name).read_text(encoding='utf-8'))
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"checkpoint of {task_name} cannot be read, the stage runs again: {e}")
+            return False, None
+
+        with self.lock:
+            self.number_reused = self.number_reused + 1
+        return True, output
+
+    def save(self, task_name, input_hash, output):
+        checkpoint_path = self.get_checkpoint_path(task_name)
+        write_json_file(checkpoint_path, output)
+
+        with self.lock:
+            self.dict_checkpoints[task_name] = {
+                "input_hash": input_hash,
+                "checkpoint_path": str(checkpoint_path.relative_to(self.run_directory)),
+                "saved_at": time.strftime("%Y-%m-%dT%H:%M:%S")
+            }
+            self.number_saved = self.number_saved + 1
+            self.save_manifest()
+
+    def get_report(self):
+        with self.lock:
+            return {
+                "run_directory": str(self.run_directory),
+                "reused": self.number_reused,
+                "saved": self.number_saved
+            }
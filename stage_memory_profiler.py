@@ -0,0 +1,330 @@
+import contextvars
+import gc
+import json
+import logging
+import re
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+
+import utils
+
+logger = logging.getLogger(__name__)
+
+memory_profile_file_name = "memory_profile.json"
+number_top_allocators = 10
+# below this a line is noise, the file reads of the RSS sampler among them
+min_allocator_bytes = 4096
+# the page of a task name, and its stage once the page is taken out, as for the stage metrics
+page_number_pattern = re.compile(r"page_(\d+)")
+page_suffix_pattern = re.compile(r"_(document_fields_)?page_\d+")
+
+active_memory_profiler = contextvars.ContextVar("active_memory_profiler", default=None)
+active_stage_record = contextvars.ContextVar("active_stage_record", default=None)
+
+
+class PeakMemorySampler:
+    def __init__(self, sampling_interval=0.002):
+        self.sampling_interval = sampling_interval
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.starting_memory = None
+        self.peak_memory = None
+
+    def sample(self):
+        resident_memory = utils.get_resident_memory()
+        if resident_memory is not None:
+            self.peak_memory = max(self.peak_memory or 0, resident_memory)
+
+    def sample_until_stopped(self):
+        # the CV and OCR stages release the GIL, so the sampler keeps running while they allocate
+        while not self.stop_event.wait(self.sampling_interval):
+            self.sample()
+
+    def __enter__(self):
+        self.starting_memory = utils.get_resident_memory()
+        self.sample()
+        self.thread = threading.Thread(target=self.sample_until_stopped, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop_event.set()
+        self.thread.join()
+        self.sample()
+
+
+def get_megabytes(number_bytes):
+    return None if number_bytes is None else round(number_bytes / 2 ** 20, 2)
+
+
+def get_memory_difference(memory_after, memory_before):
+    return None if memory_after is None or memory_before is None else memory_after - memory_before
+
+
+def take_snapshot():
+    # the snapshots themselves and the import machinery are not allocations of the stages
+    return tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        tracemalloc.Filter(False, "<unknown>")
+    ])
+
+
+class StageMemoryProfiler:
+    def __init__(self, top_allocators=number_top_allocators):
+        self.top_allocators = top_allocators
+        self.array_stage_records = []
+        self.lock = threading.Lock()
+        self.is_tracemalloc_owned = False
+        self.starting_resident_memory = None
+        self.starting_traced_memory = None
+        self.ending_resident_memory = None
+        self.ending_traced_memory = None
+        self.peak_memory_sampler = None
+        self.start_time = None
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.is_tracemalloc_owned = True
+        gc.collect()
+        self.starting_resident_memory = utils.get_resident_memory()
+        self.starting_traced_memory = tracemalloc.get_traced_memory()[0]
+        self.peak_memory_sampler = PeakMemorySampler(sampling_interval=0.01).__enter__()
+        self.start_time = time.perf_counter()
+
+    def stop(self):
+        self.peak_memory_sampler.__exit__(None, None, None)
+        gc.collect()
+        self.ending_resident_memory = utils.get_resident_memory()
+        self.ending_traced_memory = tracemalloc.get_traced_memory()[0]
+        if self.is_tracemalloc_owned:
+            tracemalloc.stop()
+
+    @contextmanager
+    def profile_stage(self, task_name):
+        parent_record = active_stage_record.get()
+        page_number_match = page_number_pattern.search(task_name)
+        stage_record = {
+            "task_name": task_name,
+            "stage_name": page_suffix_pattern.sub("", task_name),
+            # the filters of a page do not carry its number, their page task does
+            "page_number": int(page_number_match.group(1)) if page_number_match
+            else parent_record and parent_record["page_number"],
+            "depth": 0 if parent_record is None else parent_record["depth"] + 1,
+            "traced_peak": 0
+        }
+        if parent_record is None:
+            # what a page keeps alive is measured without the garbage the previous stages left to the collector
+            gc.collect()
+        if parent_record is not None:
+            # the peak of tracemalloc is reset for every stage: the parent keeps the highest one seen so far
+            parent_record["traced_peak"] = max(parent_record["traced_peak"], tracemalloc.get_traced_memory()[1])
+
+        # the sampler is started before the first snapshot: its own thread is not an allocation of the stage
+        memory_sampler = PeakMemorySampler().__enter__()
+        snapshot_before = take_snapshot()
+        tracemalloc.reset_peak()
+        traced_memory_before = tracemalloc.get_traced_memory()[0]
+        stage_record_token = active_stage_record.set(stage_record)
+        start_time = time.perf_counter()
+        stage_record["started_at"] = round(start_time - self.start_time, 3)
+        try:
+            yield stage_record
+        finally:
+            active_stage_record.reset(stage_record_token)
+            stage_record["seconds"] = round(time.perf_counter() - start_time, 3)
+            stage_record["traced_peak"] = max(stage_record["traced_peak"], tracemalloc.get_traced_memory()[1])
+            if parent_record is not None:
+                parent_record["traced_peak"] = max(parent_record["traced_peak"], stage_record["traced_peak"])
+            if parent_record is None:
+                gc.collect()
+            snapshot_difference = take_snapshot().compare_to(snapshot_before, "lineno")
+            memory_sampler.__exit__(None, None, None)
+            self.record(stage_record, memory_sampler, traced_memory_before, snapshot_difference)
+
+    def record(self, stage_record, memory_sampler, traced_memory_before, snapshot_difference):
+        stage_record.update({
+            "resident_memory_before": memory_sampler.starting_memory,
+            "resident_memory_after": utils.get_resident_memory(),
+            "peak_resident_memory": memory_sampler.peak_memory,
+            # still allocated when the stage is over: the output it returns and whatever leaks
+            "traced_retained": sum(statistic.size_diff for statistic in snapshot_difference),
+            "traced_peak_increase": stage_record.pop("traced_peak") - traced_memory_before,
+            "top_allocators": [
+                {
+                    "location": f"{statistic.traceback[0].filename}:{statistic.traceback[0].lineno}",
+                    "size_difference": statistic.size_diff,
+                    "count_difference": statistic.count_diff
+                }
+                for statistic in sorted(snapshot_difference, key=lambda statistic: statistic.size_diff,
+                                        reverse=True)[:self.top_allocators]
+                if statistic.size_diff >= min_allocator_bytes
+            ]
+        })
+        with self.lock:
+            self.array_stage_records.append(stage_record)
+
+    def get_stage_reports(self):
+        dict_stage_reports = {}
+        for stage_record in self.array_stage_records:
+            stage_report = dict_stage_reports.setdefault(stage_record["stage_name"], {
+                "stage_name": stage_record["stage_name"],
+                "depth": stage_record["depth"],
+                "first_started_at": stage_record["started_at"],
+                "calls": 0,
+                "seconds": 0.0,
+                "resident_memory_delta": 0,
+                "max_peak_resident_memory_increase": 0,
+                "traced_retained": 0,
+                "max_traced_peak_increase": 0,
+                "dict_allocators": {}
+            })
+            stage_report["first_started_at"] = min(stage_report["first_started_at"], stage_record["started_at"])
+            stage_report["calls"] = stage_report["calls"] + 1
+            stage_report["seconds"] = stage_report["seconds"] + stage_record["seconds"]
+            stage_report["resident_memory_delta"] = stage_report["resident_memory_delta"] + (get_memory_difference(
+                stage_record["resident_memory_after"], stage_record["resident_memory_before"]
+            ) or 0)
+            stage_report["max_peak_resident_memory_increase"] = max(
+                stage_report["max_peak_resident_memory_increase"],
+                get_memory_difference(stage_record["peak_resident_memory"], stage_record["resident_memory_before"]) or 0
+            )
+            stage_report["traced_retained"] = stage_report["traced_retained"] + stage_record["traced_retained"]
+            stage_report["max_traced_peak_increase"] = max(
+                stage_report["max_traced_peak_increase"],
+                stage_record["traced_peak_increase"]
+            )
+            for allocator in stage_record["top_allocators"]:
+                stage_report["dict_allocators"][allocator["location"]] = \
+                    stage_report["dict_allocators"].get(allocator["location"], 0) + allocator["size_difference"]
+
+        array_stage_reports = []
+        # in the order the stages first ran: the filters of a page come right after its page task
+        for stage_report in sorted(dict_stage_reports.values(),
+                                   key=lambda stage_report: stage_report["first_started_at"]):
+            dict_allocators = stage_report.pop("dict_allocators")
+            array_stage_reports.append({
+                "stage_name": stage_report["stage_name"],
+                "depth": stage_report["depth"],
+                "first_started_at": stage_report["first_started_at"],
+                "calls": stage_report["calls"],
+                "seconds": round(stage_report["seconds"], 3),
+                "resident_memory_delta_mb": get_megabytes(stage_report["resident_memory_delta"]),
+                "max_peak_resident_memory_increase_mb": get_megabytes(
+                    stage_report["max_peak_resident_memory_increase"]
+                ),
+                "traced_retained_mb": get_megabytes(stage_report["traced_retained"]),
+                "max_traced_peak_increase_mb": get_megabytes(stage_report["max_traced_peak_increase"]),
+                "top_allocators": [
+                    {"location": location, "size_difference_mb": get_megabytes(size_difference)}
+                    for location, size_difference in sorted(
+                        dict_allocators.items(), key=lambda item: item[1], reverse=True
+                    )[:self.top_allocators]
+                ]
+            })
+        return array_stage_reports
+
+    def get_page_reports(self):
+        # only the page tasks of the scheduler count: their filters are already inside them
+        dict_page_reports = {}
+        for stage_record in self.array_stage_records:
+            if stage_record["depth"] != 0 or stage_record["page_number"] is None:
+                continue
+            page_report = dict_page_reports.setdefault(stage_record["page_number"], {
+                "page_number": stage_record["page_number"],
+                "traced_retained": 0,
+                "resident_memory_delta": 0,
+                "max_peak_resident_memory": 0
+            })
+            page_report["traced_retained"] = page_report["traced_retained"] + stage_record["traced_retained"]
+            page_report["resident_memory_delta"] = page_report["resident_memory_delta"] + (get_memory_difference(
+                stage_record["resident_memory_after"], stage_record["resident_memory_before"]
+            ) or 0)
+            page_report["max_peak_resident_memory"] = max(
+                page_report["max_peak_resident_memory"], stage_record["peak_resident_memory"] or 0
+            )
+
+        return [
+            {
+                "page_number": page_report["page_number"],
+                "traced_retained_mb": get_megabytes(page_report["traced_retained"]),
+                "resident_memory_delta_mb": get_megabytes(page_report["resident_memory_delta"]),
+                "max_peak_resident_memory_mb": get_megabytes(page_report["max_peak_resident_memory"])
+            }
+            for page_report in sorted(dict_page_reports.values(), key=lambda page_report: page_report["page_number"])
+        ]
+
+    def get_report(self):
+        return {
+            "starting_resident_memory_mb": get_megabytes(self.starting_resident_memory),
+            "ending_resident_memory_mb": get_megabytes(self.ending_resident_memory),
+            "peak_resident_memory_mb": get_megabytes(self.peak_memory_sampler.peak_memory),
+            # after a collection: what the run still holds once it returned its results
+            "run_traced_retained_mb": get_megabytes(self.ending_traced_memory - self.starting_traced_memory),
+            "stages": self.get_stage_reports(),
+            "pages": self.get_page_reports(),
+            "stage_records": self.array_stage_records
+        }
+
+
+def log_memory_report(memory_report):
+    logger.info(
+        f"memory: {memory_report['starting_resident_memory_mb']} MB at the start, "
+        f"{memory_report['peak_resident_memory_mb']} MB at the peak, {memory_report['ending_resident_memory_mb']} MB "
+        f"at the end, {memory_report['run_traced_retained_mb']} MB of Python objects still held by the run"
+    )
+    for stage_report in memory_report["stages"]:
+        top_allocator = stage_report["top_allocators"][0]["location"] if stage_report["top_allocators"] else "-"
+        logger.info(
+            f"memory of stage {'  ' * stage_report['depth']}{stage_report['stage_name']}: {stage_report['calls']} "
+            f"calls, RSS {stage_report['resident_memory_delta_mb']:+} MB, peak +"
+            f"{stage_report['max_peak_resident_memory_increase_mb']} MB, retained "
+            f"{stage_report['traced_retained_mb']:+} MB, top allocator {top_allocator}"
+        )
+    for page_report in memory_report["pages"]:
+        logger.info(
+            f"memory of page {page_report['page_number']}: retained {page_report['traced_retained_mb']:+} MB, "
+            f"RSS {page_report['resident_memory_delta_mb']:+} MB"
+        )
+
+
+@contextmanager
+def profile_stage(task_name):
+    memory_profiler = active_memory_profiler.get()
+    if memory_profiler is None:
+        yield None
+        return
+    with memory_profiler.profile_stage(task_name) as stage_record:
+        yield stage_record
+
+
+def is_profiling():
+    return active_memory_profiler.get() is not None
+
+
+@contextmanager
+def start_memory_profile(run_directory, top_allocators=number_top_allocators):
+    if run_directory is None:
+        yield None
+        return
+
+    memory_profiler = StageMemoryProfiler(top_allocators)
+    memory_profiler.start()
+    memory_profiler_token = active_memory_profiler.set(memory_profiler)
+    try:
+        yield memory_profiler
+    finally:
+        active_memory_profiler.reset(memory_profiler_token)
+        memory_profiler.stop()
+        memory_report = memory_profiler.get_report()
+        log_memory_report(memory_report)
+        memory_profile_path = Path(run_directory) / memory_profile_file_name
+        utils.create_directory_if_not_exists(str(Path(run_directory)))
+        utils.write_text_file_atomically(memory_profile_path, json.dumps(memory_report, indent=4))
+        logger.info(f"memory profile of {len(memory_report['stage_records'])} stages written to {memory_profile_path}")
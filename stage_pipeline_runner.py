@@ -0,0 +1,153 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from metrics_registry import stage_duration_histogram, stage_errors_counter, stage_queue_depth_gauge
+from stage_result import StageResult
+
+logger = logging.getLogger(__name__)
+
+end_of_stream = object()
+
+
+class PipelineStage:
+    def __init__(self, stage_name, function, number_workers=1, process_pool=None):
+        self.stage_name = stage_name
+        self.function = function
+        self.number_workers = number_workers
+        # with a process pool the worker threads only dispatch: the work itself runs in the pool
+        self.process_pool = process_pool
+        self.lock = threading.Lock()
+        self.busy_time = 0.0
+        self.blocked_time = 0.0
+        self.number_items = 0
+        self.number_failures = 0
+        self.array_queue_depths = []
+
+    def execute(self, data):
+        if self.process_pool is not None:
+            return self.process_pool.submit(self.function, data).result()
+        return self.function(data)
+
+    def record_item(self, busy_time, is_failed):
+        with self.lock:
+            self.busy_time = self.busy_time + busy_time
+            self.number_items = self.number_items + 1
+            self.number_failures = self.number_failures + int(is_failed)
+        stage_duration_histogram.observe(busy_time, stage=self.stage_name)
+        if is_failed:
+            stage_errors_counter.inc(stage=self.stage_name)
+
+    def record_queue_depth(self, queue_depth):
+        with self.lock:
+            self.array_queue_depths.append(queue_depth)
+        stage_queue_depth_gauge.set(queue_depth, stage=self.stage_name)
+
+    def record_blocked_time(self, blocked_time):
+        with self.lock:
+            self.blocked_time = self.blocked_time + blocked_time
+
+
+class StagePipelineRunner:
+    def __init__(self, array_stages, queue_size=2):
+        self.array_stages = array_stages
+        self.queue_size = queue_size
+        self.array_threads = []
+        self.start_time = None
+        self.end_time = None
+
+    def start(self, items):
+        items = list(items)
+        array_futures = [Future() for _ in items]
+        # one bounded queue in front of every stage: a fast stage blocks instead of piling up pages in memory
+        array_queues = [queue.Queue(maxsize=self.queue_size) for _ in self.array_stages]
+        array_remaining_workers = [stage.number_workers for stage in self.array_stages]
+        remaining_workers_lock = threading.Lock()
+        self.start_time = time.perf_counter()
+
+        def put(stage_index, queue_item):
+            if stage_index == len(self.array_stages):
+                return
+            put_start_time = time.perf_counter()
+            array_queues[stage_index].put(queue_item)
+            if stage_index > 0:
+                self.array_stages[stage_index - 1].record_blocked_time(time.perf_counter() - put_start_time)
+
+        def feed_items():
+            for item_index, item in enumerate(items):
+                put(0, (item_index, item))
+            for _ in range(self.array_stages[0].number_workers):
+                put(0, end_of_stream)
+
+        def run_stage_worker(stage_index):
+            stage = self.array_stages[stage_index]
+            is_last_stage = stage_index == len(self.array_stages) - 1
+            while True:
+                queue_item = array_queues[stage_index].get()
+                stage.record_queue_depth(array_queues[stage_index].qsize())
+                if queue_item is end_of_stream:
+                    break
+
+                item_index, data = queue_item
+                busy_start_time = time.perf_counter()
+                try:
+                    data = stage.execute(data)
+                except Exception as e:
+                    stage.record_item(time.perf_counter() - busy_start_time, True)
+                    logger.error(f"stage '{stage.stage_name}' failed on item {items[item_index]}: {e}")
+                    array_futures[item_index].set_exception(e)
+                    continue
+                stage.record_item(time.perf_counter() - busy_start_time, False)
+
+                # an empty or failed item leaves the pipeline here instead of going through the next stages
+                if is_last_stage or (isinstance(data, StageResult) and not data.is_ok):
+                    array_futures[item_index].set_result(data)
+                    self.end_time = time.perf_counter()
+                else:
+                    put(stage_index + 1, (item_index, data))
+
+            # the last worker of a stage to finish closes the next stage
+            with remaining_workers_lock:
+                array_remaining_workers[stage_index] = array_remaining_workers[stage_index] - 1
+                is_stage_done = array_remaining_workers[stage_index] == 0
+            if is_stage_done and not is_last_stage:
+                for _ in range(self.array_stages[stage_index + 1].number_workers):
+                    put(stage_index + 1, end_of_stream)
+
+        self.array_threads = [threading.Thread(target=feed_items, daemon=True)]
+        for stage_index, stage in enumerate(self.array_stages):
+            self.array_threads.extend(
+                threading.Thread(target=run_stage_worker, args=(stage_index,), daemon=True)
+                for _ in range(stage.number_workers)
+            )
+        for thread in self.array_threads:
+            thread.start()
+
+        return array_futures
+
+    def join(self):
+        for thread in self.array_threads:
+            thread.join()
+        self.end_time = self.end_time or time.perf_counter()
+
+    def get_report(self):
+        elapsed_time = max((self.end_time or time.perf_counter()) - self.start_time, 1e-9)
+        array_stage_reports = []
+        for stage in self.array_stages:
+            with stage.lock:
+                array_stage_reports.append({
+                    "stage_name": stage.stage_name,
+                    "workers": stage.number_workers,
+                    "items": stage.number_items,
+                    "failures": stage.number_failures,
+                    "busy_seconds": round(stage.busy_time, 3),
+                    "utilization": round(stage.busy_time / (elapsed_time * stage.number_workers), 3),
+                    "blocked_seconds": round(stage.blocked_time, 3),
+                    "mean_queue_depth": round(
+                        sum(stage.array_queue_depths) / len(stage.array_queue_depths), 2
+                    ) if stage.array_queue_depths else 0.0,
+                    "max_queue_depth": max(stage.array_queue_depths, default=0)
+                })
+        return {"elapsed_seconds": round(elapsed_time, 3), "stages": array_stage_reports}
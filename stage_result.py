@@ -0,0 +1,53 @@
+stage_status_ok = "ok"
+stage_status_empty = "empty"
+stage_status_failed = "failed"
+stage_statuses = [stage_status_ok, stage_status_empty, stage_status_failed]
+
+
+class StageResult:
+    def __init__(self, status, stage_name, output=None, reason=None):
+        if status not in stage_statuses:
+            raise ValueError(f"Stage status '{status}' is not one of {stage_statuses}.")
+        self.status = status
+        self.stage_name = stage_name
+        self.output = output
+        self.reason = reason
+
+    @classmethod
+    def ok(cls, stage_name, output):
+        return cls(stage_status_ok, stage_name, output)
+
+    @classmethod
+    def empty(cls, stage_name, reason):
+        return cls(stage_status_empty, stage_name, reason=reason)
+
+    @classmethod
+    def failed(cls, stage_name, reason):
+        # the reason is kept as text: results cross process boundaries and are checkpointed as JSON
+        return cls(stage_status_failed, stage_name, reason=str(reason))
+
+    @property
+    def is_ok(self):
+        return self.status == stage_status_ok
+
+    @property
+    def is_failed(self):
+        return self.status == stage_status_failed
+
+    def get_output(self, default=None):
+        return self.output if self.is_ok else default
+
+    def to_dict(self):
+        return {"status": self.status, "stage_name": self.stage_name, "output": self.output, "reason": self.reason}
+
+    @classmethod
+    def from_dict(cls, dict_stage_result):
+        return cls(
+            dict_stage_result["status"],
+            dict_stage_result["stage_name"],
+            dict_stage_result.get("output"),
+            dict_stage_result.get("reason")
+        )
+
+    def __repr__(self):
+        return f"StageResult({self.status!r}, {self.stage_name!r}, reason={self.reason!r})"
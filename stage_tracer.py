@@ -0,0 +1,194 @@
+import contextvars
+import itertools
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import utils
+
+logger = logging.getLogger(__name__)
+
+trace_file_name = "trace.json"
+trace_events_folder_name = "trace_events"
+
+active_tracer = contextvars.ContextVar("active_tracer", default=None)
+active_span = contextvars.ContextVar("active_span", default=None)
+# the span of the parent process a page worker runs under
+remote_parent_span_id = contextvars.ContextVar("remote_parent_span_id", default=None)
+span_ids = itertools.count(1)
+
+
+class Span:
+    def __init__(self, name, category, parent_span_id, attributes):
+        self.name = name
+        self.category = category
+        # unique across the processes of a run: the workers of the page pool trace into the same file
+        self.span_id = f"{os.getpid()}.{next(span_ids)}"
+        self.parent_span_id = parent_span_id
+        self.attributes = attributes
+        self.start_time = time.time()
+
+    def set_attributes(self, **attributes):
+        self.attributes.update(attributes)
+
+    def get_trace_event(self, end_time):
+        # a complete event of the Chrome trace event format, times in microseconds
+        return {
+            "name": self.name,
+            "cat": self.category,
+            "ph": "X",
+            "ts": round(self.start_time * 1e6),
+            "dur": round((end_time - self.start_time) * 1e6),
+            "pid": os.getpid(),
+            "tid": threading.get_native_id(),
+            "args": {"span_id": self.span_id, "parent_span_id": self.parent_span_id, **self.attributes}
+        }
+
+
+class StageTracer:
+    def __init__(self, events_directory):
+        self.events_directory = Path(events_directory)
+        self.events_directory.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+
+    def record(self, trace_event):
+        line = json.dumps(trace_event, ensure_ascii=False, default=str)
+        # one file per process, opened per event: a killed worker loses at most the span it was in
+        with self.lock:
+            with open(self.events_directory / f"{os.getpid()}.jsonl", 'a', encoding='utf-8') as file:
+                file.write(line + "\n")
+
+    def read_trace_events(self):
+        array_trace_events = []
+        for events_path in sorted(self.events_directory.glob("*.jsonl")):
+            for line in events_path.read_text(encoding='utf-8').splitlines():
+                try:
+                    array_trace_events.append(json.loads(line))
+                except json.JSONDecodeError:
+                    logger.warning(f"truncated trace event skipped in {events_path}")
+        return sorted(array_trace_events, key=lambda trace_event: trace_event["ts"])
+
+    def export(self, trace_path):
+        array_trace_events = self.read_trace_events()
+        array_metadata_events = [
+            {
+                "name": "process_name",
+                "ph": "M",
+                "pid": pid,
+                "args": {"name": "engine" if pid == os.getpid() else f"page worker {pid}"}
+            }
+            for pid in sorted({trace_event["pid"] for trace_event in array_trace_events})
+        ]
+        utils.write_text_file_atomically(
+            trace_path,
+            json.dumps({"traceEvents": array_metadata_events + array_trace_events, "displayTimeUnit": "ms"})
+        )
+        shutil.rmtree(self.events_directory, ignore_errors=True)
+        return len(array_trace_events)
+
+
+def create_span(name, category, attributes):
+    parent_span = active_span.get()
+    return Span(
+        name,
+        category,
+        parent_span.span_id if parent_span is not None else remote_parent_span_id.get(),
+        attributes
+    )
+
+
+@contextmanager
+def trace_span(name, category="stage", **attributes):
+    span = create_span(name, category, attributes)
+    tracer = active_tracer.get()
+    if tracer is None:
+        # not tracing: the span only collects the attributes set on it
+        yield span
+        return
+
+    span_token = active_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.set_attributes(error=f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        active_span.reset(span_token)
+        tracer.record(span.get_trace_event(time.time()))
+
+
+@contextmanager
+def trace_detached_span(name, category="stage", **attributes):
+    # never made the active span: it can stay open across the yields of a generator
+    span = create_span(name, category, attributes)
+    tracer = active_tracer.get()
+    try:
+        yield span
+    except GeneratorExit:
+        raise
+    except BaseException as e:
+        span.set_attributes(error=f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        if tracer is not None:
+            tracer.record(span.get_trace_event(time.time()))
+
+
+def set_span_attributes(**attributes):
+    span = active_span.get()
+    if span is not None:
+        span.set_attributes(**attributes)
+
+
+def get_trace_context():
+    # what a page worker needs to trace under the current span: it shares no context variables with the run
+    tracer = active_tracer.get()
+    if tracer is None:
+        return None
+    span = active_span.get()
+    return {
+        "events_directory": str(tracer.events_directory),
+        "parent_span_id": span.span_id if span is not None else None
+    }
+
+
+def run_traced(trace_context, span_name, attributes, function, *args):
+    if trace_context is None or active_tracer.get() is not None:
+        with trace_span(span_name, **attributes):
+            return function(*args)
+
+    tracer_token = active_tracer.set(StageTracer(trace_context["events_directory"]))
+    parent_token = remote_parent_span_id.set(trace_context["parent_span_id"])
+    try:
+        with trace_span(span_name, **attributes):
+            return function(*args)
+    finally:
+        remote_parent_span_id.reset(parent_token)
+        active_tracer.reset(tracer_token)
+
+
+@contextmanager
+def start_trace(run_directory, span_name, **attributes):
+    if run_directory is None:
+        with trace_span(span_name, "run", **attributes) as span:
+            yield span
+        return
+
+    events_directory = Path(run_directory) / trace_events_folder_name
+    # the events of an earlier run of the same pages are not part of this trace
+    shutil.rmtree(events_directory, ignore_errors=True)
+    tracer = StageTracer(events_directory)
+    tracer_token = active_tracer.set(tracer)
+    try:
+        with trace_span(span_name, "run", **attributes) as span:
+            yield span
+    finally:
+        active_tracer.reset(tracer_token)
+        trace_path = Path(run_directory) / trace_file_name
+        number_trace_events = tracer.export(trace_path)
+        logger.info(f"trace of {number_trace_events} spans written to {trace_path}")
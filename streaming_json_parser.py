@@ -0,0 +1,76 @@
+import json
+
+from ai_output_validator import load_json_repaired
+
+
+class JsonArrayStreamParser:
+    def __init__(self):
+        self.buffer = ""
+        self.position = 0
+        self.depth = 0
+        self.is_in_string = False
+        self.is_escaped = False
+        self.object_start = None
+        self.is_array_open = False
+        self.is_complete = False
+        self.array_unparsable_objects = []
+
+    def feed(self, text):
+        self.buffer += text
+        array_objects = []
+
+        while self.position < len(self.buffer) and not self.is_complete:
+            character = self.buffer[self.position]
+
+            if self.is_in_string:
+                if self.is_escaped:
+                    self.is_escaped = False
+                elif character == "\\":
+                    self.is_escaped = True
+                elif character == '"':
+                    self.is_in_string = False
+
+            elif not self.is_array_open:
+                # everything before the array (code fences, prose) is skipped
+                if character == "[":
+                    self.is_array_open = True
+                    self.depth = 1
+
+            elif character == '"':
+                self.is_in_string = True
+
+            elif character in "{[":
+                if self.depth == 1 and character == "{":
+                    self.object_start = self.position
+                self.depth = self.depth + 1
+
+            elif character in "}]":
+                self.depth = self.depth - 1
+                if self.depth == 1 and character == "}" and self.object_start is not None:
+                    object_text = self.buffer[self.object_start:self.position + 1]
+                    try:
+                        array_objects.append(load_json_repaired(object_text))
+                    except json.JSONDecodeError:
+                        # one broken object must not cost the rest of the answer
+                        self.array_unparsable_objects.append(object_text)
+                    self.object_start = None
+                elif self.depth == 0:
+                    self.is_complete = True
+
+            self.position = self.position + 1
+
+        # drop what has been consumed so long answers do not grow the buffer without bound
+        consumed_position = self.object_start if self.object_start is not None else self.position
+        self.buffer = self.buffer[consumed_position:]
+        self.position = self.position - consumed_position
+        if self.object_start is not None:
+            self.object_start = 0
+
+        return array_objects
+
+    def iterate(self, iterator_text_chunks):
+        for text_chunk in iterator_text_chunks:
+            for json_object in self.feed(text_chunk):
+                yield json_object
+            if self.is_complete:
+                return
@@ -0,0 +1,541 @@
+import argparse
+import io
+import json
+import logging
+import math
+import os
+import random
+
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+import utils
+
+logger = logging.getLogger(__name__)
+
+# the three table layouts of prompt_json_table.md: the ground truth uses the same keys the AI model is asked for
+dict_column_sets = {
+    "format_length": {
+        "columns": ["Tag", "Field Name", "Format", "Len", "Possible Values", "M/C",
+                    "Short Description, Compatibility Notes, Value & Conditions", "Value Example"],
+        "column_widths": [0.07, 0.17, 0.12, 0.05, 0.17, 0.05, 0.27, 0.10]
+    },
+    "description_values": {
+        "columns": ["Tag", "Field Name", "Req Description", "Value Meaning"],
+        "column_widths": [0.08, 0.24, 0.40, 0.28]
+    },
+    "required_format": {
+        "columns": ["FIX tag", "Field Name", "Required", "Field Format", "Field Description"],
+        "column_widths": [0.09, 0.27, 0.09, 0.15, 0.40]
+    }
+}
+array_field_name_words = [
+    "Order", "Quote", "Trade", "Security", "Party", "Market", "Entry", "Price", "Qty", "Side", "Time", "Status",
+    "Session", "Account", "Clearing", "Trigger", "Leg", "Instrument", "Exec", "Settl", "Limit", "Stop", "Book",
+    "Member", "Gateway", "Seq", "Request", "Report", "Trading", "Event", "Position", "Strategy", "Expire", "Owner"
+]
+array_field_name_suffixes = ["ID", "Type", "Time", "Num", "Qty", "Px", "Status", "Code", "Source", "Flag"]
+array_description_subjects = [
+    "the order", "the quote", "the trade", "the instrument", "the member", "the session", "the gateway",
+    "the matching engine", "the clearing member", "the inbound message", "the outbound message"
+]
+array_description_verbs = [
+    "Identifies", "Indicates the state of", "Timestamp set by", "Reference assigned to", "Quantity of",
+    "Price of", "Type of", "Number of entries related to", "Sequence number of"
+]
+array_description_notes = [
+    "Always set by the Exchange.", "Only present for derivatives.", "Mutually exclusive with the previous field.",
+    "Not checked by the Exchange.", "Populated with the same value as in the request.", ""
+]
+array_enum_meanings = [
+    "New", "Update", "Delete", "Buy", "Sell", "Limit", "Market", "Stop", "Day", "Good Till Cancel", "Fill",
+    "Partial Fill", "Canceled", "Rejected", "Trading Halt", "Ready to Trade", "Not available for trading"
+]
+# format, length, kind of the possible values: the mix of the sample documents, not a uniform one
+array_field_formats = [
+    ("UTCTimestamp", 27, "timestamp"), ("String", 20, "range"), ("String", 10, "range"), ("Int", 4, "range"),
+    ("Int", 2, "enum"), ("Char", 1, "enum"), ("Price", 20, "range"), ("Qty", 20, "range"), ("Length", 4, "range"),
+    ("SeqNum", 10, "range"), ("MultipleCharValue", 40, "enum"), ("LocalMktDate", 8, "date")
+]
+max_field_id = 99999
+page_width_inches = 8.27
+page_height_inches = 11.69
+# smaller print is not read back reliably by the OCR
+minimum_font_size = 6
+
+
+def get_field_names(rng, number_fields):
+    array_field_names = []
+    set_field_names = set()
+    while len(array_field_names) < number_fields:
+        field_name = "".join(rng.sample(array_field_name_words, rng.randint(1, 2))) \
+            + rng.choice(array_field_name_suffixes)
+        # past a few thousand fields the word pairs run out: a counter keeps the names unique
+        if field_name in set_field_names:
+            field_name = f"{field_name}{len(array_field_names)}"
+        set_field_names.add(field_name)
+        array_field_names.append(field_name)
+    return array_field_names
+
+
+def generate_field(rng, field_id, field_name):
+    field_format, length, values_kind = rng.choice(array_field_formats)
+    dict_enum_values = {}
+    if values_kind == "timestamp":
+        possible_values = "Timestamp"
+        value_example = f"2019{rng.randint(1, 12):02d}{rng.randint(1, 28):02d}-15:{rng.randint(0, 59):02d}:" \
+                        f"{rng.randint(0, 59):02d}.{rng.randint(0, 999999999):09d}"
+    elif values_kind == "date":
+        possible_values = "YYYYMMDD"
+        value_example = f"2019{rng.randint(1, 12):02d}{rng.randint(1, 28):02d}"
+    elif values_kind == "enum":
+        array_enum_keys = [str(index) for index in range(10)] if field_format != "Char" \
+            else [chr(ord("0") + index) for index in range(10)] + [chr(ord("A") + index) for index in range(6)]
+        array_enum_meanings_field = rng.sample(array_enum_meanings, rng.randint(2, 5))
+        dict_enum_values = dict(zip(rng.sample(array_enum_keys, len(array_enum_meanings_field)),
+                                    array_enum_meanings_field))
+        possible_values = "\n".join(f"{key} = {meaning}" for key, meaning in dict_enum_values.items())
+        value_example = next(iter(dict_enum_values))
+    else:
+        max_exponent = min(length * 3, 64)
+        possible_values = rng.choice([f"From 0 to 2^{max_exponent}-2", f"From -2^{max_exponent - 1} to "
+                                                                        f"2^{max_exponent - 1}-1"])
+        value_example = str(rng.randint(1, 10 ** min(length, 9)))
+
+    description = f"{rng.choice(array_description_verbs)} {rng.choice(array_description_subjects)}. " \
+                  f"{rng.choice(array_description_notes)}".strip()
+    return {
+        "field_id": field_id,
+        "field_name": field_name,
+        "format": field_format,
+        "length": length,
+        "is_mandatory": rng.random() < 0.6,
+        "possible_values": possible_values,
+        "enum_values": dict_enum_values,
+        "description": description,
+        "value_example": value_example
+    }
+
+
+def get_document_field(field, column_set_name):
+    if column_set_name == "format_length":
+        return {
+            "Tag": field["field_id"],
+            "Field Name": field["field_name"],
+            "Format": field["format"],
+            "Len": field["length"],
+            "Possible Values": field["possible_values"],
+            "M/C": "M" if field["is_mandatory"] else "C",
+            "Short Description, Compatibility Notes, Value & Conditions": field["description"],
+            "Value Example": field["value_example"]
+        }
+    if column_set_name == "description_values":
+        document_field = {
+            "Tag": field["field_id"],
+            "Field Name": field["field_name"],
+            "Req Description": field["description"]
+        }
+        if field["enum_values"]:
+            document_field["Value Meaning"] = field["enum_values"]
+        return document_field
+    return {
+        "FIX tag": field["field_id"],
+        "Field Name": field["field_name"],
+        "Required": "Y" if field["is_mandatory"] else "N",
+        "Field Format": f"{field['format']}({field['length']})",
+        "Field Description": f"{field['description']} {field['possible_values']}".strip()
+    }
+
+
+def get_cell_text(document_field, column):
+    value = document_field.get(column, "")
+    if isinstance(value, dict):
+        return "\n".join(f"{key} {meaning}" for key, meaning in value.items())
+    return str(value)
+
+
+def generate_messages(rng, number_pages, tables_per_page, rows_per_table, continuation_ratio, column_set_names):
+    # every message fills whole table slots: a message longer than a slot continues in the next one,
+    # on the next page when the slot was the last of its page
+    number_slots = number_pages * tables_per_page
+    array_messages = []
+    number_used_slots = 0
+    while number_used_slots < number_slots:
+        if rng.random() < continuation_ratio:
+            number_rows = rng.randint(rows_per_table + 1, rows_per_table * 3)
+        else:
+            number_rows = rng.randint(max(rows_per_table // 2, 1), rows_per_table)
+        number_message_slots = min(math.ceil(number_rows / rows_per_table), number_slots - number_used_slots)
+        array_messages.append({
+            "message_name": f"SyntheticMessage{len(array_messages) + 1}",
+            "template_id": len(array_messages) + 1,
+            "column_set": rng.choice(column_set_names),
+            "number_rows": min(number_rows, number_message_slots * rows_per_table),
+            "first_slot": number_used_slots
+        })
+        number_used_slots = number_used_slots + number_message_slots
+
+    number_fields = sum(message["number_rows"] for message in array_messages)
+    # a tag is unique across the corpus while the 5 digits the OCR row pattern allows last
+    array_field_ids = rng.sample(range(1, max_field_id + 1), min(number_fields, max_field_id))
+    array_field_names = get_field_names(rng, number_fields)
+    field_index = 0
+    for message in array_messages:
+        message["fields"] = []
+        for _ in range(message["number_rows"]):
+            message["fields"].append(generate_field(
+                rng,
+                array_field_ids[field_index % len(array_field_ids)],
+                array_field_names[field_index]
+            ))
+            field_index = field_index + 1
+    return array_messages
+
+
+def get_page_tables(array_messages, number_pages, tables_per_page, rows_per_table):
+    array_page_tables = [[] for _ in range(number_pages)]
+    for message in array_messages:
+        for row_index in range(0, message["number_rows"], rows_per_table):
+            slot = message["first_slot"] + row_index // rows_per_table
+            array_page_tables[slot // tables_per_page].append({
+                "message": message,
+                "fields": message["fields"][row_index:row_index + rows_per_table],
+                "is_continued": row_index > 0
+            })
+    return array_page_tables
+
+
+def load_font(font_size):
+    try:
+        return ImageFont.truetype("DejaVuSans.ttf", font_size)
+    except OSError:
+        try:
+            return ImageFont.load_default(size=font_size)
+        except TypeError:
+            return ImageFont.load_default()
+
+
+def wrap_cell_text(draw, text, font, cell_width):
+    array_lines = []
+    for paragraph in text.split("\n"):
+        line = ""
+        for word in paragraph.split():
+            # a word wider than its cell is cut, as the venues print "UTCTimestam" over "p"
+            while draw.textlength(word, font=font) > cell_width and len(word) > 1:
+                cut_index = len(word) - 1
+                while cut_index > 1 and draw.textlength(word[:cut_index], font=font) > cell_width:
+                    cut_index = cut_index - 1
+                if line:
+                    array_lines.append(line)
+                    line = ""
+                array_lines.append(word[:cut_index])
+                word = word[cut_index:]
+            candidate_line = f"{line} {word}".strip()
+            if line and draw.textlength(candidate_line, font=font) > cell_width:
+                array_lines.append(line)
+                line = word
+            else:
+                line = candidate_line
+        array_lines.append(line)
+    return array_lines
+
+
+def get_table_layout(draw, table, font, line_height, table_width, padding):
+    column_set = dict_column_sets[table["message"]["column_set"]]
+    array_cell_widths = [table_width * column_width - 2 * padding for column_width in column_set["column_widths"]]
+    array_rows = [column_set["columns"]] + [
+        [get_cell_text(get_document_field(field, table["message"]["column_set"]), column)
+         for column in column_set["columns"]]
+        for field in table["fields"]
+    ]
+    array_row_lines = [
+        [wrap_cell_text(draw, cell_text, font, cell_width) for cell_text, cell_width in zip(row, array_cell_widths)]
+        for row in array_rows
+    ]
+    array_row_heights = [max(len(lines) for lines in row_lines) * line_height + 2 * padding
+                         for row_lines in array_row_lines]
+    return array_row_lines, array_row_heights
+
+
+def draw_table(draw, table, array_row_lines, array_row_heights, font, line_height, left, top, table_width,
+               padding):
+    title = table["message"]["message_name"] + (" (continued)" if table["is_continued"] else "")
+    draw.text((left, top), title, fill=0, font=font)
+    top = top + 2 * line_height
+    table_height = sum(array_row_heights)
+    array_column_edges = [left]
+    for column_width in dict_column_sets[table["message"]["column_set"]]["column_widths"]:
+        array_column_edges.append(array_column_edges[-1] + table_width * column_width)
+
+    # the rulings of the table are what the layout model and the page scout look for
+    for column_edge in array_column_edges:
+        draw.line([(column_edge, top), (column_edge, top + table_height)], fill=0, width=2)
+    row_top = top
+    for row_index, (row_lines, row_height) in enumerate(zip(array_row_lines, array_row_heights)):
+        draw.line([(left, row_top), (left + table_width, row_top)], fill=0, width=3 if row_index <= 1 else 1)
+        for column_edge, cell_lines in zip(array_column_edges, row_lines):
+            for line_index, line in enumerate(cell_lines):
+                draw.text((column_edge + padding, row_top + padding + line_index * line_height), line, fill=0,
+                          font=font)
+        row_top = row_top + row_height
+    draw.line([(left, row_top), (left + table_width, row_top)], fill=0, width=2)
+    return [round(left), round(top), round(left + table_width), round(row_top)]
+
+
+def render_page(array_tables, page_number, dpi):
+    page_width = round(page_width_inches * dpi)
+    page_height = round(page_height_inches * dpi)
+    margin = round(0.6 * dpi)
+    table_width = page_width - 2 * margin
+    image = Image.new("L", (page_width, page_height), 255)
+    draw = ImageDraw.Draw(image)
+
+    # the font shrinks until every table of the page fits: a ground truth row must never fall off the page
+    font_size = round(dpi / 10)
+    while True:
+        font = load_font(font_size)
+        line_height = round(font_size * 1.25)
+        padding = max(round(font_size / 3), 2)
+        array_layouts = [get_table_layout(draw, table, font, line_height, table_width, padding)
+                         for table in array_tables]
+        content_height = sum(sum(row_heights) + 3 * line_height for _, row_heights in array_layouts)
+        if content_height <= page_height - 2 * margin - 2 * line_height:
+            break
+        if font_size <= minimum_font_size:
+            raise ValueError(
+                f"the {sum(len(table['fields']) for table in array_tables)} rows of page {page_number} do not fit "
+                f"at font size {minimum_font_size} and {dpi} dpi: lower the tables per page or the rows per table"
+            )
+        font_size = font_size - 1
+
+    array_bounding_boxes = []
+    top = margin
+    for table, (array_row_lines, array_row_heights) in zip(array_tables, array_layouts):
+        bounding_box = draw_table(draw, table, array_row_lines, array_row_heights, font, line_height, margin, top,
+                                  table_width, padding)
+        array_bounding_boxes.append(bounding_box)
+        top = bounding_box[3] + line_height
+    draw.text((page_width / 2, page_height - margin / 2), str(page_number), fill=0, font=font, anchor="mm")
+    return image, array_bounding_boxes
+
+
+def add_noise(image, rng, noise):
+    if noise <= 0:
+        return image
+    # scanner artifacts: a skewed page, a little blur and dust
+    image = image.rotate(rng.uniform(-1.5, 1.5) * noise, resample=Image.BICUBIC, fillcolor=255)
+    image = image.filter(ImageFilter.GaussianBlur(radius=noise))
+    draw = ImageDraw.Draw(image)
+    for _ in range(round(noise * image.width * image.height / 4000)):
+        x = rng.randrange(image.width)
+        y = rng.randrange(image.height)
+        draw.point((x, y), fill=rng.randint(0, 160))
+    return image
+
+
+class JpegPdfWriter:
+    # every page is one JPEG image: the objects are streamed to the file and only their offsets are kept,
+    # where Pillow would hold every page or rewrite the whole page tree at each appended page
+    def __init__(self, pdf_path, dpi):
+        self.file = open(pdf_path, 'wb')
+        self.dpi = dpi
+        # 1 is the catalog and 2 the page tree, both written last
+        self.dict_object_offsets = {}
+        self.next_object_number = 3
+        self.array_page_object_numbers = []
+        self.file.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def write_object(self, object_number, body):
+        self.dict_object_offsets[object_number] = self.file.tell()
+        self.file.write(f"{object_number} 0 obj\n".encode('ascii') + body + b"\nendobj\n")
+
+    def reserve_object_numbers(self, number_objects):
+        object_number = self.next_object_number
+        self.next_object_number = self.next_object_number + number_objects
+        return range(object_number, object_number + number_objects)
+
+    def add_page(self, jpeg_bytes, image_width, image_height):
+        image_object_number, contents_object_number, page_object_number = self.reserve_object_numbers(3)
+        page_width = round(image_width * 72 / self.dpi, 2)
+        page_height = round(image_height * 72 / self.dpi, 2)
+        self.write_object(image_object_number, (
+            f"<< /Type /XObject /Subtype /Image /Width {image_width} /Height {image_height} "
+            f"/ColorSpace /DeviceGray /BitsPerComponent 8 /Filter /DCTDecode /Length {len(jpeg_bytes)} >>\nstream\n"
+        ).encode('ascii') + jpeg_bytes + b"\nendstream")
+        contents = f"q {page_width} 0 0 {page_height} 0 0 cm /Page Do Q".encode('ascii')
+        self.write_object(contents_object_number,
+                          f"<< /Length {len(contents)} >>\nstream\n".encode('ascii') + contents + b"\nendstream")
+        self.write_object(page_object_number, (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {page_width} {page_height}] "
+            f"/Resources << /XObject << /Page {image_object_number} 0 R >> >> /Contents {contents_object_number} 0 R >>"
+        ).encode('ascii'))
+        self.array_page_object_numbers.append(page_object_number)
+
+    def close(self):
+        self.write_object(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+        kids = " ".join(f"{page_object_number} 0 R" for page_object_number in self.array_page_object_numbers)
+        self.write_object(2, f"<< /Type /Pages /Kids [{kids}] /Count {len(self.array_page_object_numbers)} >>"
+                          .encode('ascii'))
+        xref_offset = self.file.tell()
+        array_xref_lines = [f"xref\n0 {self.next_object_number}\n", "0000000000 65535 f \n"]
+        array_xref_lines.extend(f"{self.dict_object_offsets[object_number]:010d} 00000 n \n"
+                                for object_number in range(1, self.next_object_number))
+        array_xref_lines.append(f"trailer\n<< /Size {self.next_object_number} /Root 1 0 R >>\n"
+                                f"startxref\n{xref_offset}\n%%EOF\n")
+        self.file.write("".join(array_xref_lines).encode('ascii'))
+        self.file.close()
+
+
+def get_page_ranges(array_page_numbers):
+    array_page_ranges = []
+    for page_number in sorted(set(array_page_numbers)):
+        if array_page_ranges and array_page_ranges[-1][1] == page_number - 1:
+            array_page_ranges[-1][1] = page_number
+        else:
+            array_page_ranges.append([page_number, page_number])
+    return [f"{starting_page}-{ending_page}" for starting_page, ending_page in array_page_ranges]
+
+
+def generate_corpus(output_directory, corpus_name="synthetic", number_pages=10, tables_per_page=1, rows_per_table=12,
+                    continuation_ratio=0.3, column_set_names=None, noise=0.0, dpi=200, output_format="pdf", seed=0):
+    if number_pages < 1 or tables_per_page < 1 or rows_per_table < 1:
+        raise ValueError("pages, tables per page and rows per table must be at least 1")
+    column_set_names = column_set_names or list(dict_column_sets)
+    for column_set_name in column_set_names:
+        if column_set_name not in dict_column_sets:
+            raise ValueError(f"unknown column set '{column_set_name}', choose among {list(dict_column_sets)}")
+
+    rng = random.Random(seed)
+    utils.create_directory_if_not_exists(output_directory)
+    pdf_path = os.path.join(output_directory, f"{corpus_name}.pdf")
+    images_directory = os.path.join(output_directory, f"{corpus_name}_pages")
+    if output_format in ("images", "both"):
+        utils.create_directory_if_not_exists(images_directory)
+
+    array_messages = generate_messages(rng, number_pages, tables_per_page, rows_per_table, continuation_ratio,
+                                       column_set_names)
+    array_page_tables = get_page_tables(array_messages, number_pages, tables_per_page, rows_per_table)
+    dict_message_pages = {message["message_name"]: [] for message in array_messages}
+    array_pages = []
+    pdf_writer = JpegPdfWriter(pdf_path, dpi) if output_format in ("pdf", "both") else None
+
+    for page_index, array_tables in enumerate(array_page_tables):
+        page_number = page_index + 1
+        image, array_bounding_boxes = render_page(array_tables, page_number, dpi)
+        image = add_noise(image, rng, noise)
+        # one page at a time: a thousand page corpus is never held in memory
+        jpeg_buffer = io.BytesIO()
+        image.save(jpeg_buffer, "JPEG", quality=round(95 - 40 * min(noise, 1.0)))
+        if pdf_writer is not None:
+            pdf_writer.add_page(jpeg_buffer.getvalue(), image.width, image.height)
+        if output_format in ("images", "both"):
+            with open(os.path.join(images_directory, f"page_{page_number}.jpg"), 'wb') as file:
+                file.write(jpeg_buffer.getvalue())
+
+        array_pages.append({
+            "page_number": page_number,
+            "tables": [
+                {
+                    "message_name": table["message"]["message_name"],
+                    "column_set": table["message"]["column_set"],
+                    "is_continued": table["is_continued"],
+                    "bounding_box": bounding_box,
+                    "field_ids": [field["field_id"] for field in table["fields"]]
+                }
+                for table, bounding_box in zip(array_tables, array_bounding_boxes)
+            ]
+        })
+        for table in array_tables:
+            dict_message_pages[table["message"]["message_name"]].append(page_number)
+        if page_number % 50 == 0:
+            logger.info(f"{page_number} of {number_pages} pages generated")
+    if pdf_writer is not None:
+        pdf_writer.close()
+
+    ground_truth = {
+        "corpus": {
+            "pdf_path": pdf_path if output_format in ("pdf", "both") else None,
+            "images_directory": images_directory if output_format in ("images", "both") else None,
+            "pages": number_pages,
+            "tables_per_page": tables_per_page,
+            "rows_per_table": rows_per_table,
+            "continuation_ratio": continuation_ratio,
+            "column_sets": column_set_names,
+            "noise": noise,
+            "dpi": dpi,
+            "seed": seed,
+            "fields": sum(message["number_rows"] for message in array_messages)
+        },
+        "messages": [
+            {
+                "message_name": message["message_name"],
+                "template_id": message["template_id"],
+                "column_set": message["column_set"],
+                "page_ranges": get_page_ranges(dict_message_pages[message["message_name"]]),
+                "document_fields": [get_document_field(field, message["column_set"]) for field in message["fields"]]
+            }
+            for message in array_messages
+        ],
+        "pages": array_pages
+    }
+    ground_truth_path = os.path.join(output_directory, f"{corpus_name}_ground_truth.json")
+    utils.write_text_file_atomically(ground_truth_path, json.dumps(ground_truth, indent=4, ensure_ascii=False))
+
+    # the same messages as a batch manifest: batch_module runs the whole corpus with --manifest
+    manifest_path = os.path.join(output_directory, f"{corpus_name}_manifest.json")
+    if output_format in ("pdf", "both"):
+        utils.write_text_file_atomically(manifest_path, json.dumps({
+            "messages": [
+                {
+                    "pdf_path": pdf_path,
+                    "page_ranges": message["page_ranges"],
+                    "message_name": message["message_name"],
+                    "template_id": message["template_id"]
+                }
+                for message in ground_truth["messages"]
+            ]
+        }, indent=4))
+
+    return ground_truth
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate synthetic FIX/SBE field table pages with their ground truth for scale tests."
+    )
+    parser.add_argument("--output-directory", default="synthetic_corpus")
+    parser.add_argument("--name", default="synthetic", help="prefix of the generated files")
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--tables-per-page", type=int, default=1)
+    parser.add_argument("--rows-per-table", type=int, default=12)
+    parser.add_argument("--continuation-ratio", type=float, default=0.3,
+                        help="share of the messages whose table continues over more than one table slot")
+    parser.add_argument("--column-sets", nargs="+", choices=list(dict_column_sets), default=list(dict_column_sets))
+    parser.add_argument("--noise", type=float, default=0.0, help="0 for clean pages, 1 for a poor scan")
+    parser.add_argument("--dpi", type=int, default=200)
+    parser.add_argument("--format", choices=["pdf", "images", "both"], default="pdf")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    ground_truth = generate_corpus(
+        args.output_directory,
+        corpus_name=args.name,
+        number_pages=args.pages,
+        tables_per_page=args.tables_per_page,
+        rows_per_table=args.rows_per_table,
+        continuation_ratio=args.continuation_ratio,
+        column_set_names=args.column_sets,
+        noise=args.noise,
+        dpi=args.dpi,
+        output_format=args.format,
+        seed=args.seed
+    )
+    corpus = ground_truth["corpus"]
+    print(f"{corpus['pages']} pages, {len(ground_truth['messages'])} messages, {corpus['fields']} fields "
+          f"written to {args.output_directory}")
+    if corpus["pdf_path"]:
+        print(f"benchmark page set: {corpus['pdf_path']}:1-{corpus['pages']}")
+
+
+if __name__ == "__main__":
+    main()
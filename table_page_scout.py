@@ -0,0 +1,176 @@
+import argparse
+import logging
+import subprocess
+
+import cv2
+import numpy as np
+from pdf2image import convert_from_path, pdfinfo_from_path
+
+import ocr_text_chunker
+
+logger = logging.getLogger(__name__)
+
+scout_methods = ["text", "rulings"]
+thumbnail_dpi = 36
+min_table_rows = 3
+min_horizontal_rulings = 6
+min_vertical_rulings = 2
+# a ruling spans a good part of the page, underlines and table cell borders of a single word do not
+horizontal_ruling_ratio = 0.3
+vertical_ruling_ratio = 0.1
+
+
+def read_pdf_text_pages(pdf_path):
+    # the text layer costs milliseconds per page, rasterizing and OCR seconds
+    try:
+        completed_process = subprocess.run(
+            ["pdftotext", "-layout", pdf_path, "-"],
+            capture_output=True,
+            check=True,
+            encoding='utf-8',
+            errors='replace'
+        )
+    except (OSError, subprocess.CalledProcessError) as e:
+        logger.warning(f"cannot read the text layer of {pdf_path}, the pages are scouted on their rulings: {e}")
+        return None
+
+    # pdftotext ends every page with a form feed
+    return completed_process.stdout.split("\f")[:-1]
+
+
+def get_page_text_scores(page_text):
+    array_lines = [line for line in page_text.splitlines() if line.strip()]
+    return {
+        "words": len(page_text.split()),
+        "header_lines": sum(ocr_text_chunker.is_table_header(line) for line in array_lines),
+        "table_rows": sum(bool(ocr_text_chunker.row_start_pattern.match(line)) for line in array_lines)
+    }
+
+
+def count_rulings(image_inverted, kernel_size, axis):
+    # the runs of dark pixels longer than the kernel survive the opening, text does not
+    image_rulings = cv2.morphologyEx(
+        image_inverted,
+        cv2.MORPH_OPEN,
+        cv2.getStructuringElement(cv2.MORPH_RECT, kernel_size)
+    )
+    array_positions = np.flatnonzero(np.count_nonzero(image_rulings, axis=axis))
+
+    number_rulings = 0
+    previous_position = None
+    for position in array_positions:
+        if previous_position is None or position - previous_position > 1:
+            number_rulings = number_rulings + 1
+        previous_position = position
+    return number_rulings
+
+
+def get_thumbnail_ruling_counts(image):
+    image_gray = np.array(image.convert("L"))
+    height, width = image_gray.shape[:2]
+    _, image_inverted = cv2.threshold(image_gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+
+    return {
+        "horizontal_rulings": count_rulings(image_inverted, (max(int(width * horizontal_ruling_ratio), 1), 1), 1),
+        "vertical_rulings": count_rulings(image_inverted, (1, max(int(height * vertical_ruling_ratio), 1)), 0)
+    }
+
+
+def render_pdf_thumbnails(pdf_path, array_page_numbers, dpi=thumbnail_dpi):
+    # one conversion per run of consecutive pages instead of one poppler call per page
+    dict_thumbnails = {}
+    for starting_page, ending_page in group_page_ranges(array_page_numbers):
+        array_images = convert_from_path(
+            pdf_path,
+            dpi=dpi,
+            first_page=starting_page,
+            last_page=ending_page,
+            grayscale=True
+        )
+        dict_thumbnails.update(zip(range(starting_page, ending_page + 1), array_images))
+    return dict_thumbnails
+
+
+def scout_table_pages(pdf_path, methods=None):
+    methods = scout_methods if methods is None else methods
+    number_pages = pdfinfo_from_path(pdf_path)["Pages"]
+    array_page_texts = read_pdf_text_pages(pdf_path) if "text" in methods else None
+
+    array_pages = []
+    for page_number in range(1, number_pages + 1):
+        page = {"page_number": page_number, "is_table_page": False, "reason": None}
+        if array_page_texts is not None and page_number <= len(array_page_texts):
+            page.update(get_page_text_scores(array_page_texts[page_number - 1]))
+        array_pages.append(page)
+
+    # scanned pages have no text layer: only their rulings can tell a table apart
+    array_ruling_page_numbers = [
+        page["page_number"] for page in array_pages
+        if "rulings" in methods and not page.get("words")
+    ]
+    for page_number, image in render_pdf_thumbnails(pdf_path, array_ruling_page_numbers).items():
+        array_pages[page_number - 1].update(get_thumbnail_ruling_counts(image))
+
+    previous_page = None
+    for page in array_pages:
+        if page.get("header_lines", 0) >= 1 and page.get("table_rows", 0) >= min_table_rows:
+            page["is_table_page"], page["reason"] = True, "header"
+        # the header of a table is often printed on its first page only
+        elif page.get("table_rows", 0) >= min_table_rows and previous_page is not None \
+                and previous_page["is_table_page"]:
+            page["is_table_page"], page["reason"] = True, "continuation"
+        elif page.get("horizontal_rulings", 0) >= min_horizontal_rulings \
+                and page.get("vertical_rulings", 0) >= min_vertical_rulings:
+            page["is_table_page"], page["reason"] = True, "rulings"
+        previous_page = page
+
+    return array_pages
+
+
+def group_page_ranges(array_page_numbers, max_page_gap=0):
+    array_page_ranges = []
+    for page_number in sorted(array_page_numbers):
+        if array_page_ranges and page_number - array_page_ranges[-1][1] <= max_page_gap + 1:
+            array_page_ranges[-1][1] = page_number
+        else:
+            array_page_ranges.append([page_number, page_number])
+    return [tuple(page_range) for page_range in array_page_ranges]
+
+
+def discover_table_page_ranges(pdf_path, methods=None, max_page_gap=0):
+    array_pages = scout_table_pages(pdf_path, methods)
+    array_page_ranges = group_page_ranges(
+        [page["page_number"] for page in array_pages if page["is_table_page"]],
+        max_page_gap
+    )
+    logger.info(
+        f"{sum(page['is_table_page'] for page in array_pages)}/{len(array_pages)} pages of {pdf_path} hold field "
+        f"tables: {', '.join(f'{starting_page}-{ending_page}' for starting_page, ending_page in array_page_ranges)}"
+    )
+    return array_page_ranges
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find the pages of a PDF holding field tables.")
+    parser.add_argument("pdf")
+    parser.add_argument("--methods", nargs="+", choices=scout_methods, default=scout_methods)
+    parser.add_argument("--max-page-gap", type=int, default=0,
+                        help="pages without a table allowed inside one page range")
+    arguments = parser.parse_args()
+
+    array_pages = scout_table_pages(arguments.pdf, arguments.methods)
+    for page in array_pages:
+        if page["is_table_page"]:
+            print(f"page {page['page_number']:>4}: {page['reason']}")
+    array_page_ranges = group_page_ranges(
+        [page["page_number"] for page in array_pages if page["is_table_page"]],
+        arguments.max_page_gap
+    )
+    print("page ranges: " + " ".join(
+        f"{starting_page}-{ending_page}" for starting_page, ending_page in array_page_ranges
+    ))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,79 @@
+import ocr_text_chunker
+
+geometry_tolerance = 0.02
+# a table continues on the next page only if it runs into the bottom of its page and the next one starts at the top
+page_bottom_ratio = 0.6
+page_top_ratio = 0.4
+
+
+def has_same_column_geometry(geometry, next_geometry, tolerance=geometry_tolerance):
+    if abs(geometry["x_1"] - next_geometry["x_1"]) > tolerance or abs(geometry["x_2"] - next_geometry["x_2"]) > tolerance:
+        return False
+
+    column_positions = geometry["column_positions"]
+    next_column_positions = next_geometry["column_positions"]
+    if len(column_positions) != len(next_column_positions):
+        return False
+    return all(
+        abs(position - next_position) <= tolerance
+        for position, next_position in zip(column_positions, next_column_positions)
+    )
+
+
+def get_table_column_header(text_table):
+    header, _ = ocr_text_chunker.split_header_and_rows(text_table)
+    return header if ocr_text_chunker.is_table_header(header) else ""
+
+
+def split_leading_fragment(text_table):
+    # the cells of a row cut by the page break come before the first tagged row of the next page
+    lines = [line for line in text_table.splitlines() if line.strip()]
+    first_row_index = next(
+        (index for index, line in enumerate(lines) if ocr_text_chunker.row_start_pattern.match(line)),
+        len(lines)
+    )
+    return lines[:first_row_index], "\n".join(lines[first_row_index:])
+
+
+def is_continuation_table(ocr_output_page, ocr_output_next_page):
+    if not ocr_output_page["text_tables"] or not ocr_output_next_page["text_tables"]:
+        return False
+
+    geometry = ocr_output_page["table_geometries"][-1]
+    next_geometry = ocr_output_next_page["table_geometries"][0]
+    next_text_table = ocr_output_next_page["text_tables"][0]
+
+    return geometry["y_2"] >= page_bottom_ratio and next_geometry["y_1"] <= page_top_ratio \
+        and not get_table_column_header(next_text_table) \
+        and has_same_column_geometry(geometry, next_geometry)
+
+
+def stitch_page_text_tables(ocr_output_page, stitched_text_previous_page=None, ocr_output_next_page=None):
+    text_tables = list(ocr_output_page["text_tables"])
+    continues_previous_page = stitched_text_previous_page is not None \
+        and stitched_text_previous_page["continued_on_next_page"]
+    continued_on_next_page = ocr_output_next_page is not None \
+        and is_continuation_table(ocr_output_page, ocr_output_next_page)
+
+    column_header = ""
+    if continues_previous_page:
+        # the header of a table spanning several pages is only printed on its first page
+        _, text_tables[0] = split_leading_fragment(text_tables[0])
+        column_header = stitched_text_previous_page["last_column_header"]
+
+    last_column_header = get_table_column_header(text_tables[-1]) if text_tables else ""
+    if continues_previous_page and len(text_tables) == 1:
+        last_column_header = column_header
+
+    if continued_on_next_page:
+        array_fragment_lines, _ = split_leading_fragment(ocr_output_next_page["text_tables"][0])
+        if array_fragment_lines:
+            text_tables[-1] = "\n".join([text_tables[-1]] + array_fragment_lines)
+
+    return {
+        "text_tables": [text_table for text_table in text_tables if text_table.strip()],
+        "column_header": column_header,
+        "last_column_header": last_column_header,
+        "continues_previous_page": continues_previous_page,
+        "continued_on_next_page": continued_on_next_page
+    }
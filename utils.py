@@ -1,13 +1,97 @@
 import os
+import multiprocessing
+import tempfile
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
 
 ai_model_name = "gpt-4-0125-preview"
 openai_api_key = ""
+openai_api_base = ""
+ai_model_requests_per_minute = 500
+ai_model_tokens_per_minute = 150000
+ai_model_sbe_batch_size = 20
+use_recorded_ai_model_responses = True
+number_page_workers = max(multiprocessing.cpu_count() - 1, 1)
+stage_workers = {"rasterize": 1, "preprocess": 2, "detect_tables": 1, "ocr_tables": 2}
+stage_queue_size = 2
+runs_directory = "runs"
+# the local SBE typing caches shared by the runs, read on first use and written once at the end of each run
+fix_tag_knowledge_base_path = "fix_tag_knowledge_base.json"
+field_similarity_index_path = "field_similarity_index.json"
+trace_runs = True
+metrics_dump_path = os.path.join(runs_directory, "metrics.prom")
+metrics_export_interval = 5.0
 
 def create_directory_if_not_exists(directory_path):
     if not os.path.exists(directory_path):
         os.makedirs(directory_path)
 
 
+def write_text_file_atomically(file_path, text):
+    # written aside and renamed: concurrent runs and killed runs never leave a half written file behind
+    file_descriptor, temporary_file_path = tempfile.mkstemp(
+        prefix=f".{os.path.basename(file_path)}.",
+        suffix=".tmp",
+        dir=os.path.dirname(os.path.abspath(file_path))
+    )
+    try:
+        with os.fdopen(file_descriptor, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(temporary_file_path, file_path)
+    except BaseException:
+        os.remove(temporary_file_path)
+        raise
+
+
+def acquire_file_lock(lock_path, is_blocking=True):
+    # advisory lock shared by the processes of the machine: the open lock file, None if it is held elsewhere
+    lock_file = open(lock_path, "a+")
+    try:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | (0 if is_blocking else fcntl.LOCK_NB))
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK if is_blocking else msvcrt.LK_NBLCK, 1)
+    except OSError:
+        lock_file.close()
+        if is_blocking:
+            raise
+        return None
+    return lock_file
+
+
+def release_file_lock(lock_file):
+    if fcntl is not None:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+    else:
+        lock_file.seek(0)
+        msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+    lock_file.close()
+
+
+@contextmanager
+def file_lock(lock_path):
+    lock_file = acquire_file_lock(lock_path)
+    try:
+        yield
+    finally:
+        release_file_lock(lock_file)
+
+
+def get_resident_memory():
+    # bytes of the process in RAM right now, None where /proc is not available
+    try:
+        with open("/proc/self/statm", 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
 def save_uploaded_file(directory_path, file):
     create_directory_if_not_exists(directory_path)
     file_path = os.path.join(directory_path, file.name)
@@ -19,3 +103,32 @@ def save_uploaded_file(directory_path, file):
 def replace_newlines_with_space(input_string):
     return input_string.replace('\n', ' ')
 
+
+document_field_tag_keys = ["tag", "fix tag", "field id", "id", "offset"]
+document_field_name_keys = ["field name", "fieldname", "field", "name"]
+document_field_format_keys = ["format", "field format", "type", "data type"]
+document_field_length_keys = ["len", "length", "size"]
+document_field_values_keys = ["possible values", "values", "value meaning"]
+document_field_presence_keys = ["m/c", "req", "req'd", "req’d", "required", "presence"]
+document_field_description_keys = ["description", "req description", "field description", "short description"]
+
+
+def get_document_field_value(document_field, candidate_keys, default=None, match_key_prefix=False):
+    normalized_document_field = {str(key).strip().lower(): value for key, value in document_field.items()}
+    for candidate_key in candidate_keys:
+        if candidate_key in normalized_document_field:
+            return normalized_document_field[candidate_key]
+    if not match_key_prefix:
+        return default
+    for key, value in normalized_document_field.items():
+        if any(key.startswith(candidate_key) for candidate_key in candidate_keys):
+            return value
+    return default
+
+
+def get_document_field_id(document_field):
+    tag = get_document_field_value(document_field, document_field_tag_keys)
+    if tag is None:
+        return None
+    tag = str(tag).strip()
+    return str(int(tag)) if tag.isdigit() else tag
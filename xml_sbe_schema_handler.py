@@ -249,3 +249,63 @@ class XmlSbeSchemaHandler:
 
         self.append_to_sbe_schema_root(message_element)
         return etree.tostring(message_element, pretty_print=True, encoding='UTF-8').decode()
+
+
+def generate_sbe_data_type_definitions(json_handler, sbe_field):
+
+    if sbe_field["data_type"].lower() == "char":
+        json_handler.add_primitive_data_type("array_string_data_types", sbe_field)
+
+    elif sbe_field["data_type"].lower() in ["int8", "int16",
+                                            "int32", "int64",
+                                            "uint8",
+                                            "uint16",
+                                            "uint32",
+                                            "uint64"] and sbe_field["presence"] == "optional":
+        json_handler.add_primitive_data_type("array_number_data_types", sbe_field)
+
+    elif sbe_field["data_type"].lower().endswith("_enum"):
+        json_handler.add_custom_data_type("array_enum_data_types", sbe_field["encoding_type"],
+                                          sbe_field["data_type"],
+                                          sbe_field["structure"])
+
+    elif sbe_field["data_type"].lower().endswith("_set"):
+        json_handler.add_custom_data_type("array_set_data_types", sbe_field["encoding_type"],
+                                          sbe_field["data_type"],
+                                          sbe_field["structure"])
+
+
+def generate_xml_schema_from_json_schema(json_handler, xml_handler):
+    number_data_types = json_handler.get_schema_array_iterator("array_number_data_types")
+    for number_data_type in number_data_types:
+        xml_handler.generate_sbe_number_definition(number_data_type["name_type"], number_data_type["data_type"],
+                                                   number_data_type["presence"])
+
+    string_data_types = json_handler.get_schema_array_iterator("array_string_data_types")
+    for string_data_type in string_data_types:
+        xml_handler.generate_sbe_string_definition(string_data_type["name_type"], string_data_type["data_type"],
+                                                   string_data_type["length"],
+                                                   string_data_type["presence"])
+
+    enum_data_types = json_handler.get_schema_array_iterator("array_enum_data_types")
+    for enum_data_type in enum_data_types:
+        xml_handler.generate_sbe_enum_definition(enum_data_type["encoding_type"], enum_data_type["data_type"],
+                                                 enum_data_type["structure"])
+
+    set_data_types = json_handler.get_schema_array_iterator("array_set_data_types")
+    for set_data_type in set_data_types:
+        xml_handler.generate_sbe_set_definition(set_data_type["encoding_type"], set_data_type["data_type"],
+                                                set_data_type["structure"])
+
+    xml_handler.generate_sbe_default_composites()
+
+    document_messages = json_handler.get_schema_array_iterator("array_document_messages")
+    for document_message in document_messages:
+        xml_handler.generate_sbe_message_xml(
+            document_message["message_name"],
+            document_message["template_id"],
+            json_handler.get_message_array_iterator(document_message["message_name"],
+                                                    "array_sbe_fields"),
+            json_handler.get_message_array_iterator(document_message["message_name"],
+                                                    "array_sbe_repeating_groups")
+        )